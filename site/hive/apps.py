@@ -8,8 +8,13 @@ class HiveConfig(AppConfig):
     def ready(self):
         from django.conf import settings
         from .mqtt.moxie_server import create_service_instance, get_instance
+        from .mqtt.moxie_service import service_mode
+        from . import config_cache, stt  # connect the HiveConfiguration change signals
 
         log = logging.getLogger("hive")
+        if service_mode() == "remote":
+            # the moxie_service process owns the MQTT connection
+            return
         try:
             if get_instance() is None:
                 ep = settings.MQTT_ENDPOINT
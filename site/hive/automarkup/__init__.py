@@ -4,6 +4,7 @@ from typing import Dict
 from .ml import mlrules_utils
 from . import markup
 from . import main_cli
+from .engine import AutomarkupEngine
 from ._version import __version__
 
 
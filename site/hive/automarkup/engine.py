@@ -0,0 +1,103 @@
+import random
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Tuple
+
+from .ml import mlrules_utils
+from . import markup
+
+DEFAULT_CACHE_SIZE = 512
+
+
+class AutomarkupEngine:
+    """
+    Long-lived markup engine. Rules and text replacements are loaded once, and results are
+    kept in a bounded LRU cache keyed by (text, mood, intensity), because the same strings
+    (openers, exit lines, global responses, fallbacks) get marked up over and over.
+
+    Markup picks gestures and voice variants at random. With a seed, each input is marked
+    up with its own random.Random seeded from the seed and the input, so the output for an
+    input is the same whether it came from the cache or not, and markups run concurrently.
+    With seed=None the first (random) result for an input is the one that gets cached.
+    """
+
+    def __init__(self, rules=None, text_replacements=None, cache_size: int = DEFAULT_CACHE_SIZE, seed: int = 0):
+        self._rules = rules if rules is not None else mlrules_utils.load_rules()
+        self._text_replacements = text_replacements if text_replacements is not None \
+            else markup.get_internal_text_replacements()
+        self._cache_size = max(0, int(cache_size))
+        self._seed = seed
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def rules(self):
+        return self._rules
+
+    def process(self, input_string: str, mood_and_intensity: Tuple[str, float] = None) -> str:
+        """
+        Markup an unmarked string, using the cached result if there is one.
+
+        input_string (str) - base string to pass in
+        mood_and_intensity (tuple) - two-length tuple for (str, float) to specify mood and normalized intensity
+        """
+        key = self._cache_key(input_string, mood_and_intensity)
+        if key is not None and self._cache_size:
+            with self._lock:
+                result = self._cache.get(key)
+                if result is not None:
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    return result
+                self._misses += 1
+
+        result = self._markup(input_string, mood_and_intensity)
+
+        if key is not None and self._cache_size:
+            with self._lock:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"size": len(self._cache),
+                    "max_size": self._cache_size,
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "hit_rate": self._hits / lookups if lookups else 0.0}
+
+    @staticmethod
+    def _cache_key(input_string, mood_and_intensity):
+        if isinstance(mood_and_intensity, list):
+            mood_and_intensity = tuple(mood_and_intensity)
+        key = (input_string, mood_and_intensity)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _markup(self, input_string, mood_and_intensity):
+        rng = None
+        if self._seed is not None:
+            rng = random.Random(zlib.crc32(f"{self._seed}|{input_string}|{mood_and_intensity}".encode("utf-8")))
+        return markup.markup(input_string,
+                             rules=self._rules,
+                             markVoice=True,
+                             markBehaviors=True,
+                             markMoodAndIntensity=mood_and_intensity,
+                             prettyPrint=False,
+                             text_replacements=self._text_replacements,
+                             debug=False,
+                             rng=rng)
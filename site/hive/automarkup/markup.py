@@ -3,6 +3,7 @@
 
 import logging
 import os
+import random
 import re
 import sys
 from typing import Union, Tuple, Dict
@@ -12,6 +13,7 @@ from unidecode import unidecode
 from .utils import bcolors
 from .markup_core import markup_xmlassembly
 from .markup_core.tagspan import TagSpan
+from .markup_core.span_conflicts import resolve_span_conflicts
 from .markup_types import markup_behavior
 from .markup_types import markup_mood
 from .markup_types import markup_voice
@@ -274,7 +276,8 @@ def markup_sentence(s: str,
                     markup_pauses: float = None,
                     text_replacements: Dict[str, str] = None,
                     lastSentence : bool = False,
-                    debug: bool = False):
+                    debug: bool = False,
+                    rng: random.Random = None):
     
     def replace_string_with_pad(string: str, replace_key: str, replace_value: str) -> str:
         """
@@ -342,12 +345,12 @@ def markup_sentence(s: str,
     # Generate a nested list of rules-per-word
     rulesPerWordDict = {}
     if markVoice:
-        rulesPerWordDict = markup_voice.markup(words, origWords, rules, markVoiceSpecialMarkGenre=markVoiceSpecialMarkGenre, synthRate=synthRate, debug=debug)
+        rulesPerWordDict = markup_voice.markup(words, origWords, rules, markVoiceSpecialMarkGenre=markVoiceSpecialMarkGenre, synthRate=synthRate, debug=debug, rng=rng or random)
 
     # Add behavior markups
     if markBehaviors:
         if debug: print("Adding behaviors markup")
-        behaviorRules = markup_behavior.markup(words, origWords)
+        behaviorRules = markup_behavior.markup(words, origWords, rng=rng or random)
         rulesPerWordDict[markup_behavior.TAG] = behaviorRules
 
     # Add playback-mood markups
@@ -458,12 +461,7 @@ def markup_sentence(s: str,
     ###################################################################################
 
     # Check conflicting SCOPEs and remove those spans until none are left
-    spansPerTagCheck, conflictSomewhere, (worst_offender_conflict_count, worst_offender_tag, worst_offender_span_index) = check_span_conflicts(spansPerTag)
-    while worst_offender_tag != None:
-        if debug:
-            print("[{}] Removing worst offending tag: '{}': {}".format(worst_offender_conflict_count, worst_offender_tag, worst_offender_span_index))
-        spansPerTag = remove_worst_offending_span(spansPerTag, (worst_offender_conflict_count, worst_offender_tag, worst_offender_span_index))
-        spansPerTagCheck, conflictSomewhere, (worst_offender_conflict_count, worst_offender_tag, worst_offender_span_index) = check_span_conflicts(spansPerTag)
+    spansPerTag = resolve_span_conflicts(spansPerTag)
 
     # Sort and queue by scope range and start index
     tagsForInsertStagingList = [ ]
@@ -505,7 +503,8 @@ def markup(s: str,
            prettyPrint: bool = True,
            markup_pauses: float = None,
            text_replacements: Dict[str, str] = None,
-           debug: bool = False) -> str:
+           debug: bool = False,
+           rng: random.Random = None) -> str:
     """
     Main function; proceeds as follows:
         - Look up rules per word
@@ -518,6 +517,7 @@ def markup(s: str,
 
     Args:
         markup_pauses: pause/break time in seconds between sentences. Defaults None.
+        rng: random.Random for gesture and voice variant choices. Defaults to the random module.
     """
 
 
@@ -625,7 +625,8 @@ def markup(s: str,
                                       markup_pauses = markup_pauses,
                                       text_replacements = text_replacements,
                                       lastSentence = True if index == len(sentences)-1 else False,
-                                      debug = debug) 
+                                      debug = debug,
+                                      rng = rng) 
                       for index, sentence in enumerate(sentences))
     
 
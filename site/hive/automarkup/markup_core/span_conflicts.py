@@ -0,0 +1,141 @@
+"""
+Span conflict resolution that scales with long texts.
+
+markup_sentence used to call check_span_conflicts() and remove_worst_offending_span() in a
+loop.  Every check compares all span pairs, so resolving k conflicts costs k * n^2.
+resolve_span_conflicts() finds the conflicting (crossing) pairs once with a sweep over
+start/end indices, then removes worst offenders greedily using a heap of conflict counts.
+It keeps the original choices exactly:
+    - Self-conflicting spans within a tag are pruned from last to first
+    - The worst offender is the span with the most conflicts against other tags, ties go
+      to the earliest tag and then the earliest span
+    - The first pass counts a tag's spans against later tags before those tags are pruned
+"""
+import heapq
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple
+
+from .tagspan import TagSpan
+
+
+def crossing_pairs(spans: List[TagSpan]) -> List[Tuple[int, int]]:
+    """
+    Index pairs (i, j) of spans that cross, the same relation as TagSpan.conflicts():
+    a.start < b.start <= a.end < b.end, where neither span has size 1.
+    """
+    order = sorted((i for i, s in enumerate(spans) if s.size != 1), key=lambda i: spans[i].start_index)
+    pairs = []
+    # spans already started, sorted by end index
+    active_ends: List[int] = []
+    active: List[int] = []
+    pos = 0
+    while pos < len(order):
+        start = spans[order[pos]].start_index
+        group_end = pos
+        while group_end < len(order) and spans[order[group_end]].start_index == start:
+            group_end += 1
+        # drop spans ending before this start, they can't cross anything from here on
+        expired = bisect_left(active_ends, start)
+        del active_ends[:expired]
+        del active[:expired]
+        for b in order[pos:group_end]:
+            # started earlier and ending inside b, but not at b's end
+            hi = bisect_left(active_ends, spans[b].end_index)
+            pairs.extend((a, b) for a in active[:hi])
+        for b in order[pos:group_end]:
+            at = bisect_right(active_ends, spans[b].end_index)
+            active_ends.insert(at, spans[b].end_index)
+            active.insert(at, b)
+        pos = group_end
+    return pairs
+
+
+def _prune_self_conflicts(count: int, pairs: List[Tuple[int, int]]) -> List[bool]:
+    # A span is dropped if it crosses any span before it, or a surviving span after it
+    neighbors: List[List[int]] = [[] for _ in range(count)]
+    for a, b in pairs:
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    removed = [False] * count
+    for i in range(count - 1, -1, -1):
+        removed[i] = any(j < i or not removed[j] for j in neighbors[i])
+    return removed
+
+
+def resolve_span_conflicts(spans_per_tag: Dict[str, List[TagSpan]]) -> Dict[str, List[TagSpan]]:
+    """
+    Remove conflicting spans in place until none are left, with the same result as
+    repeating check_span_conflicts() / remove_worst_offending_span().
+    """
+    tags = list(spans_per_tag.keys())
+    everything: List[TagSpan] = []
+    tag_of: List[int] = []
+    first_index: List[int] = []
+    for t, tag in enumerate(tags):
+        first_index.append(len(everything))
+        everything.extend(spans_per_tag[tag])
+        tag_of.extend([t] * len(spans_per_tag[tag]))
+    first_index.append(len(everything))
+
+    pairs = crossing_pairs(everything)
+    if not pairs:
+        return spans_per_tag
+
+    # Prune self conflicts within each tag, using indexes local to the tag
+    kept = [True] * len(everything)
+    inner: List[List[Tuple[int, int]]] = [[] for _ in tags]
+    for a, b in pairs:
+        if tag_of[a] == tag_of[b]:
+            base = first_index[tag_of[a]]
+            inner[tag_of[a]].append((a - base, b - base))
+    for t in range(len(tags)):
+        if inner[t]:
+            base = first_index[t]
+            for i, removed in enumerate(_prune_self_conflicts(first_index[t + 1] - base, inner[t])):
+                kept[base + i] = not removed
+
+    count = [0] * len(everything)
+    first_count = [0] * len(everything)
+    neighbors: List[List[int]] = [[] for _ in everything]
+    for a, b in pairs:
+        ta, tb = tag_of[a], tag_of[b]
+        if ta == tb:
+            continue
+        # first pass: earlier tags are pruned already, later tags are not yet
+        if kept[b] or tb > ta:
+            first_count[a] += 1
+        if kept[a] or ta > tb:
+            first_count[b] += 1
+        if kept[a] and kept[b]:
+            count[a] += 1
+            count[b] += 1
+            neighbors[a].append(b)
+            neighbors[b].append(a)
+
+    # spans are numbered in (tag, position) order, which is also the tie break
+    alive = {i for i in range(len(everything)) if kept[i]}
+    heap: List[Tuple[int, int]] = []
+
+    def remove(i):
+        alive.discard(i)
+        for j in neighbors[i]:
+            if j in alive:
+                count[j] -= 1
+                heapq.heappush(heap, (-count[j], j))
+
+    first = min(alive, key=lambda i: (-first_count[i], i), default=None)
+    if first is not None and first_count[first] > 0:
+        remove(first)
+        heap = [(-count[i], i) for i in alive if count[i] > 0]
+        heapq.heapify(heap)
+        while heap:
+            neg, i = heapq.heappop(heap)
+            if i not in alive or -neg != count[i]:
+                continue
+            if count[i] == 0:
+                break
+            remove(i)
+
+    for t, tag in enumerate(tags):
+        spans_per_tag[tag][:] = [everything[i] for i in range(first_index[t], first_index[t + 1]) if i in alive]
+    return spans_per_tag
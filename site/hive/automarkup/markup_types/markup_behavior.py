@@ -51,8 +51,8 @@ WORDS_SELF = ["i", "me", "us", "my", "mine", "myself"]
 WORDS_YOUU = ["you", "your"]
 WORDS_HIGH = ["up", "above", "higher", "high", "wow", "great", "fantastic", "wonderful", "amazing", "awesome", "yay", "fun"]
 
-def gesture_change_word_count():
-    return random.randint(GESTURE_CHANGE_WORDS_MIN, GESTURE_CHANGE_WORDS_MAX)
+def gesture_change_word_count(rng=random):
+    return rng.randint(GESTURE_CHANGE_WORDS_MIN, GESTURE_CHANGE_WORDS_MAX)
 
 class MarkupBehavior:
     behavior_name: str = ""
@@ -88,7 +88,7 @@ def CanMarkupFit(markedIndices, index, minDistance, hasPunctuation: bool = False
     
     return False
 
-def get_behaviors_from_str(words: List[str], orig_words: List[str], outRules: List[MarkupBehavior]):
+def get_behaviors_from_str(words: List[str], orig_words: List[str], outRules: List[MarkupBehavior], rng=random):
     logging.debug("Adding behavior markup using default method")
 
     # Bool-dict per word to see which words might have gestures correlating with them
@@ -101,7 +101,7 @@ def get_behaviors_from_str(words: List[str], orig_words: List[str], outRules: Li
     b_dict[GESTURE_TALK] = []
     b_dict[GESTURE_NONE] = []
     lastGestureIndex = 0
-    gestureChangeWordCount = gesture_change_word_count()
+    gestureChangeWordCount = gesture_change_word_count(rng)
     logging.debug("Will change words at {} words".format(gestureChangeWordCount))
     multiSentence = False
     i = 0
@@ -116,16 +116,16 @@ def get_behaviors_from_str(words: List[str], orig_words: List[str], outRules: Li
         origWord = orig_words[i]
         b_dict[GESTURE_QSTN].append(word in WORDS_QUESTION or "?" in origWord)
         b_dict[GESTURE_TALK_PRIORITY].append(lastWordHasPeriod or i == 0)
-        b_dict[GESTURE_SELF].append(word in WORDS_SELF and random.random() <= GESTURE_PROBABILITY)
-        b_dict[GESTURE_YOU].append(word in WORDS_YOUU and random.random() <= GESTURE_PROBABILITY)
-        b_dict[GESTURE_HIGH].append(word in WORDS_HIGH and random.random() <= GESTURE_PROBABILITY)
+        b_dict[GESTURE_SELF].append(word in WORDS_SELF and rng.random() <= GESTURE_PROBABILITY)
+        b_dict[GESTURE_YOU].append(word in WORDS_YOUU and rng.random() <= GESTURE_PROBABILITY)
+        b_dict[GESTURE_HIGH].append(word in WORDS_HIGH and rng.random() <= GESTURE_PROBABILITY)
         b_dict[GESTURE_NONE].append(False)
 
         # Talk gestures are on a number-of-words basis
         doTalkGesture = False
         if (i - lastGestureIndex) >= gestureChangeWordCount:
             doTalkGesture = True
-            gestureChangeWordCount = gesture_change_word_count()
+            gestureChangeWordCount = gesture_change_word_count(rng)
             logging.debug("Next word will be {} words later (at index {})".format(gestureChangeWordCount, i + gestureChangeWordCount))
             lastGestureIndex = i
         b_dict[GESTURE_TALK].append(doTalkGesture)
@@ -228,7 +228,7 @@ def get_behaviors_from_str(words: List[str], orig_words: List[str], outRules: Li
 
     return outRulesShifted
 
-def markup(words: List[str], orig_words: List[str]):
+def markup(words: List[str], orig_words: List[str], rng=random):
     """
     Markup gestural behaviors on the provided list of words. Returns a list of rules the same size
     as the list of words.
@@ -247,4 +247,4 @@ def markup(words: List[str], orig_words: List[str]):
     outRules[0] = MarkupBehavior(GESTURE_TALK).json()
     outRules[-1] = MarkupBehavior(GESTURE_NONE).json()
 
-    return get_behaviors_from_str(words, orig_words, outRules)
+    return get_behaviors_from_str(words, orig_words, outRules, rng)
@@ -27,7 +27,7 @@ def vocal_variant(genre: str, variant: int = 0, specialMark: bool = False) -> st
 
 
 def markup(words: List[str], orig_words: List[str], rules: dict, markVoiceSpecialMarkGenre: bool = True, 
-           synthRate: float = mlparams.SYNTH_RATE_DEFAULT, debug=False):
+           synthRate: float = mlparams.SYNTH_RATE_DEFAULT, debug=False, rng=random):
     """
     Generate a nested list of rules-per-word
 
@@ -59,47 +59,32 @@ def markup(words: List[str], orig_words: List[str], rules: dict, markVoiceSpecia
         lastUselRule = None
         for w in words:
             wordRule = None
-            if w in tagRules.keys():
+            rule_list = tagRules.get(w)
+            if rule_list:
                 # TODO: Mechanism to CHOOSE a rule. For now default to the first one
-                wordRule = tagRules[w][0].associated_str
+                rule = rule_list[0]
+                wordRule = rule.markup_str
 
                 # This is where some higher-level rules are applied, based on observed style
                 # Check usel variants and clamping
                 if isUselTag:
-                    e = mlrules_utils.deserialize_element(wordRule)
-                    varAttrib = int(e.attrib["variant"])
-                    logging.debug("    word={}, tag={}, variant={}".format(w, mlrules_utils.clean_dict_key_str(mlparams.TAG_USEL), varAttrib))
-                    if varAttrib > CLAMP_MAX_USEL_VARIANT:
-                        newVarAttrib = random.randint(0, CLAMP_MAX_USEL_VARIANT)
-                        e.attrib["variant"] = str(newVarAttrib)
-                        logging.debug("        Variant ({}) larger than max-constrained-value per this script of {}. Variant now set to {}".format(varAttrib, CLAMP_MAX_USEL_VARIANT, newVarAttrib))
-                        wordRule = mlrules_utils.serialize_element(e)
-
-                    if lastUselRule is not None and lastUselRule["genre"] == e.attrib["genre"]:
-                        e.attrib["variant"] = lastUselRule["variant"]
-                        logging.debug("        Modifying usel variant to match last word's rule ({}), to reduce choppiness ".format(e.attrib["variant"]))
-                        wordRule = mlrules_utils.serialize_element(e)
-
-                    lastUselRule = e.attrib
+                    variant = rule.variant
+                    logging.debug("    word=%s, tag=%s, variant=%s", w, tag, variant)
+                    if rule.needs_clamp:
+                        variant = str(rng.randint(0, CLAMP_MAX_USEL_VARIANT))
+                        wordRule = rule.with_variant(variant)
+                        logging.debug("        Variant ({}) larger than max-constrained-value per this script of {}. Variant now set to {}".format(rule.variant, CLAMP_MAX_USEL_VARIANT, variant))
+
+                    if lastUselRule is not None and lastUselRule[0] == rule.genre:
+                        variant = lastUselRule[1]
+                        wordRule = rule.with_variant(variant)
+                        logging.debug("        Modifying usel variant to match last word's rule ({}), to reduce choppiness ".format(variant))
+
+                    lastUselRule = (rule.genre, variant)
                 else:
                     lastUselRule = None
-                
-                # Check prosody playback speed, clamp very-fast/slow speeds
-                if isProsodyTag:
-                    e = mlrules_utils.deserialize_element(wordRule)
-                    rateAttrib = e.attrib["rate"]
-                    volAttrib = e.attrib["volume"]
-                    logging.debug("    word={}, tag={}, rate={}, volume={}".format(w, mlrules_utils.clean_dict_key_str(mlparams.TAG_PROSODY), rateAttrib, volAttrib))
-
-                    if rateAttrib == "x-slow":
-                        e.attrib["rate"] = "slow"
-                        wordRule = mlrules_utils.serialize_element(e)
-                        logging.debug("        Rate is 'x-slow', clamping to 'slow'")
-
-                    if volAttrib != "medium":
-                        e.attrib["volume"] = "medium"
-                        wordRule = mlrules_utils.serialize_element(e)
-                        logging.debug("        Rate is '{}', clamping to 'slow'".format(volAttrib))
+
+                # Prosody playback speed is clamped when the rules are loaded (very-fast/slow speeds, volume)
 
             tagRulesApplied.append(wordRule)
         rulesPerWordDict[tag] = tagRulesApplied
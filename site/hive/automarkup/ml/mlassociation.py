@@ -1,5 +1,7 @@
 """Basic class structure for defining apyori association parameters."""
 
+import json
+import xml.etree.ElementTree as ET
 from json import JSONEncoder
 
 
@@ -19,3 +21,50 @@ class Rule:
 class RuleEncoder(JSONEncoder):
     def default(self, o):
         return o.__dict__
+
+
+class CompiledRule:
+    """
+    A Rule prepared for markup at load time. The associated_str JSON is parsed once into
+    tag and attrib, usel variants know whether they need clamping, and prosody rules carry
+    their clamped markup string. Compiled rules are held by the rules tables, so slots keep
+    them small.
+    """
+    __slots__ = ("associated_str", "support", "confidence", "lift", "tag", "attrib",
+                 "genre", "variant", "needs_clamp", "markup_str", "_variants")
+
+    def __init__(self, associated_str: str, support: float, confidence: float, lift: float,
+                 tag: str, attrib: dict, genre: str = None, variant: str = None,
+                 needs_clamp: bool = False, markup_str: str = None):
+        self.associated_str = associated_str
+        self.support = support
+        self.confidence = confidence
+        self.lift = lift
+        self.tag = tag
+        self.attrib = attrib
+        self.genre = genre
+        self.variant = variant
+        self.needs_clamp = needs_clamp
+        # string to use when the rule applies as-is (prosody rules are pre-clamped)
+        self.markup_str = markup_str if markup_str is not None else associated_str
+        self._variants = {}
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__ if k != "_variants"}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        self._variants = {}
+
+    def with_variant(self, variant: str) -> str:
+        """Serialized markup for this rule with a different variant attribute"""
+        s = self._variants.get(variant)
+        if s is None:
+            # mlrules_utils imports this module, so import it when first needed
+            from . import mlrules_utils
+            attrib = dict(self.attrib)
+            attrib["variant"] = variant
+            s = mlrules_utils.serialize_element(ET.Element(self.tag, attrib))
+            self._variants[variant] = s
+        return s
@@ -16,12 +16,13 @@ from . import mlparams
 from . import mlrules_utils
 
 
-def generate_rules() -> Dict[str, Dict[str, List[mlassociation.Rule]]]:
+def generate_rules() -> Dict[str, Dict[str, List[mlassociation.CompiledRule]]]:
     rules = generate()
     f = open(mlparams.ML_DATA_PATH, "w")
     f.write(json.dumps(rules, indent=4, cls=mlassociation.RuleEncoder))
     f.close()
-    return rules
+    # reload so the new rules are compiled for markup (and the stale cache is replaced)
+    return mlrules_utils.load_rules()
 
 
 def check_and_clean_text(element) -> Union[str, None]:
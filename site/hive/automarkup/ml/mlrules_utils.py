@@ -1,7 +1,9 @@
 """Utility class to mlrules.py for data serialization."""
 
 import json
+import logging
 import os
+import pickle
 import re
 import sys
 import xml.etree.ElementTree as ET
@@ -11,10 +13,21 @@ from . import mlassociation
 from . import mlparams
 
 
-def load_rules() -> Dict[str, Dict[str, List[mlassociation.Rule]]]:
+def load_rules(use_cache: bool = True) -> Dict[str, Dict[str, List[mlassociation.CompiledRule]]]:
+    """
+    Load the rules table with every rule compiled for markup. The compiled table is pickled
+    next to the data file, and used while it is newer than the data file, to skip the JSON
+    parse at startup.
+    """
     data_path = mlparams.ML_DATA_PATH
     if not os.path.exists(mlparams.ML_DATA_PATH):
         data_path = mlparams.ML_DATA_EXE_PATH
+    cache_path = os.path.splitext(data_path)[0] + RULES_CACHE_EXT
+
+    if use_cache:
+        rules = _load_rules_cache(cache_path, data_path)
+        if rules is not None:
+            return rules
 
     f = open(data_path, "r")
     rules = json.loads(f.read())
@@ -25,10 +38,75 @@ def load_rules() -> Dict[str, Dict[str, List[mlassociation.Rule]]]:
             json_list = rules[key][ikey]
             rules[key][ikey] = []
             for j in json_list:
-                rules[key][ikey].append(mlassociation.Rule(**j))
+                rules[key][ikey].append(compile_rule(key, mlassociation.Rule(**j)))
+
+    if use_cache:
+        _save_rules_cache(cache_path, rules)
     return rules
 
 
+RULES_CACHE_EXT = ".pickle"
+# Bump when CompiledRule or compile_rule() changes, so stale caches are rebuilt
+RULES_CACHE_VERSION = 1
+
+
+def compile_rule(tag: str, rule: mlassociation.Rule) -> mlassociation.CompiledRule:
+    """Parse a rule's associated_str once, and apply the usel and prosody clamping that doesn't vary"""
+    e = deserialize_element(rule.associated_str)
+    attrib = dict(e.attrib)
+    compiled = mlassociation.CompiledRule(rule.associated_str, rule.support, rule.confidence, rule.lift,
+                                          tag=e.tag, attrib=attrib)
+    if tag == clean_dict_key_str(mlparams.TAG_USEL) and "variant" in attrib:
+        compiled.genre = attrib.get("genre")
+        compiled.variant = attrib["variant"]
+        compiled.needs_clamp = int(attrib["variant"]) > mlparams.CLAMP_MAX_USEL_VARIANT
+    elif tag == clean_dict_key_str(mlparams.TAG_PROSODY):
+        changed = False
+        if attrib.get("rate") == "x-slow":
+            attrib["rate"] = "slow"
+            changed = True
+        if "volume" in attrib and attrib["volume"] != "medium":
+            attrib["volume"] = "medium"
+            changed = True
+        if changed:
+            compiled.markup_str = serialize_element(_element(e.tag, attrib))
+    return compiled
+
+
+def _element(tag: str, attrib: dict) -> ET.Element:
+    e = ET.Element(tag)
+    e.attrib = attrib
+    return e
+
+
+def _load_rules_cache(cache_path: str, data_path: str):
+    try:
+        if os.path.getmtime(cache_path) < os.path.getmtime(data_path):
+            return None
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") != RULES_CACHE_VERSION:
+            return None
+        return cached["rules"]
+    except Exception:
+        return None
+
+
+def _save_rules_cache(cache_path: str, rules):
+    # write then rename, so a concurrent load never sees a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": RULES_CACHE_VERSION, "rules": rules}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logging.info(f"Could not write rules cache {cache_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
 def serialize_element(element: ET.Element) -> str:
     """
     Serializes a TreeElement and returns json-string
@@ -0,0 +1,64 @@
+# site/hive/config_cache.py
+'''
+Process-wide snapshot of the 'default' HiveConfiguration.
+
+Config pushes, STT and the QR codes all need the system configuration, and each used to query it.
+The snapshot is loaded on first use and kept until a HiveConfiguration is saved or deleted in this
+process, or refresh_hive_config() is called (update_from_database does, which is how the moxie
+service hears about changes saved by web workers).  Every change bumps a version number, so
+anything derived from the configuration can be cached against it.  Treat the record as read-only.
+'''
+import logging
+import threading
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import HiveConfiguration
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_config = None
+_loaded = False
+_version = 0
+_stats = { "hits": 0, "loads": 0, "invalidations": 0 }
+
+def hive_config_snapshot():
+    """Returns (HiveConfiguration or None, version), loading it on first use after a change."""
+    with _lock:
+        if _loaded:
+            _stats["hits"] += 1
+            return _config, _version
+        version = _version
+    cfg = HiveConfiguration.objects.filter(name='default').first()
+    return _store(cfg, version)
+
+def get_hive_config():
+    """The 'default' HiveConfiguration, or None before setup has been saved."""
+    return hive_config_snapshot()[0]
+
+def refresh_hive_config(hive_config=None):
+    """Forget the snapshot, or replace it with a HiveConfiguration already loaded."""
+    global _config, _loaded, _version
+    with _lock:
+        _version += 1
+        _stats["invalidations"] += 1
+        _config, _loaded = hive_config, hive_config is not None
+
+def config_cache_metrics():
+    with _lock:
+        return dict(version=_version, **_stats)
+
+def _store(cfg, version):
+    global _config, _loaded
+    with _lock:
+        _stats["loads"] += 1
+        # a change saved while we were reading wins, the next caller loads again
+        if version == _version:
+            _config, _loaded = cfg, True
+        return cfg, version
+
+@receiver(post_save, sender=HiveConfiguration)
+@receiver(post_delete, sender=HiveConfiguration)
+def _hive_config_changed(sender, instance, **kwargs):
+    if instance.name == 'default':
+        refresh_hive_config()
@@ -0,0 +1,75 @@
+# bench_globals.py
+import random
+import time
+from django.core.management.base import BaseCommand
+from ...models import GlobalResponse, GlobalAction
+from ...mqtt.global_responses import GlobalResponses, ActionPattern
+from ...mqtt.volley import Volley
+
+_WORDS = [ "time", "weather", "joke", "dance", "story", "song", "game", "riddle", "fact", "color",
+           "animal", "planet", "number", "friend", "music", "book", "picture", "breathe", "sleep", "hello" ]
+
+_SPEECH = [ "i went to the park today and saw a dog",
+            "can we talk about dinosaurs",
+            "moxie what time is it",
+            "i don't know",
+            "tell me something funny please",
+            "my favorite color is blue",
+            "moxie tell me a joke",
+            "yes" ]
+
+class Command(BaseCommand):
+    help = 'Benchmark global response matching, combined matcher vs the linear scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', default='10,100,500,2000', help='Comma separated pattern counts')
+        parser.add_argument('--iterations', type=int, default=2000, help='Lookups per measurement')
+
+    def make_patterns(self, count):
+        rng = random.Random(count)
+        patterns = []
+        samples = []
+        for i in range(count):
+            word = f'{rng.choice(_WORDS)}{i}'
+            shape = i % 4
+            if shape == 0:
+                regex = f'^(moxie|moxy) {word}$'
+                sample = f'moxy {word}'
+            elif shape == 1:
+                regex = f'^(moxie|moxy) (tell me|say) (a|an|the) {word}'
+                sample = f'moxie tell me a {word}'
+            elif shape == 2:
+                regex = f'^let\'s (play|do) {word}'
+                sample = f'let\'s play {word} now'
+            else:
+                regex = f'.*{word} please$'
+                sample = f'can we do {word} please'
+            gr = GlobalResponse(name=f'bench{i}', pattern=regex, action=GlobalAction.RESPONSE.value,
+                                response_text='ok', sort_key=count - i)
+            patterns.append(ActionPattern(gr))
+            samples.append(sample)
+        return patterns, samples
+
+    def measure(self, check, volleys, iterations):
+        start = time.perf_counter()
+        for i in range(iterations):
+            check(volleys[i % len(volleys)])
+        return (time.perf_counter() - start) / iterations * 1_000_000
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'{"patterns":>9} {"linear us":>10} {"matcher us":>11} {"speedup":>8}')
+        for count in [int(c) for c in options['counts'].split(',') if c]:
+            responses = GlobalResponses()
+            patterns, samples = self.make_patterns(count)
+            responses.set_patterns(patterns)
+            # add a line matching the last (lowest priority) pattern, the worst case for a scan
+            volleys = [ Volley.request_from_speech(s) for s in _SPEECH + samples[-1:] ]
+            for v in volleys:
+                linear = responses.check_global_linear(v)
+                combined = responses.check_global(v)
+                if (linear is None) != (combined is None) or (linear and linear.func.__self__ is not combined.func.__self__):
+                    self.stderr.write(f'Mismatch for "{v.request["speech"]}"')
+            linear_us = self.measure(responses.check_global_linear, volleys, iterations)
+            matcher_us = self.measure(responses.check_global, volleys, iterations)
+            self.stdout.write(f'{count:>9} {linear_us:>10.1f} {matcher_us:>11.1f} {linear_us / matcher_us:>7.1f}x')
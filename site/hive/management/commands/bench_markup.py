@@ -0,0 +1,110 @@
+# bench_markup.py
+import copy
+import json
+import os
+import time
+from django.core.management.base import BaseCommand
+from ...automarkup import AutomarkupEngine
+from ...automarkup import markup
+from ...automarkup.markup_core.span_conflicts import resolve_span_conflicts
+from ...automarkup.markup_core.tagspan import TagSpan
+from ...automarkup.ml import mlparams
+
+GOLDEN_PATH = os.path.join(os.path.dirname(mlparams.ML_DATA_EXE_PATH), "markup_golden.json")
+
+_SENTENCES = [ "Hi there!  Welcome to Open Moxie chat!",
+               "I'm sorry. Can you repeat that?",
+               "Well, that was fun.  Let's move on.",
+               "Do you know what my favorite animal is? It's the octopus, because it has eight arms and a really big brain!",
+               "I need to store my conversations in different parts of my \"brain\" depending on how old the person I'm talking to is. If I don't my circuits might get scrambled.",
+               "Wow, that sounds amazing! Tell me more about your trip to the beach.",
+               "Let's take a deep breath together. In through the nose, and out through the mouth.",
+               "Dinosaurs lived millions of years ago, long before people. Some were as big as a bus, and some were as small as a chicken.",
+               "It's okay to feel sad sometimes. Everyone does, even robots like me.",
+               "What do you call a bear with no teeth? A gummy bear!",
+               "My mission is to learn how to be a good friend. Can you help me practice?",
+               "Yes",
+               "The sun is a star, and it is about 93 million miles away from Earth. That's really, really far!" ]
+
+_MOODS = [ None, ("happy", 0.5), ("sad", 0.3), ("excited", 1.0) ]
+
+# The original resolver, one full conflict check per removed span
+def resolve_span_conflicts_linear(spans_per_tag):
+    _, _, worst = markup.check_span_conflicts(spans_per_tag)
+    while worst[1] is not None:
+        spans_per_tag = markup.remove_worst_offending_span(spans_per_tag, worst)
+        _, _, worst = markup.check_span_conflicts(spans_per_tag)
+    return spans_per_tag
+
+def golden_inputs():
+    inputs = [ (s, m) for s in _SENTENCES for m in _MOODS[:2] ]
+    # long replies, the way LLMs run on
+    for count in (4, 8, len(_SENTENCES)):
+        inputs.append((" ".join(_SENTENCES[:count]), _MOODS[count % len(_MOODS)]))
+    return inputs
+
+class Command(BaseCommand):
+    help = 'Check automarkup against the golden corpus and benchmark span conflict resolution.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--write-golden', action='store_true', help='Regenerate the golden corpus from the current markup')
+        parser.add_argument('--words', default='10,50,100,200,400', help='Comma separated sentence lengths in words')
+        parser.add_argument('--iterations', type=int, default=5, help='Runs per measurement')
+
+    def handle(self, *args, **options):
+        engine = AutomarkupEngine(cache_size=0, seed=0)
+        if options['write_golden']:
+            corpus = [ { "text": t, "mood": m, "markup": engine.process(t, m) } for t, m in golden_inputs() ]
+            with open(GOLDEN_PATH, "w") as f:
+                json.dump(corpus, f, indent=1)
+            self.stdout.write(f'Wrote {len(corpus)} golden entries to {GOLDEN_PATH}')
+            return
+        self.check_golden(engine)
+        self.bench(options)
+
+    def check_golden(self, engine):
+        with open(GOLDEN_PATH) as f:
+            corpus = json.load(f)
+        failed = 0
+        for rec in corpus:
+            result = engine.process(rec["text"], tuple(rec["mood"]) if rec["mood"] else None)
+            if result != rec["markup"]:
+                failed += 1
+                self.stderr.write(f'Golden mismatch for "{rec["text"][:60]}"')
+        self.stdout.write(f'Golden corpus: {len(corpus) - failed}/{len(corpus)} match')
+
+    def make_spans(self, words):
+        # back to back runs in each tag, offset per tag so spans cross the other tags' spans
+        spans_per_tag = {}
+        for t, tag in enumerate(mlparams.TAGS):
+            spans = []
+            i = t
+            while i + 1 < words:
+                length = 3 + (i + t) % 3
+                spans.append(TagSpan(f'{tag}{i % 3}', i, min(words - 1, i + length - 1)))
+                i += length
+            spans_per_tag[tag] = spans
+        return spans_per_tag
+
+    def measure(self, resolve, spans_per_tag, iterations):
+        total = 0.0
+        for _ in range(iterations):
+            spans = copy.deepcopy(spans_per_tag)
+            start = time.perf_counter()
+            resolve(spans)
+            total += time.perf_counter() - start
+        return total / iterations * 1000, spans
+
+    def bench(self, options):
+        iterations = options['iterations']
+        self.stdout.write(f'{"words":>6} {"spans":>6} {"linear ms":>10} {"sweep ms":>9} {"speedup":>8}')
+        for words in [int(w) for w in options['words'].split(',') if w]:
+            spans_per_tag = self.make_spans(words)
+            linear_ms, linear = self.measure(resolve_span_conflicts_linear, spans_per_tag, iterations)
+            sweep_ms, sweep = self.measure(resolve_span_conflicts, spans_per_tag, iterations)
+            same = { t: [ (s.start_index, s.end_index) for s in v ] for t, v in linear.items() } == \
+                   { t: [ (s.start_index, s.end_index) for s in v ] for t, v in sweep.items() }
+            if not same:
+                self.stderr.write(f'Resolved spans differ for {words} words')
+            count = sum(len(v) for v in spans_per_tag.values())
+            self.stdout.write(f'{words:>6} {count:>6} {linear_ms:>10.2f} {sweep_ms:>9.2f} {linear_ms / max(sweep_ms, 1e-9):>7.1f}x')
@@ -0,0 +1,30 @@
+# moxie_service.py
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...mqtt.moxie_server import create_service_instance, get_instance, cleanup_instance
+from ...mqtt.moxie_service import MoxieServiceHost
+
+class Command(BaseCommand):
+    help = ('Run the Moxie MQTT service in this process, and serve web workers started with '
+            'MOXIE_SERVICE_MODE=remote over MOXIE_SERVICE_ADDR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-interval', type=float, default=60.0, help='Seconds between metrics logs')
+
+    def handle(self, *args, **options):
+        ep = settings.MQTT_ENDPOINT
+        server = get_instance() or create_service_instance(ep['project'], ep['host'], ep['port'], ep.get('cert_required', True))
+        host = MoxieServiceHost(server)
+        host.start()
+        self.stdout.write('Moxie service running.')
+        try:
+            while True:
+                time.sleep(options['metrics_interval'])
+                server.print_metrics()
+                self.stdout.write(f'Service IPC: {host.metrics()}')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            host.close()
+            cleanup_instance()
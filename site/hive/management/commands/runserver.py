@@ -4,10 +4,14 @@ from django.core.management import call_command
 from django.conf import settings
 import threading
 from hive.mqtt.moxie_server import create_service_instance, cleanup_instance
+from hive.mqtt.moxie_service import service_mode
 
 class Command(RunserverCommand):
     _run_enabled = True
     def handle(self, *args, **options):
+        if service_mode() == "remote":
+            # MQTT runs in the moxie_service process
+            return super().handle(*args, **options)
         thread = threading.Thread(target=self.deamon_worker)
         thread.daemon = True  # Set as daemon thread so it exits when main thread exits
         thread.start()
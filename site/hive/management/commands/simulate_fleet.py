@@ -0,0 +1,89 @@
+# simulate_fleet.py
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...models import MoxieDevice
+from ...mqtt import fleet_sim
+from ...mqtt.moxie_server import MoxieServer, get_instance, _STT_PROTO
+from ...mqtt.robot_credentials import RobotCredentials
+from ...mqtt.robot_data import RobotData
+from ...mqtt.zmq_stt_handler import STTHandler
+
+DEFAULT_WAV = os.path.join(settings.BASE_DIR, "services", "test01_20s.wav")
+
+class Command(BaseCommand):
+    help = ('Load test MoxieServer with a fleet of virtual Moxies, in-process by default or through an MQTT broker. '
+            'Simulated devices are created in the configured database and removed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--robots', type=int, default=10, help='Number of virtual robots')
+        parser.add_argument('--duration', type=float, default=60.0, help='Seconds to run after the last robot starts')
+        parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which robots connect')
+        parser.add_argument('--turns', type=int, default=3, help='Conversation turns per robot session')
+        parser.add_argument('--think', type=float, default=1.0, help='Mean think time between robot actions, seconds')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds a robot waits for a reply')
+        parser.add_argument('--module', default=None, help='Remote chat MODULE/CONTENT to talk to (default: router auto-map)')
+        parser.add_argument('--wav', default=DEFAULT_WAV, help='16kHz WAV fixture for zmqSTT audio')
+        parser.add_argument('--utterance', type=float, default=2.0, help='Seconds of audio per utterance, 0 to skip STT')
+        parser.add_argument('--broker', default=None, help='HOST:PORT of an MQTT broker, instead of the in-process fake broker')
+        parser.add_argument('--no-tls', action='store_true', help='Connect robots to the broker without TLS')
+        parser.add_argument('--no-stubs', action='store_true', help='Use the configured LLM and STT backends')
+        parser.add_argument('--llm-latency', type=float, default=0.5, help='Stub LLM reply time, seconds')
+        parser.add_argument('--stt-latency', type=float, default=0.2, help='Stub STT fixed time, seconds')
+        parser.add_argument('--stt-rtf', type=float, default=0.1, help='Stub STT time per second of audio')
+        parser.add_argument('--keep-devices', action='store_true', help='Leave the simulated devices in the database')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for robot behavior')
+
+    def handle(self, *args, **options):
+        audio = fleet_sim.load_utterance(options['wav'], options['utterance']) if options['utterance'] > 0 else None
+        if not options['no_stubs']:
+            fleet_sim.install_stub_backends(options['llm_latency'], options['stt_latency'], options['stt_rtf'])
+
+        broker = None
+        if options['broker']:
+            # The server singleton started with Django serves the fleet, stop other servers on that broker first
+            server = get_instance()
+            if server is None:
+                raise CommandError('No Moxie server running in this process, check MQTT_HOST/MQTT_PORT')
+            host, _, port = options['broker'].rpartition(':')
+            transport = fleet_sim.MqttTransport(host, int(port), use_tls=not options['no_tls'])
+        else:
+            server = MoxieServer(RobotCredentials(True), RobotData(), "openmoxie", "localhost", 0, cert_required=False)
+            server.add_zmq_handler(_STT_PROTO, STTHandler(server))
+            broker = fleet_sim.FakeBroker()
+            broker.attach(server)
+            transport = broker
+
+        module_id, _, content_id = (options['module'] or '').partition('/')
+        sim = fleet_sim.FleetSimulator(transport, robots=options['robots'], duration=options['duration'],
+                                       ramp=options['ramp'], audio=audio, seed=options['seed'],
+                                       module_id=module_id or None, content_id=content_id or None,
+                                       turns=options['turns'], think=options['think'], timeout=options['timeout'])
+        self.stdout.write(f'Running {options["robots"]} robots for {options["duration"]}s '
+                          f'({"broker " + options["broker"] if broker is None else "in-process"})...')
+        elapsed = sim.run()
+
+        self.stdout.write(f'{"event":<24} {"sent":>7} {"replies":>7} {"timeout":>7} {"per sec":>8} '
+                          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        for r in sim.recorder.report(elapsed):
+            self.stdout.write(f'{r["event"]:<24} {r["sent"]:>7} {r["replies"]:>7} {r["timeouts"]:>7} {r["per_sec"]:>8.2f} '
+                              f'{r["p50"]:>8.1f} {r["p95"]:>8.1f} {r["p99"]:>8.1f} {r["max"]:>8.1f}')
+        self.stdout.write(f'Server workers: {server.worker_metrics()}')
+        stt_handler = server._zmq_handlers.get(_STT_PROTO)
+        if stt_handler:
+            self.stdout.write(f'STT sessions: {stt_handler.metrics()}')
+        self.stdout.write(f'Delayed tasks: {server._delayed.metrics()}')
+        self.stdout.write(f'Transport: {transport.metrics()}')
+
+        if broker:
+            broker.stop()
+            server._delayed.shutdown()
+            server._worker_queue.shutdown(wait=True)
+            server._robot_data.shutdown()
+            if stt_handler:
+                stt_handler.shutdown()
+        if not options['keep_devices']:
+            ids = [ robot.device_id for robot in sim.robots ]
+            # the total includes cascaded rows, report just the devices
+            _, deleted = MoxieDevice.objects.filter(device_id__in=ids).delete()
+            self.stdout.write(f'Removed {deleted.get(MoxieDevice._meta.label, 0)} simulated device records')
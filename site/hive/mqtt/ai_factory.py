@@ -1,5 +1,6 @@
 from openai import OpenAI
 import logging
+import threading
 import ollama
 from typing import List, Dict, Any, Generator, Union
 from django.conf import settings
@@ -17,21 +18,56 @@ logger = logging.getLogger(__name__)
 _OPENAPI_KEY=None
 _XAI_API_KEY = None  # <— NEW
 
+# Providers (and their HTTP connection pools) are reused across volleys, keyed by
+# (vendor, model, host, api key).  Entries for a vendor are dropped when its key changes.
+_PROVIDER_LOCK = threading.Lock()
+_PROVIDER_CACHE = {}
+_PROVIDER_STATS = {"hits": 0, "misses": 0, "invalidations": 0}
+_OPENAI_CLIENT = None
+
 def set_openai_key(key):
-    global _OPENAPI_KEY
-    _OPENAPI_KEY = key
+    global _OPENAPI_KEY, _OPENAI_CLIENT
+    # swap the key and drop clients built with the old one together, so none built in between survive
+    with _PROVIDER_LOCK:
+        if key != _OPENAPI_KEY:
+            _OPENAPI_KEY = key
+            _OPENAI_CLIENT = None
+            _drop_providers_locked(AIVendor.OPEN_AI)
 
 
 def set_xai_key(key):  # <— NEW
     global _XAI_API_KEY
-    _XAI_API_KEY = key
+    with _PROVIDER_LOCK:
+        if key != _XAI_API_KEY:
+            _XAI_API_KEY = key
+            _drop_providers_locked(AIVendor.XAI)
+
+
+def invalidate_providers(vendor: AIVendor = None):
+    """Drop cached providers for one vendor, or all of them."""
+    with _PROVIDER_LOCK:
+        _drop_providers_locked(vendor)
+
 
+def _drop_providers_locked(vendor):
+    for k in [k for k in _PROVIDER_CACHE if vendor is None or k[0] == vendor]:
+        del _PROVIDER_CACHE[k]
+        _PROVIDER_STATS["invalidations"] += 1
+
+
+def provider_cache_stats():
+    """Hit/miss counters and size of the provider registry."""
+    with _PROVIDER_LOCK:
+        return dict(_PROVIDER_STATS, size=len(_PROVIDER_CACHE))
 
 
 def create_openai():
-    """Used by Whisper/STT and any legacy OpenAI chat paths."""
-    global _OPENAPI_KEY
-    return OpenAI(api_key=_OPENAPI_KEY)
+    """Used by Whisper/STT and any legacy OpenAI chat paths.  Shares one client per key."""
+    global _OPENAI_CLIENT
+    with _PROVIDER_LOCK:
+        if _OPENAI_CLIENT is None:
+            _OPENAI_CLIENT = OpenAI(api_key=_OPENAPI_KEY)
+        return _OPENAI_CLIENT
 
 
 
@@ -73,7 +109,19 @@ class OpenAIProvider(LLMProvider):
 
     def chat(self, messages, temperature=0.7, stream=False, **kwargs):
         max_tokens = kwargs.get("max_tokens")
-        # (streaming optional later; keep behavior identical to current non-stream)
+        if stream:
+            def gen():
+                for chunk in self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                ):
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            return gen()
         resp = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
@@ -211,7 +259,7 @@ class OllamaProvider(LLMProvider):
 
 def get_llm_provider_from_vendor(vendor: AIVendor, model: str) -> LLMProvider:
     """
-    Create a chat provider based on DB-selected vendor enum.
+    Get a chat provider based on DB-selected vendor enum, reusing a cached one when possible.
     - vendor: AIVendor.OPEN_AI or AIVendor.OLLAMA
     - model: model name stored with the chat (e.g., "gpt-4o-mini" or "llama3")
     """
@@ -221,14 +269,26 @@ def get_llm_provider_from_vendor(vendor: AIVendor, model: str) -> LLMProvider:
 
     if vendor == AIVendor.OLLAMA:
         host = getattr(settings, "OLLAMA_HOST", "http://127.0.0.1:11434")
-        fallback = getattr(settings, "OLLAMA_MODEL", "llama3")
-        return OllamaProvider(host=host, model=(model or fallback))
-
-    if vendor == AIVendor.XAI:
-        fallback = getattr(settings, "XAI_MODEL", "grok-3-mini")
-        return XAIProvider(model=(model or fallback))
-
-
-    # default OPEN_AI
-    fallback = getattr(settings, "OPENAI_MODEL", "gpt-3.5-turbo")
-    return OpenAIProvider(model=(model or fallback))
\ No newline at end of file
+        model = model or getattr(settings, "OLLAMA_MODEL", "llama3")
+        key = (vendor, model, host, None)
+        factory = lambda: OllamaProvider(host=host, model=model)
+    elif vendor == AIVendor.XAI:
+        model = model or getattr(settings, "XAI_MODEL", "grok-3-mini")
+        key = (vendor, model, getattr(settings, "XAI_BASE_URL", None), _XAI_API_KEY)
+        factory = lambda: XAIProvider(model=model)
+    else:
+        # default OPEN_AI
+        model = model or getattr(settings, "OPENAI_MODEL", "gpt-3.5-turbo")
+        key = (vendor, model, None, _OPENAPI_KEY)
+        factory = lambda: OpenAIProvider(model=model)
+
+    with _PROVIDER_LOCK:
+        provider = _PROVIDER_CACHE.get(key)
+        if provider:
+            _PROVIDER_STATS["hits"] += 1
+            return provider
+        _PROVIDER_STATS["misses"] += 1
+    # build outside the lock, creating clients may be slow
+    provider = factory()
+    with _PROVIDER_LOCK:
+        return _PROVIDER_CACHE.setdefault(key, provider)
\ No newline at end of file
@@ -7,15 +7,20 @@ import logging
 import copy
 import random
 import re
+import threading
 import traceback
 from django.template import Template, Context
 from .ai_factory import create_openai, get_llm_provider_from_vendor#, _hive 
 from ..models import SinglePromptChat, AIVendor
 
 from .volley import Volley
+from .sentence_stream import SentenceSplitter
 
 logger = logging.getLogger(__name__)
 
+# Event Moxie sends when a monologue wait completes, used to ask for the next streamed line
+STREAM_NEXT_EVENT = "eb-wait-complete"
+
 _DEFAULT_SUMMARY_PROMPT = "Summarize the following conversation between the friendly robot Moxie, and the user.  Keep the summary brief, but include any important details."
 
 '''
@@ -28,11 +33,15 @@ class ChatSession:
         self._max_history = max_history
         self._total_volleys = 0
         self._local_data = {}
+        self._stream_continuations = 0
+        # streamed lines are counted on a worker and their notifies arrive on another thread
+        self._stream_lock = threading.Lock()
 
-    def add_history(self, role, message, history=None):
+    def add_history(self, role, message, history=None, count_volley=True):
         if not history:
             history = self._history
-            self._total_volleys += 1
+            if count_volley:
+                self._total_volleys += 1
         if history and history[-1].get("role") == role:
             # same role, append text
             history[-1]["content"] =  history[-1].get("content", '') + ' ' + message
@@ -63,12 +72,30 @@ class ChatSession:
         rcr = volley.request
         # RULES - speech field is what 'assistant' said, but we should skip the [animation]
         # 'user' speech comes from extra_lines[].text when .context_type=='input'
+        # Streamed lines after the first continue the same volley, and the wait event
+        # used to request them isn't something the user said
+        speech = rcr.get('speech')
+        spoken = speech and 'animation:' not in speech and 'silent:' not in speech
+        with self._stream_lock:
+            continuation = self._stream_continuations > 0
+            if continuation and spoken:
+                self._stream_continuations -= 1
         for line in rcr.get('extra_lines', []):
             if line['context_type'] == 'input':
+                if continuation and line.get('text') == STREAM_NEXT_EVENT:
+                    continue
                 self.add_history('user', line['text'])
-        speech = rcr.get('speech')
-        if speech and 'animation:' not in speech and 'silent:' not in speech:
-            self.add_history('assistant', speech)
+        if spoken:
+            self.add_history('assistant', speech, count_volley=not continuation)
+
+    # Called when a streamed line after the first is sent, so its notify extends the volley
+    def stream_continuation_sent(self):
+        with self._stream_lock:
+            self._stream_continuations += 1
+
+    # Streaming not supported by default, handle_volley is used
+    def stream_volley(self, volley:Volley):
+        return None
 
     def next_response(self, speech, context):
         logger.debug(f'Inference using history:\n{self._history}')
@@ -104,7 +131,8 @@ class SingleContextChatSession(ChatSession):
                  max_tokens=70,
                  temperature=0.5,
                  exit_line="Well, that was fun.  Let's move on.",
-                 vendor: AIVendor = AIVendor.OPEN_AI
+                 vendor: AIVendor = AIVendor.OPEN_AI,
+                 prompt_template: Template = None
                  ):
         super().__init__(max_history)
         self._max_volleys = max_volleys        
@@ -121,7 +149,7 @@ class SingleContextChatSession(ChatSession):
         self._post_filter = None
         self._notify_handler = None
         self._complete_handler = None
-        self._prompt_template = Template(prompt)
+        self._prompt_template = prompt_template or Template(prompt)
         # default vendor (can be overridden by DB subclass)
         self._vendor = AIVendor.OPEN_AI
 
@@ -228,6 +256,47 @@ class SingleContextChatSession(ChatSession):
             self.add_history('assistant', resp)
         return resp, of
     
+    # Start streaming the response to a plain inference volley.  Returns a tuple of
+    # (sentence generator, overflow) or None if the volley must use handle_volley, which
+    # is the case for prompts and for sessions with filters that need the full text.
+    def stream_volley(self, volley:Volley):
+        if volley.request.get('command') != 'continue' or self._auto_history:
+            return None
+        if self._pre_filter or self._post_filter:
+            return None
+        volley.assign_local_data(self._local_data)
+        return self.next_response_stream(volley.request["speech"], self.make_volley_context(volley)), self.overflow()
+
+    # Streamed version of next_response, yields the response one sentence at a time
+    def next_response_stream(self, speech, context):
+        of = self.overflow()
+        # clone, add new input, official history comes from notify
+        history = copy.deepcopy(self._history)
+        self.add_history('user', speech, history)
+        splitter = SentenceSplitter()
+        try:
+            logger.info(f"Streaming using vendor={getattr(self._vendor,'name',self._vendor)}, model={self._model}")
+            provider = get_llm_provider_from_vendor(self._vendor, self._model)
+            resp = provider.chat(
+                messages=context + history,
+                temperature=self._temperature,
+                stream=True,
+                max_tokens=self._max_tokens
+            )
+            # providers without streaming support return the whole string
+            for delta in ([resp] if isinstance(resp, str) else resp):
+                for sentence in splitter.feed(delta):
+                    yield sentence
+        except Exception as e:
+            logger.warning(f'Exception attempting inference: {e}')
+            for sentence in splitter.feed(" Oh no.  I have run into a bug"):
+                yield sentence
+        rest = splitter.flush()
+        if rest:
+            yield rest
+        if of:
+            yield self._exit_line
+
     # Prompt in this case is an opener line to say when we start the conversation module
     def get_opener(self):
         # Supports multiple random prompts separated by |, pick a random one
@@ -277,18 +346,62 @@ class SingleContextChatSession(ChatSession):
             stack = traceback.format_exc()
             logger.error(f"Error running complete hook: {e}\n{stack}")
 
+'''
+The parsed form of a SinglePromptChat record, shared by every session of that chat.  The
+prompt Template is parsed and the filter code is compiled once per (pk, source_version),
+rather than each time a robot launches the module.  Only the code object is shared, each
+session still runs it into its own namespace so no script state leaks between sessions.
+'''
+class CompiledChatSource:
+    def __init__(self, source):
+        self.source = source
+        self.prompt_template = Template(source.prompt)
+        self.code = None
+        if source.code:
+            try:
+                self.code = compile(source.code, f'<chat {source.name}>', 'exec')
+            except Exception as e:
+                logger.error(f"Error loading code for chat session: {e}")
+
+_SOURCE_LOCK = threading.Lock()
+_SOURCE_CACHE = {}
+
+# Get the compiled chat for a record, loading it when the version isn't known or not cached
+def get_chat_source(pk, source_version=None):
+    if source_version is not None:
+        with _SOURCE_LOCK:
+            compiled = _SOURCE_CACHE.get((pk, source_version))
+        if compiled:
+            return compiled
+    source = SinglePromptChat.objects.get(pk=pk)
+    key = (pk, source.source_version)
+    with _SOURCE_LOCK:
+        compiled = _SOURCE_CACHE.get(key)
+    if not compiled:
+        compiled = CompiledChatSource(source)
+        with _SOURCE_LOCK:
+            compiled = _SOURCE_CACHE.setdefault(key, compiled)
+    return compiled
+
+# Forget all compiled chats, called when chats are reloaded from the database
+def invalidate_chat_sources():
+    with _SOURCE_LOCK:
+        _SOURCE_CACHE.clear()
+
 # A database backed version, the way we normally load them
 class SinglePromptDBChatSession(SingleContextChatSession):
-    def __init__(self, pk):
-        source = SinglePromptChat.objects.get(pk=pk)
-        super().__init__(max_history=source.max_history, max_volleys=source.max_volleys, model=source.model, prompt=source.prompt, opener=source.opener, max_tokens=source.max_tokens, temperature=source.temperature)
+    def __init__(self, pk, source_version=None):
+        compiled = get_chat_source(pk, source_version)
+        source = compiled.source
+        super().__init__(max_history=source.max_history, max_volleys=source.max_volleys, model=source.model, prompt=source.prompt, opener=source.opener, max_tokens=source.max_tokens, temperature=source.temperature,
+                         prompt_template=compiled.prompt_template)
         # pick vendor from the DB row
         self._vendor = source.vendor_enum
 
-        if source.code:
+        if compiled.code:
             try:
                 loc = locals()
-                exec(source.code, globals(), loc)
+                exec(compiled.code, globals(), loc)
                 self.set_filters(pre_filter=loc.get('pre_process'), 
                                  post_filter=loc.get('post_process'),
                                  complete_handler=loc.get('complete_handler'),
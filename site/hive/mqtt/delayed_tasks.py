@@ -0,0 +1,93 @@
+'''
+DELAYED TASKS - Run work later without holding a thread while waiting
+
+Sleeping on a worker thread to delay something (like the config push after a robot connects)
+takes that worker away from every other device on its shard.  The DelayedTaskScheduler keeps
+pending tasks in a heap ordered by due time, and one thread waits for the earliest.  Tasks
+should be quick, typically handing the real work to the ShardedExecutor.
+'''
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class DelayedTask:
+    __slots__ = ("due", "fn", "args", "kwargs", "cancelled")
+
+    def __init__(self, due, fn, args, kwargs):
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+class DelayedTaskScheduler:
+    def __init__(self, name="delayed-tasks"):
+        self._heap = []
+        self._cond = threading.Condition()
+        # tie break, so tasks due at the same time run in the order they were scheduled
+        self._seq = itertools.count()
+        self._shutdown = False
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.max_late_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # Run fn(*args, **kwargs) after delay seconds, returns a task that can be cancelled
+    def call_later(self, delay, fn, *args, **kwargs):
+        task = DelayedTask(time.monotonic() + max(0.0, delay), fn, args, kwargs)
+        with self._cond:
+            heapq.heappush(self._heap, (task.due, next(self._seq), task))
+            self.scheduled += 1
+            # wake the thread if this is now the earliest task
+            if self._heap[0][2] is task:
+                self._cond.notify()
+        return task
+
+    # Cancelled tasks stay in the heap and are skipped when due
+    def cancel(self, task):
+        with self._cond:
+            if task and not task.cancelled:
+                task.cancelled = True
+                self.cancelled += 1
+
+    def metrics(self):
+        with self._cond:
+            return { "pending": sum(1 for _, _, t in self._heap if not t.cancelled),
+                     "scheduled": self.scheduled,
+                     "fired": self.fired,
+                     "cancelled": self.cancelled,
+                     "max_late_ms": round(self.max_late_ms, 1) }
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._shutdown:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._shutdown:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+                if task.cancelled:
+                    continue
+                self.fired += 1
+                self.max_late_ms = max(self.max_late_ms, (time.monotonic() - task.due) * 1000)
+            try:
+                task.fn(*task.args, **task.kwargs)
+            except Exception:
+                logger.exception("Error running delayed task:")
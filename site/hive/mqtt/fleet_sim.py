@@ -0,0 +1,463 @@
+'''
+FLEET SIM - Virtual Moxies for load testing MoxieServer
+
+Runs N virtual robots that behave like the real ones on the wire: they connect, publish state,
+ask for their schedule and mentor behaviors, hold remote-chat conversations (prompt, continue,
+notify), stream zmqSTT audio from a WAV fixture and report mentor behaviors.  Each robot waits
+for the server's reply the way a robot would, and the time from publish to reply is recorded
+per event type.
+
+Robots talk to the server either through a real MQTT broker (a local mosquitto), or through
+FakeBroker, which stands in for both the broker and the server's paho client so the whole
+fleet runs in-process.  Stub LLM and STT backends with configurable latency keep the test
+about the server rather than about model speed.
+
+Used by the simulate_fleet management command.
+'''
+import json
+import logging
+import queue
+import random
+import ssl
+import threading
+import time
+import uuid
+import numpy as np
+import paho.mqtt.client as mqtt
+import soundfile as sf
+from .ai_factory import LLMProvider
+from .protos.embodied.perception.audio.zmqSTT_pb2 import zmqSTTRequest, zmqSTTResponse
+from .. import stt
+from . import conversations
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Audio goes out in 100ms packets, like the robot's VAD stream
+_PACKET_BYTES = SAMPLE_RATE * 2 // 10
+_STT_RESPONSE = zmqSTTResponse.DESCRIPTOR.full_name
+_STT_REQUEST = zmqSTTRequest.DESCRIPTOR.full_name
+
+_SPEECH = [ "i went to the park today and saw a dog",
+            "can we talk about dinosaurs",
+            "what is your favorite color",
+            "i don't know",
+            "tell me a story about space",
+            "my brother took my toy",
+            "i like pizza",
+            "yes" ]
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+# Device ids look like the real ones (d_ + hex), so the server's broker log patterns match them
+def sim_device_id(index, prefix="5105"):
+    return f"d_{prefix}{index:08x}"
+
+'''
+Collects latencies per event type (publish to reply, for events that get one) and counts of
+sent events and timeouts, and reports percentiles and throughput.
+'''
+class LatencyRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._sent = {}
+        self._timeouts = {}
+
+    def sent(self, event_type):
+        with self._lock:
+            self._sent[event_type] = self._sent.get(event_type, 0) + 1
+
+    def record(self, event_type, ms):
+        with self._lock:
+            self._latencies.setdefault(event_type, []).append(ms)
+
+    def timeout(self, event_type):
+        with self._lock:
+            self._timeouts[event_type] = self._timeouts.get(event_type, 0) + 1
+
+    @staticmethod
+    def percentile(ordered, pct):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+    # One row per event type: sent, replies, timeouts, events/s and latency percentiles in ms
+    def report(self, duration):
+        with self._lock:
+            rows = []
+            for event_type in sorted(self._sent):
+                ordered = sorted(self._latencies.get(event_type, []))
+                rows.append({ "event": event_type,
+                              "sent": self._sent[event_type],
+                              "replies": len(ordered),
+                              "timeouts": self._timeouts.get(event_type, 0),
+                              "per_sec": self._sent[event_type] / duration if duration else 0.0,
+                              "p50": self.percentile(ordered, 50),
+                              "p95": self.percentile(ordered, 95),
+                              "p99": self.percentile(ordered, 99),
+                              "max": ordered[-1] if ordered else 0.0 })
+            return rows
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+'''
+In-process stand-in for mosquitto and the server's paho client.  Robot messages are queued
+and delivered to MoxieServer.on_message one at a time from a single thread, as paho's network
+loop does.  Server publishes go straight to the robot the topic is addressed to.  Connects and
+disconnects show up as broker log notifications, the way the server detects them normally.
+'''
+class FakeBroker:
+    def __init__(self):
+        self._server = None
+        self._robots = {}
+        self._queue = queue.Queue()
+        self._max_depth = 0
+        self._delivered = 0
+        self._thread = None
+
+    def attach(self, server):
+        self._server = server
+        server._client = self
+        self._thread = threading.Thread(target=self._run, name="fake-broker", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            self._server.on_message(self, None, msg)
+            self._delivered += 1
+
+    def stop(self):
+        self._queue.put(None)
+
+    def metrics(self):
+        return { "delivered": self._delivered, "depth": self._queue.qsize(), "max_depth": self._max_depth }
+
+    # Robot side
+    def connect_robot(self, robot):
+        self._robots[robot.device_id] = robot
+        port = 40000 + len(self._robots)
+        self._put(FakeMessage("$SYS/broker/log/N", f"New client connected from 127.0.0.1:{port} as {robot.device_id} (p2, c1, k60).".encode()))
+
+    def disconnect_robot(self, robot):
+        self._put(FakeMessage("$SYS/broker/log/N", f"Client {robot.device_id} closed its connection.".encode()))
+
+    def robot_publish(self, topic, payload):
+        self._put(FakeMessage(topic, payload))
+
+    def _put(self, msg):
+        self._queue.put(msg)
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    # Server side, the parts of the paho client MoxieServer uses
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        robot = self._robots.get(topic.split('/')[2])
+        if robot:
+            robot.on_message(topic, payload.encode('utf-8') if isinstance(payload, str) else payload)
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.stop()
+
+'''
+Per robot connection to a real MQTT broker, with the robot's device id as its client id.
+'''
+class MqttTransport:
+    def __init__(self, host, port, use_tls=True):
+        self._host = host
+        self._port = port
+        self._use_tls = use_tls
+        self._clients = {}
+
+    def connect_robot(self, robot):
+        client = mqtt.Client(client_id=robot.device_id, transport="tcp")
+        if self._use_tls:
+            client.tls_set(cert_reqs=ssl.CERT_NONE)
+            client.tls_insecure_set(True)
+        client.username_pw_set(username='unknown', password='sim')
+        client.on_connect = lambda c, userdata, flags, rc: c.subscribe(f"/devices/{robot.device_id}/#")
+        client.on_message = lambda c, userdata, msg: robot.on_message(msg.topic, msg.payload)
+        client.connect(self._host, self._port, 60)
+        client.loop_start()
+        self._clients[robot.device_id] = client
+
+    def disconnect_robot(self, robot):
+        client = self._clients.pop(robot.device_id, None)
+        if client:
+            client.disconnect()
+            client.loop_stop()
+
+    def robot_publish(self, topic, payload):
+        client = self._clients.get(topic.split('/')[2])
+        if client:
+            client.publish(topic, payload=payload)
+
+    def metrics(self):
+        return { "clients": len(self._clients) }
+
+'''
+A virtual Moxie.  It runs one scripted session after another until the deadline, waiting for
+each reply (or the timeout) before moving on, with a random think time between steps.
+'''
+class VirtualMoxie:
+    def __init__(self, device_id, transport, recorder, audio, module_id=None, content_id=None,
+                 turns=3, think=1.0, timeout=30.0, seed=0):
+        self.device_id = device_id
+        self._transport = transport
+        self._recorder = recorder
+        self._audio = audio
+        self._module_id = module_id
+        self._content_id = content_id
+        self._turns = turns
+        self._think = think
+        self._timeout = timeout
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # reply key -> (event type, publish time, event, reply holder)
+        self._pending = {}
+        self._last_speech = None
+
+    # Replies from the server, on the broker's thread
+    def on_message(self, topic, payload):
+        parts = topic.split('/')
+        if parts[3] == "config":
+            self._resolve("config", payload)
+        elif parts[3] == "commands" and parts[4] == "zmq":
+            colon_index = payload.find(b':')
+            if payload[:colon_index].decode('utf-8') == _STT_RESPONSE:
+                resp = zmqSTTResponse()
+                resp.ParseFromString(payload[colon_index + 1:])
+                if resp.type == resp.ResponseType.FINAL:
+                    self._resolve(resp.uuid, resp)
+        elif parts[3] == "commands":
+            data = json.loads(payload)
+            self._resolve(data.get("event_id") or data.get("request_id"), data)
+
+    def _resolve(self, key, reply):
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending:
+            event_type, start, done, holder = pending
+            self._recorder.record(event_type, (time.perf_counter() - start) * 1000)
+            holder.append(reply)
+            done.set()
+
+    def _expect(self, key, event_type):
+        done = threading.Event()
+        holder = []
+        with self._lock:
+            self._pending[key] = (event_type, time.perf_counter(), done, holder)
+        return done, holder
+
+    def _wait(self, key, event_type, done, holder):
+        if not done.wait(self._timeout):
+            with self._lock:
+                self._pending.pop(key, None)
+            self._recorder.timeout(event_type)
+            return None
+        return holder[0]
+
+    def _publish(self, event_type, topic, payload, reply_key=None):
+        if reply_key:
+            done, holder = self._expect(reply_key, event_type)
+        self._recorder.sent(event_type)
+        self._transport.robot_publish(topic, payload)
+        if reply_key:
+            return self._wait(reply_key, event_type, done, holder)
+        return None
+
+    def _event(self, event_type, eventname, payload, reply_key=None):
+        return self._publish(event_type, f"/devices/{self.device_id}/events/{eventname}",
+                             json.dumps(payload).encode('utf-8'), reply_key)
+
+    def _pause(self):
+        if self._think:
+            time.sleep(self._rng.uniform(0, 2 * self._think))
+
+    def connect(self):
+        done, holder = self._expect("config", "connect")
+        self._recorder.sent("connect")
+        self._transport.connect_robot(self)
+        return self._wait("config", "connect", done, holder) is not None
+
+    def disconnect(self):
+        self._transport.disconnect_robot(self)
+
+    def send_state(self):
+        state = { "battery_level": self._rng.randint(20, 100), "charging": False, "volume": 0.5 }
+        self._publish("state", f"/devices/{self.device_id}/state", json.dumps(state).encode('utf-8'))
+
+    def query(self, what):
+        req_id = str(uuid.uuid4())
+        return self._event(f"query_{what}", "client-service-activity-log",
+                           { "subtopic": "query", "query": what, "request_id": req_id }, reply_key=req_id)
+
+    def report_mentor_behavior(self):
+        mbh = { "module_id": self._module_id or "OPENMOXIE_CHAT", "content_id": self._content_id or "default",
+                "content_day": "1", "timestamp": now_ms(), "action": "COMPLETED", "instance_id": 1 }
+        self._event("mentor_behavior", "client-service-activity-log", { "mentor_behavior": mbh })
+
+    def remote_chat(self, command, speech=None):
+        event_id = str(uuid.uuid4())
+        rcr = { "event_id": event_id, "command": command, "backend": "router" }
+        if speech:
+            rcr["speech"] = speech
+        if self._module_id:
+            rcr["module_id"] = self._module_id
+            rcr["content_id"] = self._content_id or ""
+        return self._event(f"chat_{command}", "remote-chat", rcr,
+                           reply_key=None if command == "notify" else event_id)
+
+    # Stream an utterance as zmqSTT packets, in real time, and wait for the FINAL
+    def speak(self):
+        session_id = str(uuid.uuid4())
+        offset = self._rng.randrange(0, max(1, len(self._audio) - _PACKET_BYTES)) & ~1
+        utterance = self._audio[offset:] + self._audio[:offset]
+        packets = [ utterance[i:i + _PACKET_BYTES] for i in range(0, len(utterance), _PACKET_BYTES) ]
+        topic = f"/devices/{self.device_id}/events/zmq"
+        for i, chunk in enumerate(packets):
+            req = zmqSTTRequest()
+            req.uuid = session_id
+            req.timestamp = now_ms()
+            req.audio_content = chunk
+            last = i == len(packets) - 1
+            req.vad = req.VADState.END_OF_SPEECH if last else (req.VADState.START_OF_SPEECH if i == 0 else req.VADState.SPEECH)
+            payload = (_STT_REQUEST + ":").encode('utf-8') + req.SerializeToString()
+            if last:
+                resp = self._publish("stt", topic, payload, reply_key=session_id)
+                return resp.speech if resp is not None else None
+            self._transport.robot_publish(topic, payload)
+            time.sleep(0.1)
+
+    # One robot session: state, schedule, a conversation with speech, then mentor behaviors
+    def session(self):
+        self.send_state()
+        self.query("schedule")
+        self._pause()
+        self.remote_chat("prompt")
+        for _ in range(self._turns):
+            self._pause()
+            heard = self.speak() if self._audio else None
+            self.remote_chat("notify")
+            self.remote_chat("continue", heard or self._rng.choice(_SPEECH))
+        self.report_mentor_behavior()
+        self.query("mentor_behaviors")
+
+    def run(self, deadline):
+        if not self.connect():
+            logger.warning(f"{self.device_id} got no config, giving up")
+            return
+        try:
+            while time.monotonic() < deadline:
+                self.session()
+                self._pause()
+        finally:
+            self.disconnect()
+
+def load_utterance(path, seconds):
+    audio, rate = sf.read(path, dtype="int16")
+    if rate != SAMPLE_RATE:
+        raise ValueError(f"{path} is {rate}Hz, need {SAMPLE_RATE}Hz")
+    if audio.ndim > 1:
+        audio = audio[:, 0]
+    return audio[:int(seconds * SAMPLE_RATE)].tobytes()
+
+'''
+LLM provider that waits a fixed time and returns canned text, streaming it word by word if asked.
+'''
+class StubLLMProvider(LLMProvider):
+    def __init__(self, latency=0.5, text="That sounds like so much fun! What happened next?"):
+        self._latency = latency
+        self._text = text
+
+    def chat(self, messages, temperature=0.7, stream=False, **kwargs):
+        if stream:
+            def gen():
+                time.sleep(self._latency)
+                for word in self._text.split(" "):
+                    yield word + " "
+            return gen()
+        time.sleep(self._latency)
+        return self._text
+
+'''
+STT client for the local backend that waits latency seconds plus rtf times the audio length.
+'''
+class StubSTTClient(stt.STTClient):
+    def __init__(self, latency=0.2, rtf=0.1, text="i went to the park today"):
+        super().__init__()
+        self._latency = latency
+        self._rtf = rtf
+        self._text = text
+
+    def config(self):
+        return "local", "stub://stt", "en"
+
+    def health(self, timeout=2):
+        return { "backend": "local", "url": "stub://stt", "lang": "en", "service": { "model": "stub", "device": "cpu", "compute": "none" } }
+
+    def _fake(self, seconds):
+        wait = self._latency + self._rtf * seconds
+        time.sleep(wait)
+        ms = round(wait * 1000, 1)
+        self._record({ "connect_ms": 0.0, "upload_ms": 0.0, "prep_ms": 0.0, "inference_ms": ms, "total_ms": ms })
+        return self._text, [ (0.0, seconds, self._text) ]
+
+    def transcribe_wav(self, wav_bytes, language=None):
+        text, segs = self._fake(max(0, len(wav_bytes) - 44) / (SAMPLE_RATE * 2))
+        return text, segs[0][0], segs[0][1]
+
+    def transcribe_pcm(self, pcm, language=None):
+        text, segs = self._fake(len(pcm) / (SAMPLE_RATE * 2))
+        return text, segs[0][0], segs[0][1]
+
+    def transcribe_pcm_segments(self, pcm, language=None):
+        return self._fake(len(pcm) / (SAMPLE_RATE * 2))
+
+# Route every chat and STT call in this process to the stubs
+def install_stub_backends(llm_latency=0.5, stt_latency=0.2, stt_rtf=0.1):
+    provider = StubLLMProvider(latency=llm_latency)
+    conversations.get_llm_provider_from_vendor = lambda vendor, model: provider
+    stt._client = StubSTTClient(latency=stt_latency, rtf=stt_rtf)
+
+'''
+Runs a fleet of virtual robots against a server, started ramp seconds apart in total, each
+running sessions until duration is up.
+'''
+class FleetSimulator:
+    def __init__(self, transport, robots=10, duration=60.0, ramp=5.0, audio=None, seed=0, **robot_options):
+        self.recorder = LatencyRecorder()
+        self._transport = transport
+        self._ramp = ramp
+        self._duration = duration
+        self.robots = [ VirtualMoxie(sim_device_id(i), transport, self.recorder, audio, seed=seed + i, **robot_options)
+                        for i in range(robots) ]
+
+    def run(self):
+        start = time.monotonic()
+        deadline = start + self._ramp + self._duration
+        threads = []
+        for i, robot in enumerate(self.robots):
+            t = threading.Thread(target=robot.run, args=(deadline,), name=f"sim-{robot.device_id}", daemon=True)
+            t.start()
+            threads.append(t)
+            if self._ramp and len(self.robots) > 1:
+                time.sleep(self._ramp / (len(self.robots) - 1))
+        for t in threads:
+            t.join()
+        return time.monotonic() - start
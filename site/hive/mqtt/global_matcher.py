@@ -0,0 +1,213 @@
+'''
+GLOBAL MATCHER - Compiled matcher for global response patterns
+
+Global responses are checked on every remote chat request, and a linear scan costs one
+re.match per pattern.  The GlobalMatcher is built once from the patterns in priority order
+and answers "which is the first pattern that matches this speech" with:
+
+- A literal prefilter.  Most patterns start with literal text, or a small set of literal
+  alternatives like ^(moxie|moxy) time.  Those prefixes go into a trie, and walking the
+  speech through the trie yields the only prefixed patterns that could possibly match.
+  Patterns like .*time please$ have no prefix, but must contain a literal somewhere.
+  Those literals go into an Aho-Corasick automaton, so one pass over the speech finds
+  every pattern whose required literal is present.
+- Combined regexes for the rest.  Patterns without a usable literal are joined into one
+  alternation with a named group per pattern, which keeps priority order because the
+  regex engine takes the first alternative that matches.  Patterns that can't be safely
+  combined (named groups, back references, inline flags) are kept on their own.
+
+The winning pattern is re-matched on its own so match groups (entities) are numbered
+exactly as the author wrote them.
+'''
+import re
+from collections import deque
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# Cap on literal alternatives expanded per pattern, beyond that it is treated as unprefixed
+_MAX_PREFIXES = 32
+_GROUP_NAME = "_g{}"
+_DEFAULT_FLAGS = re.compile('').flags
+
+# Expand parsed ops into the set of literal prefixes they can start with.  Returns the set
+# and whether the ops were consumed completely (so following ops may extend the prefixes).
+def _literal_prefixes(ops):
+    prefixes = {''}
+    for op, av in ops:
+        if op == sre_constants.AT and av in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING):
+            continue
+        if op == sre_constants.LITERAL:
+            options, exhaustive = { chr(av) }, True
+        elif op == sre_constants.IN and all(o == sre_constants.LITERAL for o, _ in av):
+            options, exhaustive = { chr(c) for _, c in av }, True
+        elif op == sre_constants.SUBPATTERN and not av[1] and not av[2]:
+            options, exhaustive = _literal_prefixes(av[3])
+        elif op == sre_constants.BRANCH:
+            options, exhaustive = set(), True
+            for alt in av[1]:
+                alt_options, alt_exhaustive = _literal_prefixes(alt)
+                options |= alt_options
+                exhaustive = exhaustive and alt_exhaustive
+        else:
+            return prefixes, False
+        prefixes = { p + o for p in prefixes for o in options }
+        if len(prefixes) > _MAX_PREFIXES:
+            return {''}, False
+        if not exhaustive:
+            return prefixes, False
+    return prefixes, True
+
+# Longest run of literal text every match of these ops must contain, or ''
+def _required_literal(ops):
+    best = ''
+    run = ''
+    for op, av in ops:
+        if op == sre_constants.LITERAL:
+            run += chr(av)
+            continue
+        best = max(best, run, key=len)
+        run = ''
+        if op == sre_constants.SUBPATTERN and not av[1] and not av[2]:
+            best = max(best, _required_literal(av[3]), key=len)
+    return max(best, run, key=len)
+
+# Check for anything that changes meaning when a pattern becomes one alternative of many
+def _combinable(compiled, ops):
+    return compiled.flags == _DEFAULT_FLAGS and not compiled.groupindex and not _has_group_refs(ops)
+
+# Back references use group numbers, which shift once patterns are combined
+def _has_group_refs(ops):
+    for op, av in ops:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return True
+        for item in (av if isinstance(av, (tuple, list)) else ()):
+            subs = item if isinstance(item, list) else [ item ]
+            if any(isinstance(sub, sre_parse.SubPattern) and _has_group_refs(sub) for sub in subs):
+                return True
+    return False
+
+class _LiteralAutomaton:
+    '''
+    Aho-Corasick automaton over a set of literals, search() returns the values of every
+    literal found anywhere in a string in a single pass.
+    '''
+    def __init__(self):
+        self._goto = [ {} ]
+        self._fail = [ 0 ]
+        self._out = [ [] ]
+
+    def add(self, literal, value):
+        state = 0
+        for ch in literal:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(value)
+
+    # Compute failure links breadth first, call once after all literals are added
+    def build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        found = []
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._out[state]:
+                found.extend(self._out[state])
+        return found
+
+class GlobalMatcher:
+    '''
+    Built from a priority ordered list of (regex pattern string) and answers match(speech)
+    with (index, match) for the first pattern that matches, or None.
+    '''
+    def __init__(self, patterns):
+        self._compiled = [ re.compile(p) for p in patterns ]
+        self._trie = {}
+        self._literals = _LiteralAutomaton()
+        # (compiled, [indexes]) blocks for patterns with no usable literal, in priority order
+        self._segments = []
+        pending = []
+        for index, (pattern, compiled) in enumerate(zip(patterns, self._compiled)):
+            ops = sre_parse.parse(pattern)
+            # inline flags like (?i) change what a literal matches, so no prefix for those
+            prefixes, _ = _literal_prefixes(ops) if compiled.flags == _DEFAULT_FLAGS else ({''}, False)
+            literal = _required_literal(ops) if compiled.flags == _DEFAULT_FLAGS else ''
+            if '' not in prefixes:
+                for p in prefixes:
+                    self._add_prefix(p, index)
+            elif literal:
+                self._literals.add(literal, index)
+            elif _combinable(compiled, ops):
+                pending.append(index)
+            else:
+                self._flush_segment(pending, patterns)
+                pending = []
+                self._segments.append((compiled, [ index ]))
+        self._flush_segment(pending, patterns)
+        self._literals.build()
+
+    def _add_prefix(self, prefix, index):
+        node = self._trie
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node.setdefault(None, []).append(index)
+
+    def _flush_segment(self, indexes, patterns):
+        if len(indexes) == 1:
+            self._segments.append((self._compiled[indexes[0]], indexes))
+        elif indexes:
+            combined = '|'.join(f'(?P<{_GROUP_NAME.format(i)}>{patterns[i]})' for i in indexes)
+            self._segments.append((re.compile(combined), indexes))
+
+    # Indexes of prefixed patterns whose literal prefix starts the speech
+    def _prefix_candidates(self, speech):
+        found = []
+        node = self._trie
+        for ch in speech:
+            found.extend(node.get(None, ()))
+            node = node.get(ch)
+            if node is None:
+                break
+        else:
+            found.extend(node.get(None, ()))
+        return found
+
+    def match(self, speech):
+        best = None
+        for compiled, indexes in self._segments:
+            m = compiled.match(speech)
+            if m:
+                best = indexes[0] if len(indexes) == 1 else int(m.lastgroup[len(_GROUP_NAME.format('')):])
+                break
+        candidates = self._prefix_candidates(speech) + self._literals.search(speech)
+        for index in sorted(set(candidates)):
+            if best is not None and index > best:
+                break
+            m = self._compiled[index].match(speech)
+            if m:
+                return index, m
+        if best is None:
+            return None
+        return best, self._compiled[best].match(speech)
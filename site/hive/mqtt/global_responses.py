@@ -12,15 +12,76 @@ but can be constrained to whole sentence matching using ^moxie time$ for instanc
 catch "moxie time" but ignore "moxie time is something i dont have"
 '''
 from concurrent.futures import ThreadPoolExecutor,TimeoutError
+from django.conf import settings
 from ..models import GlobalResponse, GlobalAction
 import re
 import logging
+import threading
+import time
 from .volley import Volley
+from .global_matcher import GlobalMatcher
 from functools import partial
 import traceback
 
 logger = logging.getLogger(__name__)
 
+# Raised when every sandbox worker is busy, usually with methods that ran past their timeout
+class SandboxBusy(Exception):
+    pass
+
+'''
+Long-lived, bounded pool of workers that run METHOD global response code.  Each run is limited
+by a timeout, and latency, error and timeout counts are kept for each method.  Python threads
+can't be killed, so a method that overruns still holds its worker until it returns, and once
+every worker is held new runs are refused rather than queued behind them.
+'''
+class MethodSandbox:
+    def __init__(self, max_workers=4, timeout=10.0):
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="global-method")
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def run(self, name, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self._record(name, "rejected")
+            raise SandboxBusy("All method workers are busy")
+        def call():
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            except Exception:
+                self._record(name, "errors")
+                raise
+            finally:
+                self._record(name, "calls", (time.perf_counter() - start) * 1000)
+                self._slots.release()
+        future = self._executor.submit(call)
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            self._record(name, "timeouts")
+            raise
+
+    def _record(self, name, counter, ms=None):
+        with self._lock:
+            st = self._stats.setdefault(name, { "calls": 0, "errors": 0, "timeouts": 0, "rejected": 0,
+                                                "total_ms": 0.0, "max_ms": 0.0 })
+            st[counter] += 1
+            if ms is not None:
+                st["total_ms"] += ms
+                st["max_ms"] = max(st["max_ms"], ms)
+
+    # Per-method counters, with average latency
+    def metrics(self):
+        with self._lock:
+            return { name: dict(st, avg_ms=st["total_ms"] / st["calls"] if st["calls"] else 0.0)
+                     for name, st in self._stats.items() }
+
+_SANDBOX = MethodSandbox(max_workers=getattr(settings, "MOXIE_METHOD_WORKERS", 4),
+                         timeout=getattr(settings, "MOXIE_METHOD_TIMEOUT", 10.0))
+
 # Action Patterns - these produce a single response, with or without an attached action
 class ActionPattern:
     _re : re.Pattern
@@ -30,11 +91,18 @@ class ActionPattern:
         self._re = re.compile(source.pattern)
         self._action = action
 
+    @property
+    def pattern(self):
+        return self._source.pattern
+
     def response_functor(self, speech, volley):
         matches = self._re.match(speech)
         if matches:
-            return partial(self.create_response, matches, volley)
+            return self.match_functor(matches, volley)
         return None
+
+    def match_functor(self, matches, volley):
+        return partial(self.create_response, matches, volley)
     
     def create_response(self, matches, volley:Volley):
         volley.set_output(self._source.response_text, self._source.response_markup, output_type='GLOBAL_COMMAND')
@@ -48,25 +116,44 @@ class MethodPattern(ActionPattern):
     def __init__(self, source):
         super().__init__(source)
         self._entity_groups = [int(x) for x in source.entity_groups.split(',') if x] if source.entity_groups else None
+        # compile and resolve the methods once, errors are reported when the pattern matches.
+        # the script's top level runs here in the sandbox, under the same timeout as a call, and
+        # the objects it creates (the functions, their defaults and attributes) are reused by every
+        # call until responses are reloaded
+        self._load_error = None
+        self._func = None
+        self._func_v = None
+        def load():
+            loc = {}
+            exec(compile(source.code, f'<global {source.name}>', 'exec'), globals(), loc)
+            return loc
+        try:
+            loc = _SANDBOX.run(f"{source.name} (load)", load)
+            self._func = loc.get('get_response')
+            self._func_v = loc.get('handle_volley')
+        except TimeoutError as e:
+            logger.error(f"Loading code for GlobalResponse {source.name} exceeded time limit.")
+            self._load_error = e
+        except Exception as e:
+            logger.error(f"Error loading code for GlobalResponse {source.name}: {e}")
+            self._load_error = e
 
     def create_response(self, matches, volley):
-        loc = locals()
         try:
-            exec(self._source.code, globals(), loc)
-            func = loc.get('get_response')
-            func_v = loc.get('handle_volley')
+            if self._load_error:
+                raise self._load_error
+            func = self._func
+            func_v = self._func_v
             if func or func_v:
                 entities = [matches.group(x) for x in self._entity_groups] if self._entity_groups else None
-                # run background, limited at 10s
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    if func_v:
-                        # handle_volley(volley)
-                        volley.local_data["entities"] = entities
-                        future = executor.submit(func_v, volley)
-                    else:
-                        # get_response(request, response, entities)
-                        future = executor.submit(func, volley.request, volley.response, entities)
-                    result = future.result(timeout=10.0)
+                # run in the shared sandbox pool, limited by its timeout
+                if func_v:
+                    # handle_volley(volley)
+                    volley.local_data["entities"] = entities
+                    result = _SANDBOX.run(self._source.name, func_v, volley)
+                else:
+                    # get_response(request, response, entities)
+                    result = _SANDBOX.run(self._source.name, func, volley.request, volley.response, entities)
                 if isinstance(result, str):
                     # if string, overwrite text in canned response
                     volley.set_output(result, None, output_type='GLOBAL_COMMAND')
@@ -80,6 +167,9 @@ class MethodPattern(ActionPattern):
         except TimeoutError:
             logger.error("Method code exceeded time limit.")
             volley.set_output("Script error: Timeout exceeded", None, output_type='GLOBAL_COMMAND')
+        except SandboxBusy:
+            logger.error("Method workers all busy.")
+            volley.set_output("Script error: Too busy", None, output_type='GLOBAL_COMMAND')
         except Exception as e:
             exc_info = traceback.format_exc()
             logger.error(exc_info)
@@ -90,35 +180,57 @@ class MethodPattern(ActionPattern):
 # The object owning ALL active Global Responses.  It loads them from the database only on
 # startup and request.  All response handling must be executed in the returned functor.
 class GlobalResponses:
-    _patterns: list[ActionPattern]
+    _active: tuple[list[ActionPattern], GlobalMatcher]
 
     def __init__(self):
-        self._patterns = []
+        self.set_patterns([])
 
     def update_from_database(self):
-        self._patterns = []
+        patterns = []
         for gr in GlobalResponse.objects.all().order_by('-sort_key'):
             if gr.action == GlobalAction.LAUNCH.value:
                 logger.info(f'Loading GlobalResponse LAUNCH type {gr}')                
-                self._patterns.append(ActionPattern(gr, action="launch"))
+                patterns.append(ActionPattern(gr, action="launch"))
             elif gr.action == GlobalAction.CONFIRM_LAUNCH.value:
                 logger.info(f'Loading GlobalResponse CONFIRM_LAUNCH type {gr}')                
-                self._patterns.append(ActionPattern(gr, action="launch_if_confirmed"))
+                patterns.append(ActionPattern(gr, action="launch_if_confirmed"))
             elif gr.action == GlobalAction.RESPONSE.value:
                 logger.info(f'Loading GlobalResponse RESPONSE type {gr}')
-                self._patterns.append(ActionPattern(gr))
+                patterns.append(ActionPattern(gr))
             elif gr.action == GlobalAction.METHOD.value:
                 logger.info(f'Loading GlobalResponse CUSTOM METHOD type {gr}')
-                self._patterns.append(MethodPattern(gr))
+                patterns.append(MethodPattern(gr))
             else:
                 logger.warning(f"Unsupported type {gr.action} in GlobalResponse {gr.name}")
+        self.set_patterns(patterns)
+
+    # Use a list of patterns in priority order, building the combined matcher for them
+    def set_patterns(self, patterns):
+        # swapped as one tuple, check_global may be running in another thread
+        self._active = (patterns, GlobalMatcher([p.pattern for p in patterns]))
 
     def check_global(self, volley:Volley):
         speech = volley.request.get('speech')
         if speech:
             # all global commands match at lowercase
             speech = speech.lower()
-            for p in self._patterns:
+            patterns, matcher = self._active
+            found = matcher.match(speech)
+            if found:
+                index, matches = found
+                return patterns[index].match_functor(matches, volley)
+        return None
+
+    # Latency, error and timeout counts for METHOD responses
+    def method_metrics(self):
+        return _SANDBOX.metrics()
+
+    # The original linear scan, kept as a reference for benchmarks
+    def check_global_linear(self, volley:Volley):
+        speech = volley.request.get('speech')
+        if speech:
+            speech = speech.lower()
+            for p in self._active[0]:
                 f = p.response_functor(speech, volley)
                 if f:
                     return f
@@ -11,11 +11,12 @@
 
 import concurrent.futures
 import logging
+from django.conf import settings
 from ..models import SinglePromptChat
-from ..automarkup import process as automarkup_process
-from ..automarkup import initialize_rules as automarkup_initialize_rules
+from ..automarkup import AutomarkupEngine
 from .global_responses import GlobalResponses
-from .conversations import ChatSession, SinglePromptDBChatSession
+from .conversations import ChatSession, SinglePromptDBChatSession, STREAM_NEXT_EVENT, invalidate_chat_sources
+from .sentence_stream import SentenceStream
 from .volley import Volley
 
 # Turn on to enable global commands in the cloud
@@ -23,6 +24,8 @@ _ENABLE_GLOBAL_COMMANDS = True
 _LOG_ALL_RCR = False
 _LOG_NOTIFY_RCR = True
 _MAX_WORKER_THREADS = 5
+# Longest wait for the next streamed sentence before ending the stream
+_STREAM_LINE_TIMEOUT = 30.0
 
 logger = logging.getLogger(__name__)
 
@@ -47,10 +50,13 @@ class RemoteChat:
     def __init__(self, server):
         self._server = server
         self._device_sessions = {}
+        self._device_streams = {}
+        self._stream_responses = getattr(settings, "MOXIE_STREAM_RESPONSES", False)
         self._modules = {}
         self._modules_info = {"modules": [], "version": "openmoxie_v1"}
         self._worker_queue = concurrent.futures.ThreadPoolExecutor(max_workers=_MAX_WORKER_THREADS)
-        self._automarkup_rules = automarkup_initialize_rules()
+        self._automarkup = AutomarkupEngine(cache_size=getattr(settings, "MOXIE_AUTOMARKUP_CACHE_SIZE", 512),
+                                            seed=getattr(settings, "MOXIE_AUTOMARKUP_SEED", 0))
         self._global_responses = GlobalResponses()
 
     def register_module(self, module_id, content_id, cname):
@@ -65,13 +71,15 @@ class RemoteChat:
     def update_from_database(self):
         new_modules = {}
         mod_map = {}
+        # sessions started after this reload compile the latest chat records
+        invalidate_chat_sources()
         for chat in SinglePromptChat.objects.all():
             # one module can support many content IDs, separated by | like openers
             cid_list = chat.content_id.split("|")
             for content_id in cid_list:
                 new_modules[f"{chat.module_id}/{content_id}"] = {
                     "xtor": SinglePromptDBChatSession,
-                    "params": {"pk": chat.pk},
+                    "params": {"pk": chat.pk, "source_version": chat.source_version},
                 }
                 logger.debug(f"Registering {chat.module_id}/{content_id}")
                 # Group content IDs under module IDs
@@ -91,12 +99,17 @@ class RemoteChat:
         self._modules = new_modules
         self._global_responses.update_from_database()
 
+    # Latency and timeout counts for METHOD global responses
+    def global_method_metrics(self):
+        return self._global_responses.method_metrics()
+
     # Handle GLOBAL patterns, available inside (almost) any module
     def check_global(self, volley):
         return self._global_responses.check_global(volley) if _ENABLE_GLOBAL_COMMANDS else None
 
     def on_chat_complete(self, device_id, id, session: ChatSession):
         logger.info(f"Chat Session Complete: {id} {session.has_complete_hook()}")
+        self._device_streams.pop(device_id, None)
         if session.has_complete_hook():
             # make a data-only Volley for the completion hook
             volley = Volley(
@@ -148,27 +161,104 @@ class RemoteChat:
 
     # Markup text
     def make_markup(self, text, mood_and_intensity=None):
-        return automarkup_process(text, self._automarkup_rules, mood_and_intensity=mood_and_intensity)
+        return self._automarkup.process(text, mood_and_intensity=mood_and_intensity)
+
+    # Automarkup cache size and hit rate
+    def markup_metrics(self):
+        return self._automarkup.stats()
 
-    # Get the next response to a chat — FINAL ONLY (no partials to the robot)
-    def create_session_response(self, device_id, sess: ChatSession, volley: Volley):
+    # Get the next response to a chat
+    def create_session_response(self, device_id, sess: ChatSession, volley: Volley, subscribed=False):
         """Unified behavior for both OpenAI and Ollama:
         - Let the session build the prompt/context and get a full answer (no device partials).
         - Add automarkup if missing.
         - Send exactly one remote_chat response to the robot.
+        When response streaming is enabled and the session supports it, the response is
+        instead spoken a sentence at a time, see stream_session_response.
+        subscribed is set when an abandoned stream left the wait complete event subscribed.
         """
+        if self._stream_responses:
+            stream = sess.stream_volley(volley)
+            if stream:
+                self.stream_session_response(device_id, volley, *stream, subscribed=subscribed)
+                return
+
         sess.handle_volley(volley)
 
         if "markup" not in volley.response["output"]:
             # if we don't have markup, create it
             text = volley.response["output"]["text"]
             volley.set_output(text, self.make_markup(text))
+        if subscribed:
+            volley.update_subscriptions([], clear=True)
 
         if _LOG_ALL_RCR:
             logger.info(f"RemoteChatResponse\n{volley.response}")
 
         self._server.send_command_to_bot_json(device_id, "remote_chat", volley.response)
 
+    # Speak a streamed response a sentence at a time.  Remote chat has a single response per
+    # request, so each line except the last asks Moxie for a monologue wait, and the wait
+    # complete event is answered with the next line.  The first line goes out as soon as
+    # the second one starts, so Moxie speaks while the rest is still being generated.
+    def stream_session_response(self, device_id, volley: Volley, sentences, overflow, subscribed=False):
+        stream = SentenceStream(overflow=overflow)
+        self._device_streams[device_id] = stream
+        first = None
+        first_sent = False
+        for sentence in sentences:
+            if first is None:
+                first = sentence
+            elif not first_sent:
+                self.send_stream_line(device_id, volley, first, last=False, overflow=overflow)
+                first_sent = True
+                stream.put(sentence)
+            else:
+                stream.put(sentence)
+        stream.close()
+        if not first_sent:
+            # whole response was a single line
+            if self._device_streams.get(device_id) is stream:
+                self._device_streams.pop(device_id, None)
+            self.send_stream_line(device_id, volley, first or "", last=True, overflow=overflow, subscribed=subscribed)
+
+    # Answer a wait complete event with the next line of an active stream.  Doesn't wait for
+    # generation, the line is sent when the producer delivers it, or the stream ends after
+    # _STREAM_LINE_TIMEOUT with whatever it has.
+    def continue_stream(self, device_id, sess: ChatSession, volley: Volley, stream: SentenceStream):
+        def on_line(text, last):
+            self._server.delayed_tasks().cancel(expiry)
+            self._worker_queue.submit(self.send_stream_continuation, device_id, sess, volley, stream, text, last)
+        expiry = self._server.delayed_tasks().call_later(_STREAM_LINE_TIMEOUT, stream.expire, on_line)
+        stream.request_line(on_line)
+
+    def send_stream_continuation(self, device_id, sess: ChatSession, volley: Volley, stream: SentenceStream, text, last):
+        if last and self._device_streams.get(device_id) is stream:
+            self._device_streams.pop(device_id, None)
+        if text:
+            sess.stream_continuation_sent()
+        self.send_stream_line(device_id, volley, text or "", last=last, overflow=stream.overflow, subscribed=True)
+
+    # Send one streamed line, with markup, requesting another if more lines follow.  The wait
+    # complete subscription lasts for the rest of the module, so the last line clears it if an
+    # earlier line subscribed, or a later wait timer would reach the session as speech.
+    def send_stream_line(self, device_id, volley: Volley, text, last, overflow, subscribed=False):
+        volley.set_output(text, None)
+        if last:
+            if overflow:
+                volley.add_launch_or_exit()
+        else:
+            volley.add_execution_action('eb_wait_monologue')
+            volley.update_subscriptions([STREAM_NEXT_EVENT])
+        volley.ingest_action_tags()
+        if last and subscribed:
+            volley.update_subscriptions([], clear=True)
+        text = volley.response["output"]["text"]
+        volley.set_output(text, self.make_markup(text) if text else None)
+        if _LOG_ALL_RCR:
+            logger.info(f"RemoteChatResponse\n{volley.response}")
+        self._server.send_command_to_bot_json(device_id, "remote_chat", volley.response)
+
     # Produce / execute a global response
     def global_response(self, device_id, functor):
         resp = functor()
@@ -253,8 +343,20 @@ class RemoteChat:
                 sess.ingest_notify(volley)
             else:
                 volley = Volley(rcr, device_id=device_id, robot_data=volley_data, local_data=sess.local_data)
+                stream = self._device_streams.get(device_id)
+                if rcr.get("speech") == STREAM_NEXT_EVENT:
+                    if stream:
+                        # Moxie finished a streamed line and is ready for the next one
+                        self.continue_stream(device_id, sess, volley, stream)
+                    else:
+                        # a late wait timer, not something the child said
+                        logger.debug(f"Dropping {STREAM_NEXT_EVENT} for {device_id} with no active stream")
+                    return
+                # any other input abandons a response still being streamed, and its response
+                # clears the subscription the stream left behind
+                abandoned = self._device_streams.pop(device_id, None) is not None
                 if not self.handled_global(device_id, volley):
-                    self._worker_queue.submit(self.create_session_response, device_id, sess, volley)
+                    self._worker_queue.submit(self.create_session_response, device_id, sess, volley, abandoned)
         else:
             # THIS IS THE PATH FOR MOXIE ON-BOARD CONTENT
             session_reset = False
@@ -1,25 +1,33 @@
 '''
 MOXIE SERVER - Primary service handler for Moxie
 '''
-import concurrent
 import paho.mqtt.client as mqtt
 import json
 import time
 import re
 import logging
 import base64
+import hashlib
+import threading
 import ssl
-from .ai_factory import set_openai_key, set_xai_key
+from .ai_factory import set_openai_key, set_xai_key, provider_cache_stats
 from .robot_credentials import RobotCredentials
 from .robot_data import RobotData
+from .volley import Volley
 from .moxie_remote_chat import RemoteChat
 from .protos.embodied.logging.Log_pb2 import ProtoSubscribe
 from .protos.embodied.logging.Cloud2_pb2 import ServiceConfiguration2
 from .protos.embodied.wifiapp.QRCommands_pb2 import StartPairingQR
 from .zmq_stt_handler import STTHandler
-from ..models import HiveConfiguration
+from .sharded_executor import ShardedExecutor
+from .delayed_tasks import DelayedTaskScheduler
+from ..config_cache import config_cache_metrics, get_hive_config, refresh_hive_config
+from ..models import MoxieDevice
+from ..stt import refresh_stt_config, get_stt_client
+from django.conf import settings
 
 _BASIC_FORMAT = '{1}'
+_STT_PROTO = 'embodied.perception.audio.zmqSTTRequest'
 _MOXIE_SERVICE_INSTANCE = None
 # OpenMoxie doesn't support any, but providing a dummy token can unblock some Moxie actions like OTA download
 _PROVIDE_HTTP_TOKENS=False
@@ -79,7 +87,20 @@ class MoxieServer:
         self._client_metrics = {}
         self._connect_pattern = r"connected from (.*) as (d_[a-f0-9-]+)"
         self._disconnect_pattern = r"Client (d_[a-f0-9-]+) (closed its connection|disconnected)"
-        self._worker_queue = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+        # Work is sharded by device_id, so each robot's events are handled in order
+        self._worker_queue = ShardedExecutor(shards=getattr(settings, "MOXIE_WORKER_SHARDS", 5),
+                                             max_queue_depth=getattr(settings, "MOXIE_WORKER_QUEUE_DEPTH", 1000),
+                                             name="moxie-worker")
+        # Post-connect config pushes wait here rather than sleeping on a worker
+        self._delayed = DelayedTaskScheduler(name="moxie-delayed")
+        self._connect_delay = getattr(settings, "MOXIE_CONNECT_DELAY", 1.0)
+        self._pending_connect = {}
+        # Config pushes: digest of the last config sent to each device, and batched pushes waiting to go
+        self._config_lock = threading.Lock()
+        self._config_sent = {}
+        self._pending_config = {}
+        self._config_batch_window = getattr(settings, "MOXIE_CONFIG_BATCH_WINDOW", 0.5)
+        self._config_counts = { "sent": 0, "suppressed": 0, "batched": 0 }
         self.update_from_database()
 
     # Connect to the broker - the jwt stuff left in place, but isn't required
@@ -153,9 +174,9 @@ class MoxieServer:
             match2 = None if match else re.search(self._disconnect_pattern, line)
             if match:
                 if self._robot_data.connect_init_needed(match.group(2)):
-                    self._worker_queue.submit(self.on_device_connect, match.group(2), True, match.group(1))
+                    self._worker_queue.submit(match.group(2), self.on_device_connect, match.group(2), True, match.group(1))
             elif match2:
-                self._worker_queue.submit(self.on_device_connect, match2.group(1), False)
+                self._worker_queue.submit(match2.group(1), self.on_device_connect, match2.group(1), False)
 
     # Handles metrics from mosquitto
     def on_client_metrics(self, basetype, msg):
@@ -185,12 +206,12 @@ class MoxieServer:
                     # SCHEDULE REQUEST - Robot asking what schedule to follow this session
                     logger.debug("Rx Schedule request.")
                     req_id = csa.get('request_id')
-                    self._worker_queue.submit(self.provide_schedule, req_id, device_id)
+                    self._worker_queue.submit(device_id, self.provide_schedule, req_id, device_id)
                 elif csa.get("query") == "mentor_behaviors":
                     # MENTOR BEHAVIOR REQUEST - Robot asking what user has done before
                     logger.debug("Rx MBH request.")
                     req_id = csa.get('request_id')
-                    self._worker_queue.submit(self.provide_mentor_behaviors, req_id, device_id)
+                    self._worker_queue.submit(device_id, self.provide_mentor_behaviors, req_id, device_id)
                 elif csa.get("query") == "license":
                     # ROBOT IS ASKING FOR ANY LICENSES IT CAN USE (e.g. google speech)
                     req_id = csa.get('request_id')
@@ -204,7 +225,7 @@ class MoxieServer:
                                                         })
             elif 'mentor_behavior' in csa:
                 # MENTOR BEHAVIOR REPORT - Robot informing what user has done
-                self._worker_queue.submit(self.ingest_mentor_behavior, device_id, csa['mentor_behavior'])
+                self._worker_queue.submit(device_id, self.ingest_mentor_behavior, device_id, csa['mentor_behavior'])
             elif csa.get("subtopic") == "telehealth":
                 # ROBOT TELEHEALTH INTERFACE
                 logger.info(f'Rx TELEHEALTH: {csa.get("message")}')
@@ -255,40 +276,62 @@ class MoxieServer:
         if connected:
             logger.info(f'Moxie CONNECTED {device_id} from {ip_addr}')
             self._robot_data.db_connect(device_id)
-            # Sleep to avoid sending sub/config before client is ready
-            time.sleep(1.0)
-            self.send_config_to_bot_json(device_id, self._robot_data.get_config(device_id))
-            # subscripe to ZMQ STT
-            sub = ProtoSubscribe()
-            sub.protos.append('embodied.perception.audio.zmqSTTRequest')
-            sub.timestamp = now_ms()
-            logger.debug(f'Subscribed to ZMQ STT')
-            self.send_zmq_to_bot(device_id, sub)
+            # Wait before sending sub/config so the client is ready, without holding this worker
+            self._pending_connect[device_id] = self._delayed.call_later(
+                self._connect_delay, self._worker_queue.submit, device_id, self.finish_device_connect, device_id)
         else:
+            self._delayed.cancel(self._pending_connect.pop(device_id, None))
+            with self._config_lock:
+                self._delayed.cancel(self._pending_config.pop(device_id, None))
+                # a reconnecting robot always gets its config
+                self._config_sent.pop(device_id, None)
             self._robot_data.db_release(device_id)
             logger.info(f'Moxie DISCONNECTED {device_id}')
 
+    # NOTE: Called from worker thread pool, after the connect delay
+    def finish_device_connect(self, device_id):
+        self._pending_connect.pop(device_id, None)
+        self.send_config_to_bot_json(device_id, self._robot_data.get_config(device_id), force=True)
+        # subscripe to ZMQ STT
+        sub = ProtoSubscribe()
+        sub.protos.append('embodied.perception.audio.zmqSTTRequest')
+        sub.timestamp = now_ms()
+        logger.debug(f'Subscribed to ZMQ STT')
+        self.send_zmq_to_bot(device_id, sub)
+
     # Fallback, we missed the connect message but robot is connected
     def check_device_connect(self, device_id, info="Missing"):
         if self._robot_data.connect_init_needed(device_id):
             logger.info(f"Unconnected robot {device_id} location {info}.  Connecting now.")
-            self._worker_queue.submit(self.on_device_connect, device_id, True, info)
+            self._worker_queue.submit(device_id, self.on_device_connect, device_id, True, info)
 
     # Moxie reporting its own state information
     def on_device_state(self, device_id, msg):
         logger.debug(f"Rx STATE topic for device {device_id}")
         self.check_device_connect(device_id, "State")
-        self._worker_queue.submit(self.ingest_robot_state, device_id, json.loads(msg.payload))
+        self._worker_queue.submit(device_id, self.ingest_robot_state, device_id, json.loads(msg.payload))
 
     # Callback when a moxie config has changed and may need to be provided
     def handle_config_updated(self, device):
-        # Update if connected
+        # Update if connected, bursts of updates within the batch window go out as one push
         if self._robot_data.config_update_live(device):
-            logger.info(f'Moxie device {device.device_id} updated, sending updated config.')
-            self.send_config_to_bot_json(device.device_id, self._robot_data.get_config(device.device_id))
+            device_id = device.device_id
+            with self._config_lock:
+                if device_id in self._pending_config:
+                    self._config_counts["batched"] += 1
+                    return
+                self._pending_config[device_id] = self._delayed.call_later(
+                    self._config_batch_window, self._worker_queue.submit, device_id, self.push_config, device_id)
+            logger.info(f'Moxie device {device_id} updated, sending updated config.')
         else:
             logger.info(f'Moxie device {device.device_id} updated, but device offline')
 
+    # NOTE: Called from worker thread pool, after the batch window, sends the latest config
+    def push_config(self, device_id):
+        with self._config_lock:
+            self._pending_config.pop(device_id, None)
+        self.send_config_to_bot_json(device_id, self._robot_data.get_config(device_id))
+
     # For Robots using wake_button_enabled, wake them from screen off
     def send_wakeup_to_bot(self, device_id):
         if self._robot_data.device_online(device_id):
@@ -296,9 +339,23 @@ class MoxieServer:
             return True
         return False
 
-    # Send Moxie its configuration data
-    def send_config_to_bot_json(self, device_id, payload: dict):
-        self._client.publish(f"/devices/{device_id}/config", payload=json.dumps(payload))
+    # Send a config to Moxie, skipped when it matches the last one sent unless forced
+    def send_config_to_bot_json(self, device_id, payload: dict, force=False):
+        text = json.dumps(payload)
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._config_lock:
+            if not force and self._config_sent.get(device_id) == digest:
+                self._config_counts["suppressed"] += 1
+                return False
+            self._config_sent[device_id] = digest
+            self._config_counts["sent"] += 1
+        self._client.publish(f"/devices/{device_id}/config", payload=text)
+        return True
+
+    # Counters for config publishes
+    def config_push_metrics(self):
+        with self._config_lock:
+            return dict(pending=len(self._pending_config), **self._config_counts)
 
     # Send a Command (JSON) to Moxie
     def send_command_to_bot_json(self, device_id, command, payload: dict):
@@ -341,6 +398,24 @@ class MoxieServer:
     # Print out client metrics, called periodically in the background
     def print_metrics(self):
         logger.info(f"Client Metrics: {self._client_metrics}")
+        wm = self.worker_metrics()
+        logger.info(f"State Metrics: {self._robot_data.state_metrics()}")
+        logger.info(f"Persist Metrics: {self._robot_data.persist_metrics()}")
+        logger.info(f"Config Cache: {config_cache_metrics()} Robot Configs: {self._robot_data.config_metrics()}")
+        logger.info(f"LLM Provider Pool: {provider_cache_stats()}")
+        logger.info(f"STT Client: {get_stt_client().metrics()}")
+        stt = self._zmq_handlers.get(_STT_PROTO)
+        if stt:
+            logger.info(f"STT Sessions: {stt.metrics()}")
+        logger.info(f"Global Method Metrics: {self._remote_chat.global_method_metrics()}")
+        logger.info(f"Automarkup Cache: {self._remote_chat.markup_metrics()}")
+        logger.info(f"Config Push: {self.config_push_metrics()}")
+        logger.info(f"Delayed Tasks: {self._delayed.metrics()}")
+        logger.info(f"Worker Metrics: shards={wm['shards']} depth={wm['depth']} rejected={wm['rejected']} per_shard={[s['depth'] for s in wm['per_shard']]}")
+
+    # Queue depths and counters for the per-device worker shards
+    def worker_metrics(self):
+        return self._worker_queue.metrics()
 
     # Start client connection loop
     def start(self):
@@ -360,6 +435,40 @@ class MoxieServer:
     def get_web_session_global_response(self, speech):
         return self._remote_chat.get_web_session_global_response(speech)
     
+    # One web chat volley, returns (line, details).  Sessions are keyed by the page token.
+    def web_chat(self, token, module_id, content_id, speech):
+        session = self.get_web_session_for_module(token, module_id, content_id)
+        volley = Volley.request_from_speech(speech, device_id=token, module_id=module_id, content_id=content_id, local_data=session.local_data)
+        # Check global responses manually
+        gresp = self.get_web_session_global_response(volley) if speech else None
+        if gresp:
+            return gresp, {}
+        session.handle_volley(volley)
+        return volley.debug_response_string(), volley.response
+
+    # Web tier API - plain arguments and results, so these also work over the service IPC
+    def connected_list(self):
+        return self._robot_data.connected_list()
+
+    def device_online(self, device_id):
+        return self._robot_data.device_online(device_id)
+
+    def get_puppet_state(self, device_id):
+        return self._robot_data.get_puppet_state(device_id)
+
+    def device_config(self, pk):
+        return self._robot_data.get_config_for_device(MoxieDevice.objects.get(pk=pk))
+
+    def device_persist(self, pk):
+        return self._robot_data.get_persist_for_device(MoxieDevice.objects.get(pk=pk))
+
+    def complete_missions(self, device_id, module_id, content_id_list):
+        self._robot_data.add_mbh_completion_bulk(device_id, module_id=module_id, content_id_list=content_id_list)
+
+    # A device record was saved, push its config if it is connected
+    def device_updated(self, pk):
+        self.handle_config_updated(MoxieDevice.objects.get(pk=pk))
+
     # Accessor to remote chat
     def remote_chat(self):
         return self._remote_chat
@@ -368,17 +477,24 @@ class MoxieServer:
     def robot_data(self):
         return self._robot_data
 
+    # Accessor to the delayed task scheduler
+    def delayed_tasks(self):
+        return self._delayed
+
     # Reload records from the database
     def update_from_database(self):
-        hive_config = HiveConfiguration.objects.filter(name="default").first()
+        # also how changes saved in other processes reach this one
+        refresh_hive_config()
+        hive_config = get_hive_config()
         set_openai_key(hive_config.openai_api_key if hive_config else None)
         set_xai_key(hive_config.xai_api_key if hive_config else None)
         self._google_service_account = hive_config.google_api_key if hive_config else None
+        refresh_stt_config(hive_config)
         self._remote_chat.update_from_database()
 
     # Get the endppint / moxie relocate QR code to move a Moxie to this service
     def get_endpoint_qr_data(self):
-        hiveconfig = HiveConfiguration.objects.filter(name="default").first()
+        hiveconfig = get_hive_config()
         scfg = ServiceConfiguration2()
         scfg.gcp_project = self._mqtt_project_id
         scfg.mqtt_host = hiveconfig.external_host if hiveconfig and hiveconfig.external_host else self._mqtt_endpoint
@@ -407,6 +523,12 @@ def cleanup_instance():
     global _MOXIE_SERVICE_INSTANCE
     if _MOXIE_SERVICE_INSTANCE:
         _MOXIE_SERVICE_INSTANCE._client.disconnect()
+        _MOXIE_SERVICE_INSTANCE._delayed.shutdown()
+        _MOXIE_SERVICE_INSTANCE._worker_queue.shutdown(wait=False)
+        _MOXIE_SERVICE_INSTANCE._robot_data.shutdown()
+        stt = _MOXIE_SERVICE_INSTANCE._zmq_handlers.get(_STT_PROTO)
+        if stt:
+            stt.shutdown()
         _MOXIE_SERVICE_INSTANCE = None
 
 # Instance method, accessor
@@ -421,7 +543,7 @@ def create_service_instance(project_id, host, port, cert_required=True):
         creds = RobotCredentials(True)
         rbdata = RobotData()
         _MOXIE_SERVICE_INSTANCE = MoxieServer(creds, rbdata, project_id, host, port, cert_required)
-        _MOXIE_SERVICE_INSTANCE.add_zmq_handler('embodied.perception.audio.zmqSTTRequest', STTHandler(_MOXIE_SERVICE_INSTANCE))
+        _MOXIE_SERVICE_INSTANCE.add_zmq_handler(_STT_PROTO, STTHandler(_MOXIE_SERVICE_INSTANCE))
         _MOXIE_SERVICE_INSTANCE.connect(start=True)
     
     return _MOXIE_SERVICE_INSTANCE
@@ -0,0 +1,240 @@
+'''
+MOXIE SERVICE - One process owns the MQTT connection, the web tier calls into it
+
+With MOXIE_SERVICE_MODE=embedded (the default) every process that loads Django runs its own
+MoxieServer, which is fine for runserver but means several MQTT clients with the same client
+id, and several copies of the device state, under gunicorn.  With MOXIE_SERVICE_MODE=remote
+only the moxie_service management command runs a MoxieServer.  It also listens on
+MOXIE_SERVICE_ADDR, and web workers reach it through MoxieServiceClient, which forwards the
+web tier API calls over a multiprocessing connection.  Connections are authenticated with
+MOXIE_SERVICE_AUTHKEY (required to listen anywhere but loopback, otherwise derived from a
+non-default SECRET_KEY), and calls and replies are JSON, never pickles.
+
+Views use get_service(), which is the local MoxieServer or the client depending on the mode.
+'''
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import socket
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from . import moxie_server
+
+logger = logging.getLogger(__name__)
+
+# Calls the web tier may make on the service, all take and return plain data
+SERVICE_METHODS = frozenset([
+    "connected_list", "device_online", "get_puppet_state", "device_config", "device_persist",
+    "complete_missions", "device_updated", "send_wakeup_to_bot", "send_telehealth_interrupt",
+    "send_telehealth_speech", "update_from_database", "get_endpoint_qr_data", "get_wifi_qr_data",
+    "web_chat",
+])
+
+class RemoteServiceError(Exception):
+    pass
+
+def service_mode():
+    return getattr(settings, "MOXIE_SERVICE_MODE", "embedded").lower()
+
+# "host:port" for TCP, anything else is a unix socket path
+def service_address():
+    addr = getattr(settings, "MOXIE_SERVICE_ADDR", "127.0.0.1:8765")
+    host, sep, port = addr.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return addr
+
+def _is_loopback(address):
+    if not isinstance(address, tuple):
+        # unix socket, reachable only through the filesystem
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+# The explicit MOXIE_SERVICE_AUTHKEY, or one derived from SECRET_KEY for loopback only, and never from the
+# insecure default SECRET_KEY, which is published with the source
+def service_authkey(address=None):
+    key = getattr(settings, "MOXIE_SERVICE_AUTHKEY", None)
+    if key:
+        return key.encode("utf-8")
+    address = address or service_address()
+    if not _is_loopback(address):
+        raise ImproperlyConfigured(f"MOXIE_SERVICE_AUTHKEY must be set to use the moxie service at {address}")
+    if settings.SECRET_KEY.startswith("django-insecure-"):
+        raise ImproperlyConfigured("Set MOXIE_SERVICE_AUTHKEY (or a private SECRET_KEY) to use the moxie service")
+    return hashlib.sha256(f"moxie-service:{settings.SECRET_KEY}".encode("utf-8")).digest()
+
+# Messages are JSON, so nothing received is ever unpickled
+def _send(conn, message):
+    conn.send_bytes(json.dumps(message).encode("utf-8"))
+
+def _recv(conn):
+    return json.loads(conn.recv_bytes())
+
+'''
+Serves web tier calls to the MoxieServer in this process, one thread per web worker connection.
+'''
+class MoxieServiceHost:
+    def __init__(self, server, address=None, authkey=None):
+        self._server = server
+        self._address = address or service_address()
+        self._authkey = authkey or service_authkey(self._address)
+        self._listener = None
+        self._calls = 0
+        self._errors = 0
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._listener = Listener(self._address, authkey=self._authkey)
+        logger.info(f"Moxie service listening on {self._address}")
+        threading.Thread(target=self._accept, name="moxie-service", daemon=True).start()
+
+    def close(self):
+        listener, self._listener = self._listener, None
+        if listener:
+            # a blocked accept() keeps the socket listening, so wake it with a throwaway connection
+            try:
+                family = socket.AF_INET if isinstance(self._address, tuple) else socket.AF_UNIX
+                with socket.socket(family, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(1.0)
+                    sock.connect(self._address)
+            except OSError:
+                pass
+            listener.close()
+        with self._lock:
+            conns = list(self._connections)
+        for conn in conns:
+            # shutdown wakes the serving thread out of recv(), close alone doesn't
+            try:
+                with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def metrics(self):
+        with self._lock:
+            return { "connections": len(self._connections), "calls": self._calls, "errors": self._errors }
+
+    def _accept(self):
+        listener = self._listener
+        while self._listener:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                # closed, or a client that failed authentication
+                if self._listener is None:
+                    return
+                logger.warning(f"Rejected a moxie service connection: {e}")
+                continue
+            with self._lock:
+                self._connections.add(conn)
+            threading.Thread(target=self._serve, args=(conn,), name="moxie-service-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            while True:
+                try:
+                    message = _recv(conn)
+                except (EOFError, OSError):
+                    # closed by the client, or by close()
+                    return
+                except ValueError:
+                    logger.warning("Dropping a moxie service connection that sent a message that isn't JSON")
+                    return
+                name = None
+                try:
+                    name, args, kwargs = message
+                    if name not in SERVICE_METHODS or not isinstance(args, list) or not isinstance(kwargs, dict):
+                        raise RemoteServiceError(f"Unknown service call {name}")
+                    reply = json.dumps(["ok", getattr(self._server, name)(*args, **kwargs)])
+                except Exception as e:
+                    logger.exception(f"Error in moxie service call {name}:")
+                    with self._lock:
+                        self._errors += 1
+                    reply = json.dumps(["error", f"{type(e).__name__}: {e}"])
+                with self._lock:
+                    self._calls += 1
+                conn.send_bytes(reply.encode("utf-8"))
+        finally:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+
+'''
+Forwards SERVICE_METHODS calls to the moxie service.  Connections aren't thread safe, so each
+thread keeps its own, reconnecting when the service has restarted.
+'''
+class MoxieServiceClient:
+    def __init__(self, address=None, authkey=None, timeout=None):
+        self._address = address or service_address()
+        self._authkey = authkey or service_authkey(self._address)
+        self._timeout = timeout if timeout is not None else getattr(settings, "MOXIE_SERVICE_TIMEOUT", 30.0)
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if name not in SERVICE_METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name, args, kwargs)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn.poll(0):
+            # nothing is outstanding, so a readable connection was closed by a service restart
+            self._drop()
+            conn = None
+        if conn is None:
+            conn = Client(self._address, authkey=self._authkey)
+            self._local.conn = conn
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            conn.close()
+
+    def _call(self, name, args, kwargs):
+        try:
+            conn = self._connection()
+            message = [name, list(args), kwargs]
+            try:
+                _send(conn, message)
+            except OSError:
+                # stale connection from before a service restart, nothing was delivered
+                self._drop()
+                conn = self._connection()
+                _send(conn, message)
+            if not conn.poll(self._timeout):
+                raise TimeoutError(f"No reply to {name} after {self._timeout}s")
+            status, result = _recv(conn)
+        except (OSError, EOFError, TimeoutError) as e:
+            self._drop()
+            raise RemoteServiceError(f"Moxie service unavailable at {self._address}: {e}") from e
+        if status != "ok":
+            raise RemoteServiceError(result)
+        return result
+
+_client = None
+_client_lock = threading.Lock()
+
+# The MoxieServer API for the web tier, local or in the moxie service process
+def get_service():
+    global _client
+    if service_mode() != "remote":
+        return moxie_server.get_instance()
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MoxieServiceClient()
+    return _client
@@ -0,0 +1,141 @@
+'''
+PERSIST INGEST - Periodic checkpoints of robot persistent data
+
+Conversations (MemoryChat and friends) change a robot's persist data throughout a session,
+but it used to be saved only when the robot disconnected, so a crash lost the session.
+Saving after every volley is too expensive.  PersistIngest tracks the PersistentData record
+of each online robot, and a background thread checks them on an interval, detecting changes
+by hashing the serialized data, and writes only the changed ones in a single bulk_update.
+Robots are flushed again when they disconnect and at shutdown.
+'''
+import hashlib
+import json
+import logging
+import threading
+import time
+from ..models import PersistentData
+from .util import run_db_atomic
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_FLUSH_INTERVAL = 30.0
+
+class _Tracked:
+    __slots__ = ("record", "digest")
+
+    def __init__(self, record, digest):
+        self.record = record
+        self.digest = digest
+
+class PersistIngest:
+    def __init__(self, flush_interval=_DEFAULT_FLUSH_INTERVAL):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # device_id -> PersistentData record and the digest of what the database holds
+        self._tracked = {}
+        self._flushed = 0
+        self._flushes = 0
+        self._bytes = 0
+        self._errors = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="persist-ingest", daemon=True)
+        self._thread.start()
+
+    # Serialized form and digest of a persist dict, None while another thread is changing it
+    @staticmethod
+    def _snapshot(data):
+        try:
+            text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        except RuntimeError:
+            # changed size during serialization, catch it on the next pass
+            return None, None
+        return text, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    # Snapshot for a flush, errors (like a script storing something that isn't JSON) are logged
+    # and counted, and the robot stays tracked so a later fix to its data still gets saved
+    def _flush_snapshot(self, robot_id, data):
+        try:
+            return self._snapshot(data)
+        except Exception:
+            logger.exception(f"Error serializing persistent data for {robot_id}:")
+            with self._lock:
+                self._errors += 1
+            return None, None
+
+    # Start watching a freshly loaded record, which matches the database
+    def track(self, robot_id, record):
+        _, digest = self._flush_snapshot(robot_id, record.data)
+        with self._lock:
+            self._tracked[robot_id] = _Tracked(record, digest)
+
+    # Save a robot's data if it changed, and stop watching it
+    def release(self, robot_id):
+        self.flush([robot_id])
+        with self._lock:
+            self._tracked.pop(robot_id, None)
+
+    # Write all (or the listed) changed persist records to the database
+    def flush(self, robot_ids=None):
+        with self._lock:
+            if robot_ids is None:
+                candidates = list(self._tracked.items())
+            else:
+                candidates = [ (rid, self._tracked[rid]) for rid in robot_ids if rid in self._tracked ]
+        with self._flush_lock:
+            batch = []
+            for rid, tracked in candidates:
+                text, digest = self._flush_snapshot(rid, tracked.record.data)
+                if digest is not None and digest != tracked.digest:
+                    batch.append((tracked, text, digest))
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            try:
+                run_db_atomic(self.flush_atomic, batch)
+            except Exception:
+                logger.exception("Error flushing persistent data:")
+                with self._lock:
+                    self._errors += 1
+                return 0
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for tracked, _, digest in batch:
+                tracked.digest = digest
+        with self._lock:
+            self._flushed += len(batch)
+            self._flushes += 1
+            self._bytes += sum(len(text) for _, text, _ in batch)
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        return len(batch)
+
+    # Write the snapshots, not the live dicts, so the saved digests match what was written
+    def flush_atomic(self, batch):
+        rows = [ PersistentData(pk=tracked.record.pk, data=json.loads(text)) for tracked, text, _ in batch ]
+        PersistentData.objects.bulk_update(rows, ['data'])
+
+    def metrics(self):
+        with self._lock:
+            return { "tracked": len(self._tracked),
+                     "flushed": self._flushed,
+                     "flushes": self._flushes,
+                     "bytes_written": self._bytes,
+                     "errors": self._errors,
+                     "last_flush_ms": round(self._last_flush_ms, 1),
+                     "max_flush_ms": round(self._max_flush_ms, 1) }
+
+    # Stop the background checkpoints, saving anything changed
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # keep checkpointing, losing this thread would mean losing data on a crash
+                logger.exception("Error checkpointing persistent data:")
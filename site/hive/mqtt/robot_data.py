@@ -6,16 +6,24 @@ pertinent data from the database when robots connect, and unload them when
 they disconnect, and provide various APIs to access data like schedule, config,
 and state.
 '''
+import copy
+import hashlib
 import json
 import logging
+import threading
+from collections import OrderedDict
 import deepmerge
 from django.db import connections
 from django.db import transaction
-from ..models import HiveConfiguration, MoxieDevice, MoxieSchedule, MentorBehavior, PersistentData
+from ..config_cache import hive_config_snapshot
+from ..models import MoxieDevice, MoxieSchedule, MentorBehavior, PersistentData
 from django.conf import settings
 from django.forms.models import model_to_dict
 from django.utils import timezone
 from .scheduler import expand_schedule
+from .persist_ingest import PersistIngest
+from .robot_store import RobotRecord, RobotStore
+from .state_ingest import StateIngest
 from .util import run_db_atomic, now_ms
 
 logger = logging.getLogger(__name__)
@@ -62,10 +70,21 @@ DEFAULT_COMBINED_CONFIG["settings"] = DEFAULT_ROBOT_SETTINGS
 
 DEFAULT_SCHEDULE = {}
 
+# Merged configs remembered per device, enough for the whole fleet
+_CONFIG_MEMO_SIZE = 4096
+
 class RobotData:
     def __init__(self):
         global DEFAULT_SCHEDULE
-        self._robot_map = {}
+        self._robot_map = RobotStore()
+        self._state_ingest = StateIngest(flush_interval=getattr(settings, "MOXIE_STATE_FLUSH_INTERVAL", 2.0))
+        self._persist_ingest = PersistIngest(flush_interval=getattr(settings, "MOXIE_PERSIST_FLUSH_INTERVAL", 30.0))
+        self._config_lock = threading.Lock()
+        # (hive config version, common config and settings) and device_id -> (hive version, device digest, merged)
+        self._base_config = (None, None)
+        self._config_memo = OrderedDict()
+        self._config_hits = 0
+        self._config_builds = 0
         db_default = MoxieSchedule.objects.filter(name="default").first()
         if db_default:
             logger.info("Using 'default' schedule from database as schedule fallback")
@@ -75,28 +94,26 @@ class RobotData:
 
     # Called when Robot connects to the MQTT network from a worker thread
     def db_connect(self, robot_id):
-        if robot_id in self._robot_map:
-            # Known only when cache record isnt empty
-            if self._robot_map[robot_id]:
-                logger.info(f'Device {robot_id} already known.')
-                return
+        # Known only when cache record is loaded, not just claimed
+        if self._robot_map.is_loaded(robot_id):
+            logger.info(f'Device {robot_id} already known.')
+            return
         logger.info(f'Device {robot_id} is LOADING.')
         run_db_atomic(self.init_from_db, robot_id)
 
     # Called when a Robot disconnects from the MQTT network from a worker thread
     def db_release(self, robot_id):
-        if robot_id in self._robot_map:
+        rec = self._robot_map.pop(robot_id)
+        if rec:
             logger.info(f'Releasing device data for {robot_id}')
+            self._state_ingest.release(robot_id)
+            self._persist_ingest.release(robot_id)
             run_db_atomic(self.release_to_db, robot_id)
-            del self._robot_map[robot_id]
 
     # Check if init after connection for this bot is needed, and remember it so we only init once
     def connect_init_needed(self, robot_id):
-        needed = robot_id not in self._robot_map
-        if needed:
-            # set an empty record, so we don't try again
-            self._robot_map[robot_id] = {}
-        return needed
+        # claims an empty record atomically, so only one caller tries
+        return self._robot_map.claim(robot_id)
     
     # Check if a device is online
     def device_online(self, robot_id):
@@ -104,22 +121,47 @@ class RobotData:
     
     # Get a list of online robots
     def connected_list(self):
-        return list(self._robot_map.keys())
+        return self._robot_map.keys()
     
-    # Build a configuration record for a robot
-    def build_config(self, device, hive_cfg):
-        # Robot config is base config and settings merged with robot config and settings
-        # NOTE: Uses copies of everything, to avoid altering db records when merging in settings
-        base_cfg = (hive_cfg.common_config if hive_cfg and hive_cfg.common_config else DEFAULT_ROBOT_CONFIG).copy()
+    # Common config and settings for the current hive config version, built once per version
+    def common_config(self):
+        hive_cfg, version = hive_config_snapshot()
+        with self._config_lock:
+            if self._base_config[0] == version:
+                return self._base_config[1], version
+        base_cfg = dict(hive_cfg.common_config if hive_cfg and hive_cfg.common_config else DEFAULT_ROBOT_CONFIG)
         base_cfg["settings"] = hive_cfg.common_settings if hive_cfg and hive_cfg.common_settings else DEFAULT_ROBOT_SETTINGS
+        with self._config_lock:
+            self._base_config = (version, base_cfg)
+        return base_cfg, version
+
+    # Build a configuration record for a robot, memoized on the hive config version and the device's config.
+    # Callers get their own copy, so a volley or script changing it can't alter the memo.
+    def build_config(self, device):
+        base_cfg, version = self.common_config()
         robot_cfg = device.robot_config.copy() if device.robot_config else {}
         robot_cfg["settings"] = device.robot_settings if device.robot_settings else {}
-        return deepmerge.always_merger.merge(base_cfg, robot_cfg)
+        digest = hashlib.blake2b(json.dumps(robot_cfg, sort_keys=True, default=str).encode("utf-8"), digest_size=16).digest()
+        with self._config_lock:
+            memo = self._config_memo.get(device.device_id)
+            if memo and memo[0] == version and memo[1] == digest:
+                self._config_memo.move_to_end(device.device_id)
+                self._config_hits += 1
+                return copy.deepcopy(memo[2])
+        # Robot config is base config and settings merged with robot config and settings
+        # NOTE: Merges into a deep copy, merging alters the target and the base is shared
+        cfg = deepmerge.always_merger.merge(copy.deepcopy(base_cfg), robot_cfg)
+        with self._config_lock:
+            self._config_memo[device.device_id] = (version, digest, cfg)
+            self._config_memo.move_to_end(device.device_id)
+            if len(self._config_memo) > _CONFIG_MEMO_SIZE:
+                self._config_memo.popitem(last=False)
+            self._config_builds += 1
+        return copy.deepcopy(cfg)
 
     # Load/create records for a Robot
     def init_from_db(self, robot_id):
         device, created = MoxieDevice.objects.get_or_create(device_id=robot_id)
-        curr_cfg = HiveConfiguration.objects.filter(name='default').first()
         device.last_connect = timezone.now()
         if created:
             logger.info(f'Created new model for this device {robot_id}')
@@ -127,18 +169,24 @@ class RobotData:
             if schedule:
                 logger.info(f'Setting schedule to {schedule}')
                 device.schedule = schedule
-                self._robot_map[robot_id] = { "schedule": schedule.schedule }
+                rec = RobotRecord(schedule=schedule.schedule)
             else:
                 logger.warning('Failed to locate default schedule.')
+                rec = RobotRecord(schedule=DEFAULT_SCHEDULE)
         else:
             logger.info(f'Existing model for this device {robot_id}')
-            self._robot_map[robot_id] = { "schedule": device.schedule.schedule if device.schedule else DEFAULT_SCHEDULE }
+            rec = RobotRecord(schedule=device.schedule.schedule if device.schedule else DEFAULT_SCHEDULE)
+        # remember the saved battery level so state reports can carry it forward
+        self._state_ingest.remember_battery(robot_id, device.state)
         # build our config
-        self._robot_map[robot_id]["config"] = self.build_config(device, curr_cfg)
+        rec.config = self.build_config(device)
         # load our robot's persistent data
         persistent_data, persistent_data_created = PersistentData.objects.get_or_create(device=device, defaults={'data': {}})
-        self._robot_map[robot_id]["persistent_data"] = persistent_data
+        rec.persistent_data = persistent_data
+        self._persist_ingest.track(robot_id, persistent_data)
         device.save()
+        # only visible to other threads once complete
+        self._robot_map.publish(robot_id, rec)
 
     # Finalize device record on disconnect
     def release_to_db(self, robot_id):
@@ -146,77 +194,76 @@ class RobotData:
         if device:
             device.last_disconnect = timezone.now()
             device.save()
-        # save persistent data for the robot
-        pdata = self._robot_map.get(robot_id, {}).get("persistent_data")
-        if pdata:
-            pdata.save()
 
     # Get persist record, cached or from db
     def get_persist_for_device(self, device:MoxieDevice):
-        if device.device_id in self._robot_map:
-            prec = self._robot_map[device.device_id].get("persistent_data")
-            return prec.data if prec else {}
+        rec = self._robot_map.get(device.device_id)
+        if rec:
+            return rec.persistent_data.data if rec.persistent_data else {}
         else:
             persistent_data, persistent_data_created = PersistentData.objects.get_or_create(device=device, defaults={'data': {}})
             return persistent_data.data
     
     # Get the active configuration for a device from the database objects
     def get_config_for_device(self, device):
-        curr_cfg = HiveConfiguration.objects.filter(name='default').first()
-        return self.build_config(device, curr_cfg)
+        return self.build_config(device)
     
     # Update an active device config, and return if the device is connected and needs the config provided
     def config_update_live(self, device):
         if self.device_online(device.device_id):
-            self._robot_map[device.device_id]["config"] = self.get_config_for_device(device)
+            self._robot_map.update(device.device_id, loaded_only=False, config=self.get_config_for_device(device))
             return True
         return False
     
     # Get the cached config record for a robot
     def get_config(self, robot_id):
-        robot_rec = self._robot_map.get(robot_id, {})
-        cfg = robot_rec.get("config", DEFAULT_COMBINED_CONFIG)
+        robot_rec = self._robot_map.get(robot_id)
+        cfg = robot_rec.config if robot_rec and robot_rec.config else DEFAULT_COMBINED_CONFIG
         logger.debug(f'Providing config {cfg} to {robot_id}')
         return cfg
 
     # Create a data record to connect to a volley for processing
     def get_volley_data(self, robot_id):
-        robot_rec = self._robot_map.get(robot_id, {})
-        data = { "config": robot_rec.get("config", DEFAULT_COMBINED_CONFIG),
-                 "state": robot_rec.get("state", {})
+        robot_rec = self._robot_map.get(robot_id) or RobotRecord()
+        data = { "config": robot_rec.config or DEFAULT_COMBINED_CONFIG,
+                 "state": robot_rec.state
                 }
         # persist is linked to the data record of our model object
-        prec = robot_rec.get("persistent_data")
+        prec = robot_rec.persistent_data
         data["persist"] = prec.data if prec else {}
         return data
 
-    # Save robot state data
+    # Save robot state data, written to the database in batches by the state ingest
     def put_state(self, robot_id, state):
-        run_db_atomic(self.update_state_atomic, robot_id, state)
-        rec = self._robot_map.get(robot_id)
-        if rec:
-            # only add to a non-empty (initialized) record
-            rec["state"] = state
+        state = self._state_ingest.put(robot_id, state)
+        # only add to a loaded (initialized) record
+        self._robot_map.update(robot_id, state=state)
 
     def put_puppet_state(self, robot_id, state):
-        rec = self._robot_map.get(robot_id)
-        if rec:
-            # only add to a live record
-            rec["puppet_state"] = state
+        # only add to a live record
+        self._robot_map.update(robot_id, puppet_state=state)
 
     def get_puppet_state(self, robot_id):
         rec = self._robot_map.get(robot_id)
-        return rec.get("puppet_state") if rec else None
+        return rec.puppet_state if rec else None
     
-    # Update the device record with the state data
-    def update_state_atomic(self, robot_id, state):
-        device = MoxieDevice.objects.get(device_id=robot_id)
-        if "battery_level" not in state and "battery_level" in device.state:
-            # sometimes state is missing the battery key, use the previous one if it isnt included
-            state["battery_level"] = device.state["battery_level"]
-        device.state = state
-        device.state_updated = timezone.now()
-        device.save()
+    # Counters for the state write-behind
+    def state_metrics(self):
+        return self._state_ingest.metrics()
+
+    # Counters for the persistent data checkpoints
+    def persist_metrics(self):
+        return self._persist_ingest.metrics()
+
+    # Counters for the memoized robot configs
+    def config_metrics(self):
+        with self._config_lock:
+            return { "devices": len(self._config_memo), "hits": self._config_hits, "builds": self._config_builds }
+
+    # Flush anything not yet written to the database
+    def shutdown(self):
+        self._state_ingest.shutdown()
+        self._persist_ingest.shutdown()
 
     # Get all the mentor behaviors for a specific robot, in most recent first order
     def extract_mbh_atomic(self, robot_id):
@@ -265,8 +312,8 @@ class RobotData:
 
     # Get the current schedule for the robot, typically expanded when including a generate block
     def get_schedule(self, robot_id, expand=True):
-        robot_rec = self._robot_map.get(robot_id, {})
-        s = robot_rec.get("schedule", DEFAULT_SCHEDULE)
+        robot_rec = self._robot_map.get(robot_id)
+        s = robot_rec.schedule if robot_rec and robot_rec.schedule is not None else DEFAULT_SCHEDULE
         if expand:
             # do any custom schedule automatic generation
             s = expand_schedule(s, robot_id)
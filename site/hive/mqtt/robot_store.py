@@ -0,0 +1,176 @@
+'''
+ROBOT STORE - Thread safe cache of the records for online robots
+
+Robot records are touched by the MQTT network thread (connect detection), the worker shards
+(load, release, state) and web requests (live config updates).  The RobotStore splits the
+records over N stripes, each a dict with its own lock, so operations on one device are atomic
+without every device contending on a single lock.  A record is claimed empty when a connect
+is first seen, and only published as loaded once it is fully built, so readers never see a
+half initialized record.
+'''
+import threading
+import zlib
+
+_DEFAULT_STRIPES = 16
+
+'''
+In memory data for one online robot.  Records are replaced whole when loaded, and fields are
+only written through the RobotStore, under the stripe lock.
+'''
+class RobotRecord:
+    __slots__ = ("loaded", "schedule", "config", "state", "puppet_state", "persistent_data")
+
+    def __init__(self, schedule=None, config=None, persistent_data=None, loaded=False):
+        self.loaded = loaded
+        self.schedule = schedule
+        self.config = config
+        self.state = {}
+        self.puppet_state = None
+        self.persistent_data = persistent_data
+
+class _Stripe:
+    __slots__ = ("lock", "records")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+
+class RobotStore:
+    def __init__(self, stripes=_DEFAULT_STRIPES):
+        self._stripes = [ _Stripe() for _ in range(max(1, stripes)) ]
+
+    def _stripe(self, robot_id):
+        return self._stripes[zlib.crc32(robot_id.encode("utf-8")) % len(self._stripes)]
+
+    # Add an empty record if there is none, True only for the one caller that added it
+    def claim(self, robot_id):
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            if robot_id in stripe.records:
+                return False
+            stripe.records[robot_id] = RobotRecord()
+            return True
+
+    # Store a fully built record, replacing any claimed or older one
+    def publish(self, robot_id, record):
+        record.loaded = True
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            stripe.records[robot_id] = record
+
+    # Remove and return the record, or None when the robot wasn't online
+    def pop(self, robot_id):
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            return stripe.records.pop(robot_id, None)
+
+    def get(self, robot_id):
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            return stripe.records.get(robot_id)
+
+    def is_loaded(self, robot_id):
+        rec = self.get(robot_id)
+        return rec is not None and rec.loaded
+
+    # Set fields on a record, only once loaded unless loaded_only is False.  True if it was updated.
+    def update(self, robot_id, loaded_only=True, **fields):
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            rec = stripe.records.get(robot_id)
+            if rec is None or (loaded_only and not rec.loaded):
+                return False
+            for name, value in fields.items():
+                setattr(rec, name, value)
+            return True
+
+    def __contains__(self, robot_id):
+        stripe = self._stripe(robot_id)
+        with stripe.lock:
+            return robot_id in stripe.records
+
+    def keys(self):
+        ids = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                ids.extend(stripe.records.keys())
+        return ids
+
+    def __len__(self):
+        return sum(len(stripe.records) for stripe in self._stripes)
+
+
+if __name__ == "__main__":
+    # Stress: many threads racing connects, disconnects, updates and reads on a small set of robots
+    import random
+    import time
+
+    store = RobotStore()
+    robots = [ f"d_stress{i:03d}" for i in range(64) ]
+    errors = []
+    claims = { rid: 0 for rid in robots }
+    claims_lock = threading.Lock()
+    # connect and release for one robot run in order on its worker shard, like the server
+    shard_locks = { rid: threading.Lock() for rid in robots }
+
+    # All threads claim the same robot at once, exactly one may win
+    def race_claims(rounds, threads):
+        barrier = threading.Barrier(threads)
+        for r in range(rounds):
+            rid = f"d_race{r:04d}"
+            wins = []
+            def contender():
+                barrier.wait()
+                if store.claim(rid):
+                    wins.append(1)
+            pool = [ threading.Thread(target=contender) for _ in range(threads) ]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            if len(wins) != 1:
+                errors.append(f"{rid} claimed {len(wins)} times")
+            store.pop(rid)
+
+    def churn(seed, deadline):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            rid = rng.choice(robots)
+            op = rng.random()
+            if op < 0.25:
+                with shard_locks[rid]:
+                    if store.claim(rid):
+                        with claims_lock:
+                            claims[rid] += 1
+                        store.publish(rid, RobotRecord(schedule={"id": rid}, config={"robot": rid}))
+            elif op < 0.4:
+                with shard_locks[rid]:
+                    if store.pop(rid) is not None:
+                        with claims_lock:
+                            claims[rid] -= 1
+            elif op < 0.5:
+                ids = store.keys()
+                if len(ids) != len(set(ids)):
+                    errors.append("duplicate robots in connected list")
+            elif op < 0.6:
+                store.update(rid, state={"battery": rng.random()})
+            else:
+                rec = store.get(rid)
+                if rec is not None and rec.loaded and rec.config != {"robot": rid}:
+                    errors.append(f"{rid} loaded without its config")
+
+    start = time.monotonic()
+    race_claims(rounds=200, threads=16)
+    workers = [ threading.Thread(target=churn, args=(i, time.monotonic() + 3.0)) for i in range(32) ]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    # every robot is online at most once, and online exactly when claims outnumber releases
+    for rid, count in claims.items():
+        if count not in (0, 1) or (count == 1) != (rid in store):
+            errors.append(f"{rid} claim count {count}, online {rid in store}")
+    print(f"{len(robots)} robots, {len(store)} online, {time.monotonic() - start:.1f}s, {len(errors)} errors")
+    for e in errors[:10]:
+        print(e)
+    raise SystemExit(1 if errors else 0)
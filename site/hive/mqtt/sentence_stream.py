@@ -0,0 +1,110 @@
+'''
+SENTENCE STREAM - Sentence-at-a-time delivery of streamed LLM output
+
+Streaming providers produce small text deltas.  The SentenceSplitter turns those into
+complete sentences as soon as a sentence boundary arrives, and a SentenceStream buffers the
+sentences still waiting to be spoken so they can be handed out one at a time as Moxie asks
+for the next line.
+'''
+import collections
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Same boundary automarkup uses when it splits text into sentences
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+class SentenceSplitter:
+    def __init__(self):
+        self._buffer = ''
+
+    # Add a text delta, returns any sentences it completed
+    def feed(self, delta):
+        self._buffer += delta
+        parts = _SENTENCE_BOUNDARY.split(self._buffer)
+        self._buffer = parts.pop()
+        return [ p.strip() for p in parts if p.strip() ]
+
+    # Returns any trailing text without a sentence boundary
+    def flush(self):
+        rest = self._buffer.strip()
+        self._buffer = ''
+        return rest or None
+
+'''
+Sentences waiting to be spoken.  Nothing blocks waiting for generation: the consumer parks a
+callback with request_line(), and whichever side completes the line (the consumer when it is
+already buffered, or the producer as it arrives) calls it.  A line is only handed out once the
+one after it, or the end of the stream, is known, so the callback can tell whether it's last.
+'''
+class SentenceStream:
+    def __init__(self, overflow=False):
+        self._lock = threading.Lock()
+        self._lines = collections.deque()
+        self._closed = False
+        self._cut = False
+        self._dropped = 0
+        self._waiter = None
+        self.overflow = overflow
+
+    # Producer side, add a sentence to be spoken later
+    def put(self, sentence):
+        with self._lock:
+            if self._cut:
+                self._dropped += 1
+                return
+            self._lines.append(sentence)
+            ready = self._take_ready()
+        if ready:
+            ready()
+
+    # Producer side, no more sentences will be added
+    def close(self):
+        with self._lock:
+            self._closed = True
+            dropped = self._dropped if self._cut else 0
+            ready = self._take_ready()
+        if dropped:
+            logger.warning(f"Streamed response was cut short, dropped {dropped} sentences generated after it ended")
+        if ready:
+            ready()
+
+    # Consumer side, on_line(sentence, is_last) is called once the next line is ready, maybe
+    # right away.  The sentence is None when the stream ended without anything left to say.
+    def request_line(self, on_line):
+        with self._lock:
+            self._waiter = on_line
+            ready = self._take_ready()
+        if ready:
+            ready()
+
+    # Consumer side, generation stalled: answer a still waiting on_line with what there is, as
+    # the last line, and drop the rest.  Returns False if on_line was already answered.
+    def expire(self, on_line):
+        with self._lock:
+            if self._waiter is not on_line:
+                return False
+            self._waiter = None
+            text = self._lines.popleft() if self._lines else None
+            self._dropped += len(self._lines)
+            self._lines.clear()
+            self._cut = True
+            dropped = self._dropped
+        logger.warning(f"Streamed response stalled, ending it early ({dropped} sentences dropped so far)")
+        on_line(text, True)
+        return True
+
+    # Called under the lock, the parked callback bound to its line if one is ready
+    def _take_ready(self):
+        if self._waiter is None:
+            return None
+        if len(self._lines) >= 2:
+            text, last = self._lines.popleft(), False
+        elif self._closed:
+            text, last = (self._lines.popleft() if self._lines else None), True
+        else:
+            return None
+        on_line, self._waiter = self._waiter, None
+        return lambda: on_line(text, last)
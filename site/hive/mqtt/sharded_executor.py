@@ -0,0 +1,109 @@
+'''
+SHARDED EXECUTOR - Ordered background work queues keyed by device
+
+A plain ThreadPoolExecutor runs work in whatever order its threads pick it up, so two
+state updates from the same robot can complete out of order, and one slow robot can
+occupy every worker.  The ShardedExecutor hashes each job key (the device_id) to one of
+N shards.  Each shard is a single thread with its own bounded queue, so work for one
+device always runs in submission order, while different devices run in parallel.
+'''
+import concurrent.futures
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_SHARDS = 5
+_DEFAULT_QUEUE_DEPTH = 1000
+
+class _Shard:
+    def __init__(self, name, max_queue_depth):
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    # Queue work without blocking the caller (typically the MQTT network thread)
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def stop(self):
+        self._queue.put(None)
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    logger.exception(f"Error in worker task {getattr(fn, '__name__', fn)}:")
+                    future.set_exception(e)
+            self.completed += 1
+
+class ShardedExecutor:
+    def __init__(self, shards=_DEFAULT_SHARDS, max_queue_depth=_DEFAULT_QUEUE_DEPTH, name="worker"):
+        shards = max(1, int(shards))
+        self._max_queue_depth = max(0, int(max_queue_depth))
+        self._shards = [ _Shard(f"{name}-{i}", self._max_queue_depth) for i in range(shards) ]
+        self._shutdown = False
+        logger.info(f"Started {shards} worker shards (max queue depth {self._max_queue_depth or 'unbounded'})")
+
+    # Stable mapping of a key onto a shard, so all work for a device shares one queue
+    def shard_index(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % len(self._shards)
+
+    # Submit work for a key, returns a Future or None if the shard queue is full
+    def submit(self, key, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError("cannot schedule new work after shutdown")
+        future = concurrent.futures.Future()
+        index = self.shard_index(key)
+        if not self._shards[index].put((future, fn, args, kwargs)):
+            logger.warning(f"Worker shard {index} full, dropping {getattr(fn, '__name__', fn)} for {key}")
+            return None
+        return future
+
+    # Snapshot of queue depths and counters for each shard
+    def metrics(self):
+        shard_metrics = [ { "depth": s.depth(),
+                            "max_depth": s.max_depth,
+                            "submitted": s.submitted,
+                            "completed": s.completed,
+                            "rejected": s.rejected } for s in self._shards ]
+        return { "shards": len(self._shards),
+                 "max_queue_depth": self._max_queue_depth,
+                 "depth": sum(s["depth"] for s in shard_metrics),
+                 "rejected": sum(s["rejected"] for s in shard_metrics),
+                 "per_shard": shard_metrics }
+
+    def shutdown(self, wait=True):
+        if self._shutdown:
+            return
+        self._shutdown = True
+        for s in self._shards:
+            s.stop()
+        if wait:
+            for s in self._shards:
+                s.join()
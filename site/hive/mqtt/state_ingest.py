@@ -0,0 +1,113 @@
+'''
+STATE INGEST - Coalescing write-behind for robot state reports
+
+Robots report state often, and writing every report to the database makes SQLite write
+contention the bottleneck for a fleet.  StateIngest keeps only the latest state per device
+in memory, and a background thread flushes the dirty devices on an interval using a single
+query and a single bulk_update.  The last known battery_level is remembered per device so
+reports that omit it can carry it forward without reading the database per message.
+'''
+import logging
+import threading
+from django.utils import timezone
+from ..models import MoxieDevice
+from .util import run_db_atomic
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_FLUSH_INTERVAL = 2.0
+
+class StateIngest:
+    def __init__(self, flush_interval=_DEFAULT_FLUSH_INTERVAL):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # device_id -> (state, timestamp) for devices with unsaved state
+        self._dirty = {}
+        self._last_battery = {}
+        self._received = 0
+        self._flushed = 0
+        self._flushes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="state-ingest", daemon=True)
+        self._thread.start()
+
+    # Seed the battery level we know about, typically from the db record at connect
+    def remember_battery(self, robot_id, state):
+        if state and "battery_level" in state:
+            with self._lock:
+                self._last_battery[robot_id] = state["battery_level"]
+
+    # Accept a new state report, replacing any unsaved one for this device
+    def put(self, robot_id, state):
+        with self._lock:
+            if "battery_level" in state:
+                self._last_battery[robot_id] = state["battery_level"]
+            elif robot_id in self._last_battery:
+                # sometimes state is missing the battery key, use the previous one if it isnt included
+                state["battery_level"] = self._last_battery[robot_id]
+            self._dirty[robot_id] = (state, timezone.now())
+            self._received += 1
+        return state
+
+    # Drop in-memory data for a robot, after flushing anything unsaved
+    def release(self, robot_id):
+        self.flush([robot_id])
+        with self._lock:
+            self._last_battery.pop(robot_id, None)
+
+    # Write all (or the listed) dirty device states to the database
+    def flush(self, robot_ids=None):
+        with self._lock:
+            if robot_ids is None:
+                batch = self._dirty
+                self._dirty = {}
+            else:
+                batch = { rid: self._dirty.pop(rid) for rid in robot_ids if rid in self._dirty }
+        if not batch:
+            return 0
+        with self._flush_lock:
+            try:
+                count = run_db_atomic(self.flush_atomic, batch)
+            except Exception:
+                logger.exception("Error flushing robot state:")
+                # put back anything that hasn't been replaced by a newer report
+                with self._lock:
+                    for rid, rec in batch.items():
+                        self._dirty.setdefault(rid, rec)
+                return 0
+        with self._lock:
+            self._flushed += count
+            self._flushes += 1
+        return count
+
+    # Update the device records with the state data, one query and one bulk update
+    def flush_atomic(self, batch):
+        devices = list(MoxieDevice.objects.filter(device_id__in=batch.keys()).only('id', 'device_id', 'state'))
+        for device in devices:
+            state, updated = batch[device.device_id]
+            if "battery_level" not in state and device.state and "battery_level" in device.state:
+                # first report for this device is missing the battery key, use the saved one
+                state["battery_level"] = device.state["battery_level"]
+                self.remember_battery(device.device_id, state)
+            device.state = state
+            device.state_updated = updated
+        MoxieDevice.objects.bulk_update(devices, ['state', 'state_updated'])
+        return len(devices)
+
+    def metrics(self):
+        with self._lock:
+            return { "dirty": len(self._dirty),
+                     "received": self._received,
+                     "flushed": self._flushed,
+                     "flushes": self._flushes }
+
+    # Stop the background flush, saving anything unsaved
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
@@ -1,13 +1,13 @@
 from .moxie_zmq_handler import ZMQHandler
-from ..stt import transcribe_wav_bytes, get_stt_config, stt_health
+from ..stt import transcribe_pcm_bytes, transcribe_pcm_segments, pcm_to_wav, trim_silence, normalize_pcm, get_stt_config, get_stt_client, stt_health
+from django.conf import settings
 
 from .protos.embodied.perception.audio.zmqSTT_pb2 import zmqSTTRequest,zmqSTTResponse
-import soundfile as sf
-import numpy as np
-import io
 import time
 import logging
+import threading
 import concurrent.futures
+from collections import OrderedDict
 from .ai_factory import create_openai
 
 LOG_WAV=False
@@ -15,29 +15,166 @@ OPENAI_MODEL='whisper-1'
 _STT_HEALTH_LOGGED = False
 logger = logging.getLogger(__name__)
 
+BYTES_PER_SEC = 16000 * 2
+# Streaming mode: seconds of new audio between partial passes, and how far a segment must end
+# before the end of the audio heard so far to be treated as stable
+_PARTIAL_INTERVAL = getattr(settings, "STT_PARTIAL_INTERVAL", 1.0)
+_STABLE_MARGIN = getattr(settings, "STT_STABLE_MARGIN", 0.5)
+# Don't bother transcribing a tail shorter than this (seconds)
+_MIN_TAIL = 0.1
+# Session memory bounds: sessions without audio for this long are closed, one session buffers at
+# most this much audio, and all sessions together at most this much (oldest idle closed first)
+_IDLE_TIMEOUT = getattr(settings, "STT_SESSION_IDLE_TIMEOUT", 10.0)
+_FLUSH_ON_TIMEOUT = getattr(settings, "STT_SESSION_FLUSH_ON_TIMEOUT", True)
+_SESSION_MAX_BYTES = getattr(settings, "STT_SESSION_MAX_BYTES", 60 * BYTES_PER_SEC)
+_MAX_BUFFERED_BYTES = getattr(settings, "STT_MAX_BUFFERED_BYTES", 64 * 1024 * 1024)
+_SWEEP_INTERVAL = 1.0
+# Audio prep before the final transcription: trim silent edges (offsets are added back to the
+# timestamps), and optionally normalize the level
+_TRIM_SILENCE = getattr(settings, "STT_TRIM_SILENCE", True)
+_TRIM_THRESHOLD_DB = getattr(settings, "STT_TRIM_THRESHOLD_DB", -40.0)
+_TRIM_PAD = getattr(settings, "STT_TRIM_PAD", 0.2)
+_NORMALIZE = getattr(settings, "STT_NORMALIZE", False)
+_NORMALIZE_PEAK_DB = getattr(settings, "STT_NORMALIZE_PEAK_DB", -3.0)
+# Closed session keys remembered so late packets don't start a new session
+_CLOSED_KEYS = 1024
+
 def now_ms():
     return time.time_ns() // 1_000_000
 
+def _same_text(a, b):
+    return a.strip().lower() == b.strip().lower()
+
+# Trim and normalize audio as configured, returns (pcm, offset_sec of the audio kept)
+def prepare_audio(pcm):
+    lead = 0.0
+    if _TRIM_SILENCE:
+        pcm, lead = trim_silence(pcm, threshold_db=_TRIM_THRESHOLD_DB, pad=_TRIM_PAD)
+    if _NORMALIZE:
+        pcm = normalize_pcm(pcm, peak_db=_NORMALIZE_PEAK_DB)
+    return pcm, lead
+
 
 '''
 An STT Session is a stream of contiguous audio coming out of the Robot's voice activity detector (VAD). This
 is a very simple implementation tuned to OpenAI Whisper.  Their API doesn't support streaming, so we simply
 accumulate the audio frames, then transcribe them when complete.
+
+In streaming mode (local backend only) the growing audio is also transcribed while the child is
+still speaking, and sent as PARTIAL results.  Leading segments that come back the same in two
+passes, and end well before the audio heard so far, are committed as a stable prefix.  Later
+passes, and the FINAL transcription, only cover the audio after that prefix.
 '''
 class STTSession:
-    def __init__(self, parent, device_id, session_id):
+    def __init__(self, parent, device_id, session_id, streaming=False):
         self._parent = parent
         self._device_id = device_id
         self._session_id = session_id
         self._stream_bytes = bytearray()
         self._start_ts = None
+        self._last_activity = time.monotonic()
+        self._dropped_bytes = 0
+        self._streaming = streaming
+        # guards the audio buffer, which grows on the ZMQ thread while workers read it
+        self._lock = threading.Lock()
+        # one transcription at a time per session, partial or final
+        self._transcribe_lock = threading.Lock()
+        self._closed = False
+        self._partial_pending = False
+        self._partial_at = 0
+        # stable prefix, audio before _committed_bytes is transcribed as _committed_text
+        self._committed_bytes = 0
+        self._committed_text = []
+        self._committed_start = None
+        self._committed_end = 0.0
+        # segments from the last partial pass, relative to _committed_bytes
+        self._last_segments = []
 
     def on_request(self, req):
         # future ref, this is technically wrong in the design, this ts is realtime on robot, not audio timestamp
         if not self._start_ts:
             self._start_ts = req.timestamp
-        self._stream_bytes += req.audio_content
+        start_partial = False
+        self._last_activity = time.monotonic()
+        with self._lock:
+            room = _SESSION_MAX_BYTES - len(self._stream_bytes)
+            if len(req.audio_content) > room:
+                # over the per-session cap, keep what fits and let end of speech transcribe it
+                room = max(0, room - room % 2)
+                self._dropped_bytes += len(req.audio_content) - room
+                self._stream_bytes += req.audio_content[:room]
+            else:
+                self._stream_bytes += req.audio_content
+            total = len(self._stream_bytes)
+            if self._streaming and not self._partial_pending and total - self._partial_at >= _PARTIAL_INTERVAL * BYTES_PER_SEC:
+                self._partial_pending = True
+                self._partial_at = total
+                start_partial = True
+        if start_partial:
+            self._parent.submit_partial(self)
+        return total
+
+    @property
+    def size(self):
         return len(self._stream_bytes)
+
+    @property
+    def dropped_bytes(self):
+        return self._dropped_bytes
+
+    def idle_for(self, now):
+        return now - self._last_activity
+
+    # Commit the leading segments that agree with the last pass and have stopped changing,
+    # returns the segments still tentative
+    def _commit_stable(self, segs, window_sec):
+        stable = 0
+        for i, seg in enumerate(segs):
+            if i >= len(self._last_segments) or not _same_text(seg[2], self._last_segments[i][2]):
+                break
+            if seg[1] > window_sec - _STABLE_MARGIN:
+                break
+            stable = i + 1
+        if not stable:
+            self._last_segments = segs
+            return segs
+        base = self._committed_bytes / BYTES_PER_SEC
+        cut = segs[stable - 1][1]
+        if self._committed_start is None:
+            self._committed_start = base + segs[0][0]
+        self._committed_text.extend(seg[2].strip() for seg in segs[:stable] if seg[2].strip())
+        self._committed_end = base + cut
+        cut_bytes = int(cut * BYTES_PER_SEC)
+        self._committed_bytes += cut_bytes - cut_bytes % 2
+        self._last_segments = [ (s - cut, e - cut, t) for s, e, t in segs[stable:] ]
+        return segs[stable:]
+
+    # Transcribe the audio after the stable prefix and send a PARTIAL result
+    def perform_partial(self):
+        try:
+            with self._transcribe_lock:
+                if self._closed:
+                    return
+                with self._lock:
+                    window = bytes(self._stream_bytes[self._committed_bytes:])
+                window_sec = len(window) / BYTES_PER_SEC
+                _, segs = transcribe_pcm_segments(window, language="en")
+                tentative = self._commit_stable(segs, window_sec)
+                if self._closed:
+                    return
+                resp = zmqSTTResponse()
+                resp.uuid = self._session_id
+                resp.type = resp.ResponseType.PARTIAL
+                resp.timestamp = now_ms()
+                resp.speech = " ".join(self._committed_text + [ t.strip() for _, _, t in tentative if t.strip() ])
+                logger.debug(f"STT-PARTIAL: {resp.speech} (committed {self._committed_bytes} bytes)")
+            self._parent.zmq_reply(self._device_id, resp)
+        except Exception as e:
+            # e.g. a backend without segments, carry on with the regular final transcription
+            logger.info(f"Streaming STT disabled for session {self._session_id}: {e}")
+            self._streaming = False
+        finally:
+            self._partial_pending = False
     '''
     def perform(self):
         logger.info(f'Processing session_id {self._session_id} with {len(self._stream_bytes)} bytes')
@@ -86,16 +223,20 @@ class STTSession:
 
 
     def perform(self):
-        logger.info(f'Processing session_id {self._session_id} with {len(self._stream_bytes)} bytes')
-        buffer = io.BytesIO()
-        sf.write(
-            buffer,  # File-like object (None for bytes)
-            np.frombuffer(self._stream_bytes, dtype=np.int16),
-            16000,
-            format='WAV',
-            subtype='PCM_16'  # 16-bit PCM
-            )
-        wav_bytes = buffer.getvalue()
+        # stop further partials, and wait for one in flight so its stable prefix is used
+        self._closed = True
+        with self._transcribe_lock:
+            self.perform_final()
+
+    def perform_final(self):
+        # the session has ended, so the buffer no longer changes and goes out as-is
+        tail = self._stream_bytes if not self._committed_bytes else self._stream_bytes[self._committed_bytes:]
+        base = self._committed_bytes / BYTES_PER_SEC
+        raw_len = len(tail)
+        # times from the backend are relative to the audio sent, lead is where that starts in the tail
+        tail, lead = prepare_audio(tail)
+        logger.info(f'Processing session_id {self._session_id} with {len(self._stream_bytes)} bytes '
+                    f'({raw_len} after stable prefix, {len(tail)} after trimming)')
         # Create proto response, send regardless
         resp = zmqSTTResponse()
         resp.uuid = self._session_id
@@ -104,8 +245,7 @@ class STTSession:
 
 
         try:
-            # Log which STT backend we’re using for this utterance
-            # Log which STT backend we’re using for this utterance
+            # Log which STT backend we’re using for this utterance (cached, no database read)
             backend, url, lang = get_stt_config()
             logger.info(f"STT backend={backend} url={url} lang={lang}")
 
@@ -126,11 +266,21 @@ class STTSession:
                     logger.warning(f"STT local health check error: {e}")
                 _STT_HEALTH_LOGGED = True
 
-            text, rel_start, rel_end = transcribe_wav_bytes(wav_bytes, language="en")
+            if not self._committed_text:
+                text, rel_start, rel_end = transcribe_pcm_bytes(tail, language="en")
+                rel_start += lead
+                rel_end += lead
+            else:
+                # only the audio after the stable prefix still needs transcribing
+                tail_text, rel_start, rel_end = transcribe_pcm_bytes(tail, language="en") \
+                    if len(tail) >= _MIN_TAIL * BYTES_PER_SEC else ("", 0.0, 0.0)
+                text = " ".join(self._committed_text + ([ tail_text.strip() ] if tail_text.strip() else []))
+                rel_end = base + lead + rel_end if tail_text.strip() else self._committed_end
+                rel_start = self._committed_start
             resp.speech = text
             resp.start_timestamp = self._start_ts + int(rel_start * 1000)
             resp.end_timestamp = self._start_ts + int(rel_end * 1000)
-            logger.info(f"STT-FINAL: {text}")
+            logger.info(f"STT-FINAL: {text} timings={get_stt_client().last_timings()}")
         except Exception as e:
             logger.warning(f"Exception handling STT request: {e}")
             resp.error_code = 66
@@ -142,7 +292,7 @@ class STTSession:
         if LOG_WAV:
             logfile = f'{self._session_id}.wav'
             with open(logfile, 'wb') as f:
-                f.write(wav_bytes)
+                f.write(pcm_to_wav(self._stream_bytes))
                 logger.info(f'Wrote WAV data to {logfile}')
     
 
@@ -151,25 +301,108 @@ This is the handler for all Speech data packets.  By default, the Robot uses stt
 audio data during session to be transcribed.  If Robot is using stt:0, no STT packets will arrive here.
 This is also very simple.  We create unique sessions for each device_id / session pair, pass them all the
 data inline, and when a session hits end-of-speech, queue transcription to run in the background.
+
+A robot that disconnects or drops its end-of-speech packet would leave its session behind, so a sweeper
+thread closes sessions that stop receiving audio (transcribing what they have, or dropping it), and
+closes the oldest idle sessions first when all sessions together buffer too much audio.
 '''
 class STTHandler(ZMQHandler):
 
     def __init__(self, server):
         super().__init__(server)
         self._sessions = {}
+        self._lock = threading.Lock()
+        self._closed_keys = OrderedDict()
+        self._buffered = 0
+        # sessions closed by the sweeper, by reason
+        self._closed_by = { "timed_out": 0, "evicted": 0 }
+        self._late_packets = 0
         self._worker_queue = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+        self._streaming = getattr(settings, "STT_STREAMING", False)
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._run, name="stt-sweeper", daemon=True)
+        self._sweeper.start()
+
+    # Queue a streaming partial pass for a session still receiving audio
+    def submit_partial(self, sess):
+        self._worker_queue.submit(sess.perform_partial)
 
     def handle_zmq(self, device_id, protoname, protodata):
         req = zmqSTTRequest()
         req.ParseFromString(protodata)
         sesskey = ( device_id, req.uuid )
-        if sesskey not in self._sessions:
-            self._sessions[sesskey] = STTSession(self, sesskey[0], sesskey[1])
-        total_sess_bytes = self._sessions[sesskey].on_request(req)
+        with self._lock:
+            sess = self._sessions.get(sesskey)
+            if sess is None:
+                if sesskey in self._closed_keys:
+                    # session already closed by the sweeper, ignore the rest of it
+                    self._late_packets += 1
+                    return
+                sess = STTSession(self, sesskey[0], sesskey[1], streaming=self._streaming)
+                self._sessions[sesskey] = sess
+            before = sess.size
+            total_sess_bytes = sess.on_request(req)
+            self._buffered += total_sess_bytes - before
         # every time we reach EOS, we background it for work
         logger.debug(f'ZMQ Speech VAD: {req.vad} TotalBytes: {total_sess_bytes}')
         if req.vad == req.VADState.END_OF_SPEECH:
             logger.info(f'Session reached END OF SPEECH')
             # session is done, do the work
-            sess = self._sessions.pop(sesskey)
+            self._close(sesskey, flush=True)
+        elif self._buffered > _MAX_BUFFERED_BYTES:
+            self.sweep()
+
+    # Remove a session and either transcribe what it has or drop it
+    def _close(self, sesskey, flush, reason=None):
+        with self._lock:
+            sess = self._sessions.pop(sesskey, None)
+            if sess is None:
+                return None
+            self._buffered -= sess.size
+            if reason:
+                self._closed_by[reason] += 1
+            self._closed_keys[sesskey] = True
+            while len(self._closed_keys) > _CLOSED_KEYS:
+                self._closed_keys.popitem(last=False)
+        if sess.dropped_bytes:
+            logger.warning(f'STT session {sesskey} hit the {_SESSION_MAX_BYTES} byte cap, dropped {sess.dropped_bytes} bytes')
+        if flush:
             self._worker_queue.submit(sess.perform)
+        return sess
+
+    # Close idle sessions, then the oldest idle ones while over the global byte cap
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            by_idle = sorted(self._sessions.items(), key=lambda kv: kv[1].idle_for(now), reverse=True)
+            buffered = self._buffered
+        for sesskey, sess in by_idle:
+            if sess.idle_for(now) >= _IDLE_TIMEOUT:
+                logger.info(f'STT session {sesskey} idle for {sess.idle_for(now):.1f}s with {sess.size} bytes, closing')
+                if self._close(sesskey, flush=_FLUSH_ON_TIMEOUT, reason="timed_out"):
+                    buffered -= sess.size
+            elif buffered > _MAX_BUFFERED_BYTES:
+                logger.warning(f'STT buffered audio over {_MAX_BUFFERED_BYTES} bytes, closing session {sesskey} early')
+                if self._close(sesskey, flush=_FLUSH_ON_TIMEOUT, reason="evicted"):
+                    buffered -= sess.size
+            else:
+                break
+
+    def _run(self):
+        while not self._stop.wait(_SWEEP_INTERVAL):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error sweeping STT sessions:")
+
+    def shutdown(self):
+        self._stop.set()
+        self._worker_queue.shutdown(wait=False)
+
+    # Gauges for live sessions and buffered audio, and counters for sessions closed by the sweeper
+    def metrics(self):
+        with self._lock:
+            return { "sessions": len(self._sessions),
+                     "buffered_bytes": self._buffered,
+                     **self._closed_by,
+                     "late_packets": self._late_packets }
@@ -1,16 +1,288 @@
 # site/hive/stt.py
 from __future__ import annotations
+import io
+import logging
+import threading
+import time
+import numpy as np
 import requests
-from typing import Optional, Tuple
+import soundfile as sf
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from typing import List, Optional, Tuple
 from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .config_cache import get_hive_config
 from .models import HiveConfiguration
 from .mqtt.ai_factory import create_openai
 
 # site/hive/stt.py
 
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+def pcm_to_wav(pcm) -> bytes:
+    """Wrap 16kHz mono int16 PCM in a WAV container."""
+    buffer = io.BytesIO()
+    sf.write(
+        buffer,  # File-like object (None for bytes)
+        np.frombuffer(pcm, dtype=np.int16),
+        SAMPLE_RATE,
+        format='WAV',
+        subtype='PCM_16'  # 16-bit PCM
+        )
+    return buffer.getvalue()
+
+# Silence trimming works on 20ms frames, audio around the speech is kept so word edges aren't clipped
+_TRIM_FRAME_MS = 20
+
+def trim_silence(pcm, threshold_db: float = -40.0, pad: float = 0.2) -> Tuple[bytes, float]:
+    """
+    Cut leading and trailing frames quieter than threshold_db (dBFS, RMS) from 16kHz mono int16 PCM,
+    keeping pad seconds around the speech.  Returns (pcm, offset_sec), where offset_sec is where the
+    trimmed audio starts in the original.  Audio with no frame above the threshold is returned as-is.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame = SAMPLE_RATE * _TRIM_FRAME_MS // 1000
+    count = len(samples) // frame
+    if not count:
+        return bytes(pcm), 0.0
+    frames = samples[:count * frame].astype(np.float32).reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1)) / 32768.0
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if not loud.size:
+        return bytes(pcm), 0.0
+    pad_frames = int(pad * 1000 / _TRIM_FRAME_MS)
+    first = max(0, loud[0] - pad_frames) * frame
+    last = (loud[-1] + 1 + pad_frames) * frame
+    # a partial frame at the end is kept when the speech runs up to it
+    if last >= count * frame:
+        last = len(samples)
+    return samples[first:last].tobytes(), first / SAMPLE_RATE
+
+def normalize_pcm(pcm, peak_db: float = -3.0, max_gain_db: float = 20.0) -> bytes:
+    """Scale 16kHz mono int16 PCM so its peak is at peak_db (dBFS), boosting by at most max_gain_db."""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if not len(samples):
+        return bytes(pcm)
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+    if not peak:
+        return bytes(pcm)
+    gain = min(32767 * 10 ** (peak_db / 20) / peak, 10 ** (max_gain_db / 20))
+    if abs(gain - 1.0) < 0.01:
+        return bytes(pcm)
+    return np.clip(samples.astype(np.float32) * gain, -32768, 32767).astype(np.int16).tobytes()
+
+# Connections that record how long their TCP (and TLS) connect took, per thread
+_connect_times = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_times.ms = (time.perf_counter() - start) * 1000
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_times.ms = (time.perf_counter() - start) * 1000
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = { "http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool }
+
+'''
+Client for the STT backends.  The configuration is read from the database once and kept until
+refresh() (called when the HiveConfiguration is saved or the server reloads from the database),
+and requests to the local service go over one keep-alive session.  Each call records timings:
+connect (0 when the connection was reused), upload (sending the audio and waiting for the
+reply, less the server's own time), and the server's prep and inference times.
+'''
+class STTClient:
+    def __init__(self, pool_size=10):
+        self._lock = threading.Lock()
+        self._config = None
+        self._session = requests.Session()
+        adapter = _TimedAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # STT service URLs found to be without the /pcm endpoint (older services), these get WAV uploads
+        self._pcm_unsupported = set()
+        self._local = threading.local()
+        self._calls = 0
+        self._new_connections = 0
+        self._totals = { "connect_ms": 0.0, "upload_ms": 0.0, "prep_ms": 0.0, "inference_ms": 0.0, "total_ms": 0.0 }
+
+    def config(self) -> tuple[str, str, str]:
+        """Returns (backend, url, lang), loading it on first use after a refresh."""
+        cfg = self._config
+        if cfg is None:
+            cfg = self._load_config()
+            with self._lock:
+                self._config = cfg
+        return cfg
+
+    def refresh(self, hive_config=None):
+        """Forget the cached configuration, or replace it from a HiveConfiguration already loaded."""
+        with self._lock:
+            self._config = self._config_from(hive_config) if hive_config is not None else None
+
+    def _load_config(self):
+        return self._config_from(get_hive_config())
+
+    @staticmethod
+    def _config_from(cfg):
+        backend = (getattr(cfg, "stt_backend", None) or getattr(settings, "STT_BACKEND", "openai")).lower()
+        url     = getattr(cfg, "stt_url", None) or getattr(settings, "STT_URL", "http://127.0.0.1:8001/stt")
+        lang    = getattr(cfg, "stt_lang", None) or getattr(settings, "STT_LANG", "en")
+        return backend, url, lang
+
+    def last_timings(self) -> dict:
+        """Timings of the last call made on this thread."""
+        return getattr(self._local, "timings", {})
+
+    def metrics(self) -> dict:
+        with self._lock:
+            calls = self._calls
+            avg = { k.replace("_ms", "_avg_ms"): round(v / calls, 1) if calls else 0.0 for k, v in self._totals.items() }
+            return dict(calls=calls, new_connections=self._new_connections, **avg)
+
+    def health(self, timeout=2) -> dict:
+        backend, url, lang = self.config()
+        info = {}
+        if backend == "local":
+            try:
+                hurl = url.replace("/stt", "/health")
+                r = self._session.get(hurl, timeout=timeout)
+                r.raise_for_status()
+                info = r.json()
+            except Exception as e:
+                info = {"error": str(e)}
+        return {"backend": backend, "url": url, "lang": lang, "service": info}
+
+    def transcribe_wav(self, wav_bytes: bytes, language: Optional[str] = None) -> Tuple[str, float, float]:
+        backend, url, default_lang = self.config()
+        if backend == "local":
+            return _span(*self._post(url, language or default_lang,
+                                     files={"file": ("speech.wav", wav_bytes, "audio/wav")}))
+        return self._transcribe_openai(wav_bytes)
+
+    def transcribe_pcm(self, pcm, language: Optional[str] = None) -> Tuple[str, float, float]:
+        backend, url, default_lang = self.config()
+        if backend == "local":
+            return _span(*self._transcribe_local_pcm(url, pcm, language or default_lang))
+        return self._transcribe_openai(pcm_to_wav(pcm))
+
+    def transcribe_pcm_segments(self, pcm, language: Optional[str] = None) -> Tuple[str, List[Tuple[float, float, str]]]:
+        backend, url, default_lang = self.config()
+        if backend != "local":
+            raise ValueError(f"Segment transcription needs the local STT backend, not {backend}")
+        return self._transcribe_local_pcm(url, pcm, language or default_lang)
+
+    def _transcribe_local_pcm(self, url, pcm, lang):
+        if url not in self._pcm_unsupported:
+            try:
+                return self._post(url.rstrip("/") + "/pcm", lang, data=pcm,
+                                  headers={"Content-Type": "application/octet-stream"}, as_params=True)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in (404, 405):
+                    raise
+                logger.info(f"STT service at {url} has no /pcm endpoint, using WAV uploads")
+                self._pcm_unsupported.add(url)
+        return self._post(url, lang, files={"file": ("speech.wav", pcm_to_wav(pcm), "audio/wav")})
+
+    def _post(self, url, lang, as_params=False, **kwargs):
+        _connect_times.ms = 0.0
+        start = time.perf_counter()
+        if as_params:
+            r = self._session.post(url, params={"language": lang}, timeout=120, **kwargs)
+        else:
+            r = self._session.post(url, data={"language": lang}, timeout=120, **kwargs)
+        total_ms = (time.perf_counter() - start) * 1000
+        r.raise_for_status()
+        j = r.json()
+        connect_ms = _connect_times.ms
+        prep_ms = float(j.get("prep_ms") or 0.0)
+        inference_ms = float(j.get("transcribe_ms") or 0.0)
+        timings = { "connect_ms": round(connect_ms, 1),
+                    "upload_ms": round(max(0.0, total_ms - connect_ms - prep_ms - inference_ms), 1),
+                    "prep_ms": round(prep_ms, 1),
+                    "inference_ms": round(inference_ms, 1),
+                    "total_ms": round(total_ms, 1) }
+        self._record(timings)
+        segs = [ (float(sg.get("start", 0.0)), float(sg.get("end", 0.0)), sg.get("text", "")) for sg in (j.get("segments") or []) ]
+        return j.get("text", ""), segs
+
+    def _record(self, timings):
+        self._local.timings = timings
+        with self._lock:
+            self._calls += 1
+            if timings["connect_ms"]:
+                self._new_connections += 1
+            for k, v in timings.items():
+                self._totals[k] += v
+
+    def _transcribe_openai(self, wav_bytes: bytes) -> Tuple[str, float, float]:
+        # Remote OpenAI Whisper (legacy)
+        start = time.perf_counter()
+        client = create_openai()
+        resp = client.audio.transcriptions.create(
+            file=("speech.wav", wav_bytes),
+            model="whisper-1",
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        self._record({ "connect_ms": 0.0, "upload_ms": 0.0, "prep_ms": 0.0, "inference_ms": total_ms, "total_ms": total_ms })
+        text = getattr(resp, "text", "") or ""
+        words = getattr(resp, "words", []) or []
+        if words:
+            start = min(w.start for w in words)
+            end   = max(w.end for w in words)
+        else:
+            start = end = 0.0
+        return text, float(start), float(end)
+
+def _span(text, segs) -> Tuple[str, float, float]:
+    if segs:
+        return text, segs[0][0], segs[-1][1]
+    return text, 0.0, 0.0
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_stt_client() -> STTClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = STTClient(pool_size=getattr(settings, "STT_HTTP_POOL_SIZE", 10))
+    return _client
+
+# Pick up STT changes saved from the setup page or admin
+@receiver(post_save, sender=HiveConfiguration)
+def _hive_config_saved(sender, instance, **kwargs):
+    if instance.name == 'default':
+        refresh_stt_config(instance)
+
 def get_stt_config():
     """Public helper: returns (backend, url, lang)."""
-    return _get_stt_config()
+    return get_stt_client().config()
+
+def refresh_stt_config(hive_config=None):
+    """Drop the cached STT configuration, called when HiveConfiguration changes."""
+    get_stt_client().refresh(hive_config)
 
 def stt_health(timeout=2):
     """
@@ -22,73 +294,24 @@ def stt_health(timeout=2):
       "service": {"ok": true, "model": "...", "device": "cuda|cpu", "compute": "..."} | {"error": "..."}
     }
     """
-    backend, url, lang = _get_stt_config()
-    info = {}
-    if backend == "local":
-        try:
-            hurl = url.replace("/stt", "/health")
-            r = requests.get(hurl, timeout=timeout)
-            r.raise_for_status()
-            info = r.json()
-        except Exception as e:
-            info = {"error": str(e)}
-    return {"backend": backend, "url": url, "lang": lang, "service": info}
-
-
-def _get_stt_config() -> tuple[str, str, str]:
-    """
-    Returns (backend, url, lang).
-    backend: "local" or "openai"
-    url:     e.g. http://127.0.0.1:8001/stt
-    lang:    e.g. "en"
-    """
-    cfg = HiveConfiguration.objects.filter(name='default').first()
-    backend = (getattr(cfg, "stt_backend", None) or getattr(settings, "STT_BACKEND", "openai")).lower()
-    url     = getattr(cfg, "stt_url", None) or getattr(settings, "STT_URL", "http://127.0.0.1:8001/stt")
-    lang    = getattr(cfg, "stt_lang", None) or getattr(settings, "STT_LANG", "en")
-    return backend, url, lang
+    return get_stt_client().health(timeout)
 
 def transcribe_wav_bytes(wav_bytes: bytes, language: Optional[str] = None) -> Tuple[str, float, float]:
     """
     Returns (text, start_sec, end_sec). Start/end are relative to the start of this utterance.
     """
-    backend, url, default_lang = _get_stt_config()
-    lang = language or default_lang
-
-    if backend == "local":
-        # Call your faster-whisper microservice
-        r = requests.post(
-            url,
-            files={"file": ("speech.wav", wav_bytes, "audio/wav")},
-            data={"language": lang},
-            timeout=120
-        )
-        r.raise_for_status()
-        j = r.json()
-        text = j.get("text", "")
-        segs = j.get("segments") or []
-        if segs:
-            start = float(segs[0].get("start", 0.0))
-            end   = float(segs[-1].get("end", 0.0))
-        else:
-            start = end = 0.0
-        return text, start, end
-
-    # Remote OpenAI Whisper (legacy)
-    # NOTE: ai_factory is under hive/mqtt/
-    from .mqtt.ai_factory import create_openai
-    client = create_openai()
-    resp = client.audio.transcriptions.create(
-        file=("speech.wav", wav_bytes),
-        model="whisper-1",
-        response_format="verbose_json",
-        timestamp_granularities=["word"]
-    )
-    text = getattr(resp, "text", "") or ""
-    words = getattr(resp, "words", []) or []
-    if words:
-        start = min(w.start for w in words)
-        end   = max(w.end for w in words)
-    else:
-        start = end = 0.0
-    return text, float(start), float(end)
+    return get_stt_client().transcribe_wav(wav_bytes, language)
+
+def transcribe_pcm_bytes(pcm, language: Optional[str] = None) -> Tuple[str, float, float]:
+    """
+    Same as transcribe_wav_bytes, for raw 16kHz mono int16 PCM.  The local service takes the
+    bytes as-is, OpenAI gets them wrapped as WAV.
+    """
+    return get_stt_client().transcribe_pcm(pcm, language)
+
+def transcribe_pcm_segments(pcm, language: Optional[str] = None) -> Tuple[str, List[Tuple[float, float, str]]]:
+    """
+    Returns (text, [(start_sec, end_sec, text), ...]) from the local service, used for streaming
+    partial results.  Raises ValueError for other backends, which only return whole utterances.
+    """
+    return get_stt_client().transcribe_pcm_segments(pcm, language)
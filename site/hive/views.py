@@ -16,9 +16,9 @@ from io import BytesIO
 from .models import GlobalResponse, SinglePromptChat, MoxieDevice, MoxieSchedule, HiveConfiguration, MentorBehavior
 from .content.data import DM_MISSION_CONTENT_IDS, get_moxie_customization_groups
 from .data_import import update_import_status, import_content
-from .mqtt.moxie_server import get_instance, create_service_instance
+from .mqtt.moxie_server import create_service_instance
+from .mqtt.moxie_service import get_service
 from .mqtt.robot_data import DEFAULT_ROBOT_CONFIG, DEFAULT_ROBOT_SETTINGS
-from .mqtt.volley import Volley
 import json
 import uuid
 
@@ -97,8 +97,9 @@ def _reload_local_stt(cfg):
         "compute": getattr(cfg, "stt_compute", None) or "int8",
     }
     try:
-        requests.post(f"{base}/control/reload", json=payload, timeout=6)
-        logger.info("STT hot-reload requested: %s", payload)
+        # the service loads and warms the model in the background, progress at GET /control/reload
+        r = requests.post(f"{base}/control/reload", json=payload, timeout=6)
+        logger.info("STT hot-reload requested: %s (%s)", payload, r.json().get("state"))
     except Exception as e:
         logger.warning("STT hot-reload failed: %s", e)
 
@@ -172,7 +173,7 @@ def hive_configure(request):
     # reload any cached db objects
     logger.info("Updated default Hive Configuration")
     # Ensure the Moxie server is running before reloading config
-    srv = get_instance()
+    srv = get_service()
     if srv is None:
         ep = settings.MQTT_ENDPOINT
         try:
@@ -184,7 +185,10 @@ def hive_configure(request):
             logger.warning(f"Could not initialize Moxie server: {e}")
             srv = None
     if srv:
-        srv.update_from_database()
+        try:
+            srv.update_from_database()
+        except Exception as e:
+            logger.warning(f"Moxie server reload failed: {e}")
     else:
         logger.warning("Moxie server not running; skipped live reload.")
     return HttpResponseRedirect(reverse("hive:dashboard"))
@@ -201,7 +205,11 @@ class DashboardView(generic.TemplateView):
         context['recent_devices'] = MoxieDevice.objects.all()
         context['conversations'] = SinglePromptChat.objects.all()
         context['schedules'] = MoxieSchedule.objects.all()
-        context['live'] = get_instance().robot_data().connected_list()
+        try:
+            context['live'] = get_service().connected_list()
+        except Exception as e:
+            logger.warning(f"Moxie server unavailable for dashboard: {e}")
+            context['live'] = []
         return context
 
 # INTERACT - Chat with a remote conversation
@@ -222,27 +230,17 @@ def interact_update(request):
     token = request.POST['token']
     module_id = request.POST['module_id']
     content_id = request.POST['content_id'].split('|')[0]
-    session = get_instance().get_web_session_for_module(token, module_id, content_id)
-    volley = Volley.request_from_speech(speech, device_id=token, module_id=module_id, content_id=content_id, local_data=session.local_data)
-    # Check global responses manually
-    gresp = get_instance().get_web_session_global_response(volley) if speech else None
-    if gresp:
-        line = gresp
-        details = {}
-    else:
-        session.handle_volley(volley)
-        line = volley.debug_response_string()
-        details = volley.response
+    line, details = get_service().web_chat(token, module_id, content_id, speech)
     return JsonResponse({'message': line, 'details': details})
 
 # RELOAD - Reload any records initialized from the database
 def reload_database(request):
-    get_instance().update_from_database()
+    get_service().update_from_database()
     return redirect('hive:dashboard_alert', alert_message='Updated from database.')
 
 # ENDPOINT - Render QR code to migrate Moxie
 def endpoint_qr(request):
-    img = qrcode.make(get_instance().get_endpoint_qr_data())
+    img = qrcode.make(get_service().get_endpoint_qr_data())
     buffer = BytesIO()
     img.save(buffer, 'PNG')
     buffer.seek(0)
@@ -259,7 +257,7 @@ def wifi_qr(request):
     password = request.POST['password']
     band_id = request.POST['frequency']
     hidden = 'hidden' in request.POST
-    img = qrcode.make(get_instance().get_wifi_qr_data(ssid, password, band_id, hidden))
+    img = qrcode.make(get_service().get_wifi_qr_data(ssid, password, band_id, hidden))
     buffer = BytesIO()
     img.save(buffer, 'PNG')
     buffer.seek(0)
@@ -272,7 +270,7 @@ class MoxieView(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['active_config'] = get_instance().robot_data().get_config_for_device(self.object)
+        context['active_config'] = get_service().device_config(self.object.pk)
         context['schedules'] = MoxieSchedule.objects.all()
         return context
 
@@ -297,7 +295,7 @@ def moxie_edit(request, pk):
         # pairing/unpairing
         device.robot_config["pairing_status"] = request.POST["pairing_status"]
         device.save()
-        get_instance().handle_config_updated(device)
+        get_service().device_updated(device.pk)
     except MoxieDevice.DoesNotExist as e:
         logger.warning("Moxie update for unfound pk {pk}")
     return HttpResponseRedirect(reverse("hive:dashboard"))
@@ -310,7 +308,7 @@ class MoxieFaceView(generic.DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['assets'] = get_moxie_customization_groups()
-        context['face_options'] = get_instance().robot_data().get_config_for_device(self.object).get('child_pii', {}).get('face_options', [])
+        context['face_options'] = get_service().device_config(self.object.pk).get('child_pii', {}).get('face_options', [])
         return context
 
 # FACE-POST - Save changes to a Moxie Face
@@ -338,7 +336,7 @@ def face_edit(request, pk):
             suffix = " - Created new child ID"
 
         device.save()
-        get_instance().handle_config_updated(device)
+        get_service().device_updated(device.pk)
         return redirect('hive:dashboard_alert', alert_message=f'Updated face for {device}{suffix}')
     except MoxieDevice.DoesNotExist as e:
         logger.warning("Moxie update for unfound pk {pk}")
@@ -357,8 +355,8 @@ def puppet_api(request, pk):
         if request.method == 'GET':
             # Handle GET request
             result = { 
-                "online": get_instance().robot_data().device_online(device.device_id),
-                "puppet_state": get_instance().robot_data().get_puppet_state(device.device_id),
+                "online": get_service().device_online(device.device_id),
+                "puppet_state": get_service().get_puppet_state(device.device_id),
                 "puppet_enabled": device.robot_config.get("moxie_mode") == "TELEHEALTH" if device.robot_config else False
             }
             return JsonResponse(result)
@@ -370,16 +368,16 @@ def puppet_api(request, pk):
             if cmd == "enable":
                 device.robot_config["moxie_mode"] = "TELEHEALTH"
                 device.save()
-                get_instance().handle_config_updated(device)
+                get_service().device_updated(device.pk)
             elif cmd == "disable":
                 device.robot_config.pop("moxie_mode", None)
                 device.save()
-                get_instance().handle_config_updated(device)
+                get_service().device_updated(device.pk)
             elif cmd == "interrupt":
-                get_instance().send_telehealth_interrupt(device.device_id)
+                get_service().send_telehealth_interrupt(device.device_id)
             elif cmd == "speak":
-                get_instance().send_telehealth_speech(device.device_id, request.POST['speech'], 
-                                                      request.POST['mood'], float(request.POST['intensity']))
+                get_service().send_telehealth_speech(device.device_id, request.POST['speech'],
+                                                     request.POST['mood'], float(request.POST['intensity']))
         return JsonResponse({'result': True})
     except MoxieDevice.DoesNotExist as e:
         logger.warning("Moxie puppet speak for unfound pk {pk}")
@@ -417,7 +415,7 @@ def mission_edit(request, pk):
                 msg = f'Forgot {len(mission_sets)} Daily Mission Sets ({len(dm_cid_list)} missions) for {device}'
             else: # == "complete"
                 # Create new completions for all these mission content IDs
-                get_instance().robot_data().add_mbh_completion_bulk(device.device_id, module_id="DM", content_id_list=dm_cid_list)
+                get_service().complete_missions(device.device_id, "DM", dm_cid_list)
                 msg = f'Completed {len(mission_sets)} Daily Mission Sets ({len(dm_cid_list)} missions) for {device}'
 
         return redirect('hive:dashboard_alert', alert_message=msg)
@@ -430,7 +428,7 @@ def moxie_wake(request, pk):
     try:
         device = MoxieDevice.objects.get(pk=pk)
         logger.info(f'Waking up {device}')
-        alert_msg = "Wake message sent!" if get_instance().send_wakeup_to_bot(device.device_id) else 'Moxie was offline.'
+        alert_msg = "Wake message sent!" if get_service().send_wakeup_to_bot(device.device_id) else 'Moxie was offline.'
         return redirect('hive:dashboard_alert', alert_message=alert_msg)
     except MoxieDevice.DoesNotExist as e:
         logger.warning("Moxie wake for unfound pk {pk}")
@@ -509,7 +507,7 @@ def import_data(request):
     # finally import the data
     message = import_content(json_data, g_list, s_list, c_list)
     # and refresh all things
-    get_instance().update_from_database()
+    get_service().update_from_database()
     return redirect('hive:dashboard_alert', alert_message=message)
 
 # MOXIE - View Moxie Data
@@ -519,6 +517,6 @@ class MoxieDataView(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['active_config'] = json.dumps(get_instance().robot_data().get_config_for_device(self.object))
-        context['persist_data'] = json.dumps(get_instance().robot_data().get_persist_for_device(self.object))
+        context['active_config'] = json.dumps(get_service().device_config(self.object.pk))
+        context['persist_data'] = json.dumps(get_service().device_persist(self.object.pk))
         return context
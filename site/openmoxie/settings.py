@@ -25,6 +25,32 @@ MQTT_ENDPOINT = {
     "cert_required": False,
 }
 
+# Where the MQTT service runs: "embedded" in every Django process, or "remote" in the single
+# moxie_service process (manage.py moxie_service), which web workers reach at MOXIE_SERVICE_ADDR
+MOXIE_SERVICE_MODE = os.getenv("MOXIE_SERVICE_MODE", "embedded")
+MOXIE_SERVICE_ADDR = os.getenv("MOXIE_SERVICE_ADDR", "127.0.0.1:8765")
+# Shared secret for the service IPC, required unless MOXIE_SERVICE_ADDR is loopback and SECRET_KEY is private
+MOXIE_SERVICE_AUTHKEY = os.getenv("MOXIE_SERVICE_AUTHKEY", None)
+MOXIE_SERVICE_TIMEOUT = float(os.getenv("MOXIE_SERVICE_TIMEOUT", "30.0"))
+
+# Background work for device events is sharded by device_id, so one robot's events run in order
+MOXIE_WORKER_SHARDS = int(os.getenv("MOXIE_WORKER_SHARDS", "5"))
+MOXIE_WORKER_QUEUE_DEPTH = int(os.getenv("MOXIE_WORKER_QUEUE_DEPTH", "1000"))
+# Seconds between a robot connecting and its config push, scheduled without holding a worker
+MOXIE_CONNECT_DELAY = float(os.getenv("MOXIE_CONNECT_DELAY", "1.0"))
+# Config changes for a device within this many seconds go out as one publish, identical configs are never resent
+MOXIE_CONFIG_BATCH_WINDOW = float(os.getenv("MOXIE_CONFIG_BATCH_WINDOW", "0.5"))
+# Workers shared by METHOD global responses, and the time limit for each run (seconds)
+MOXIE_METHOD_WORKERS = int(os.getenv("MOXIE_METHOD_WORKERS", "4"))
+MOXIE_METHOD_TIMEOUT = float(os.getenv("MOXIE_METHOD_TIMEOUT", "10.0"))
+# Automarkup results kept in an LRU cache, and the seed that keeps cached markup deterministic (empty for unseeded)
+MOXIE_AUTOMARKUP_CACHE_SIZE = int(os.getenv("MOXIE_AUTOMARKUP_CACHE_SIZE", "512"))
+MOXIE_AUTOMARKUP_SEED = int(os.getenv("MOXIE_AUTOMARKUP_SEED", "0")) if os.getenv("MOXIE_AUTOMARKUP_SEED", "0") else None
+# Robot state reports are coalesced in memory and written to the database on this interval (seconds)
+MOXIE_STATE_FLUSH_INTERVAL = float(os.getenv("MOXIE_STATE_FLUSH_INTERVAL", "2.0"))
+# Seconds between checkpoints of changed robot persistent data, also saved on disconnect
+MOXIE_PERSIST_FLUSH_INTERVAL = float(os.getenv("MOXIE_PERSIST_FLUSH_INTERVAL", "30.0"))
+
 # ---- Local LLM / Provider toggle ----
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama")   # "ollama" | "openai | xai"
 
@@ -33,6 +59,9 @@ OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 #OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")   # e.g. llama3, mistral, qwen2, gemma2, phi4
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")   # e.g. llama3, mistral, qwen2, gemma2, phi4
 
+# Speak LLM responses a sentence at a time while they are generated
+MOXIE_STREAM_RESPONSES = os.getenv("MOXIE_STREAM_RESPONSES", "0") == "1"
+
 XAI_BASE_URL = os.environ.get("XAI_BASE_URL", None)  # usually not needed
 XAI_MODEL = os.environ.get("XAI_MODEL", "grok-3-mini")
 
@@ -46,6 +75,25 @@ STT_URL     = os.getenv("STT_URL", "http://127.0.0.1:8001/stt")
 STT_LANG    = os.getenv("STT_LANG", "en")
 STT_DEVICE  = os.getenv("STT_DEVICE", "auto")
 STT_COMPUTE = os.getenv("STT_COMPUTE", "int8")
+# Streaming STT (local backend), PARTIAL results while the child is still speaking
+STT_STREAMING = os.getenv("STT_STREAMING", "0") == "1"
+STT_PARTIAL_INTERVAL = float(os.getenv("STT_PARTIAL_INTERVAL", "1.0"))
+STT_STABLE_MARGIN = float(os.getenv("STT_STABLE_MARGIN", "0.5"))
+# Keep-alive connections kept open to the local STT service
+STT_HTTP_POOL_SIZE = int(os.getenv("STT_HTTP_POOL_SIZE", "10"))
+# STT session bounds: idle sessions are closed (and transcribed unless flush is off), and
+# buffered audio is capped per session and across all sessions
+STT_SESSION_IDLE_TIMEOUT = float(os.getenv("STT_SESSION_IDLE_TIMEOUT", "10.0"))
+STT_SESSION_FLUSH_ON_TIMEOUT = os.getenv("STT_SESSION_FLUSH_ON_TIMEOUT", "1") == "1"
+STT_SESSION_MAX_BYTES = int(os.getenv("STT_SESSION_MAX_BYTES", str(60 * 16000 * 2)))
+STT_MAX_BUFFERED_BYTES = int(os.getenv("STT_MAX_BUFFERED_BYTES", str(64 * 1024 * 1024)))
+# Audio prep before the final transcription: trim silent edges (dBFS threshold, seconds of padding
+# kept) and optionally normalize the peak level
+STT_TRIM_SILENCE = os.getenv("STT_TRIM_SILENCE", "1") == "1"
+STT_TRIM_THRESHOLD_DB = float(os.getenv("STT_TRIM_THRESHOLD_DB", "-40"))
+STT_TRIM_PAD = float(os.getenv("STT_TRIM_PAD", "0.2"))
+STT_NORMALIZE = os.getenv("STT_NORMALIZE", "0") == "1"
+STT_NORMALIZE_PEAK_DB = float(os.getenv("STT_NORMALIZE_PEAK_DB", "-3"))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -123,6 +171,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DATA_STORE_DIR / 'db.sqlite3',
+        # Device connects run in parallel, so transactions take the write lock up front and wait for it
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
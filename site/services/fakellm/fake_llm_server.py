@@ -0,0 +1,201 @@
+# site/services/fakellm/fake_llm_server.py
+"""
+Stand-in LLM server for offline benchmarks and tests.  It speaks the Ollama chat API and the
+OpenAI chat-completions API, streaming and not, and answers with scripted or canned text at
+a configured pace: time to first token, then tokens per second.  The same conversation always
+gets the same reply, so runs are reproducible.
+
+  uvicorn --app-dir site services.fakellm.fake_llm_server:app --port 11435
+
+Point OpenMoxie at it with OLLAMA_HOST=http://127.0.0.1:11435 for Ollama chats, and
+OPENAI_BASE_URL=http://127.0.0.1:11435/v1 (any OPENAI_API_KEY) for OpenAI chats.
+
+A script is a JSON list of {"match": regex, "response": text} checked in order against the last
+user message (case-insensitive search), with an optional final {"response": text} default.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional, List, Dict
+import asyncio, json, logging, os, re, time, uuid, zlib
+
+# --- Config via env ---
+TTFT = float(os.getenv("FAKE_LLM_TTFT", "0.3"))         # seconds to the first token
+TPS = float(os.getenv("FAKE_LLM_TPS", "30"))            # tokens per second after that
+SCRIPT = os.getenv("FAKE_LLM_SCRIPT", "")               # path to a JSON script
+MODEL_NAME = os.getenv("FAKE_LLM_MODEL", "fake-llm")
+
+logger = logging.getLogger("fakellm")
+logger.setLevel(logging.INFO)
+
+# Replies when nothing in the script matches, picked by a hash of the conversation
+_CANNED = [
+    "That sounds like a lot of fun! What was your favorite part?",
+    "Hmm, I had never thought about it that way. Can you tell me more?",
+    "Wow, that is really interesting. How did it make you feel?",
+    "I love hearing about your day. What do you want to do next?",
+    "That is a great question. Let's figure it out together, one step at a time.",
+]
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+def load_script(path):
+    if not path:
+        return []
+    with open(path) as f:
+        rules = json.load(f)
+    return [ (re.compile(r["match"], re.IGNORECASE) if r.get("match") else None, r["response"]) for r in rules ]
+
+_lock = Lock()
+_config = {"ttft": TTFT, "tps": TPS, "script": SCRIPT}
+_rules = load_script(SCRIPT)
+_stats = {"requests": 0, "streamed": 0, "tokens": 0}
+
+app = FastAPI()
+
+def _reply_for(messages: List[Dict]) -> str:
+    last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    for pattern, response in _rules:
+        if pattern is None or pattern.search(last_user):
+            return response
+    key = "\n".join(f'{m.get("role")}:{m.get("content")}' for m in messages)
+    return _CANNED[zlib.crc32(key.encode("utf-8")) % len(_CANNED)]
+
+def _tokens(text: str, limit: Optional[int]) -> List[str]:
+    tokens = _TOKEN.findall(text)
+    if isinstance(limit, int) and limit > 0:
+        tokens = tokens[:limit]
+    return tokens
+
+def _prompt_tokens(messages: List[Dict]) -> int:
+    return sum(len(_TOKEN.findall(m.get("content") or "")) for m in messages)
+
+# Yields tokens at the configured pace
+async def _paced(tokens: List[str], ttft: float, tps: float):
+    await asyncio.sleep(ttft)
+    for i, tok in enumerate(tokens):
+        if i and tps > 0:
+            await asyncio.sleep(1.0 / tps)
+        yield tok
+
+async def _complete(tokens: List[str], ttft: float, tps: float) -> str:
+    await asyncio.sleep(ttft + (max(0, len(tokens) - 1) / tps if tps > 0 else 0.0))
+    return "".join(tokens)
+
+def _begin(stream: bool, tokens: List[str]):
+    with _lock:
+        _stats["requests"] += 1
+        _stats["streamed"] += 1 if stream else 0
+        _stats["tokens"] += len(tokens)
+        return _config["ttft"], _config["tps"]
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+# --- Ollama ---
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    model = body.get("model") or MODEL_NAME
+    stream = body.get("stream", True)   # Ollama streams unless told not to
+    tokens = _tokens(_reply_for(messages), (body.get("options") or {}).get("num_predict"))
+    ttft, tps = _begin(stream, tokens)
+    start = time.perf_counter_ns()
+
+    def final(content):
+        elapsed = time.perf_counter_ns() - start
+        return {"model": model, "created_at": _now_iso(),
+                "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop",
+                "total_duration": elapsed, "load_duration": 0,
+                "prompt_eval_count": _prompt_tokens(messages), "prompt_eval_duration": int(ttft * 1e9),
+                "eval_count": len(tokens), "eval_duration": max(0, elapsed - int(ttft * 1e9))}
+
+    if not stream:
+        return JSONResponse(final(await _complete(tokens, ttft, tps)))
+
+    async def lines():
+        async for tok in _paced(tokens, ttft, tps):
+            chunk = {"model": model, "created_at": _now_iso(),
+                     "message": {"role": "assistant", "content": tok}, "done": False}
+            yield json.dumps(chunk) + "\n"
+        yield json.dumps(final("")) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/api/tags")
+def ollama_tags():
+    return {"models": [{"name": MODEL_NAME, "model": MODEL_NAME, "modified_at": _now_iso(), "size": 0,
+                        "details": {"family": "fake", "parameter_size": "0B", "quantization_level": "none"}}]}
+
+@app.get("/api/version")
+def ollama_version():
+    return {"version": "0.0.0-fake"}
+
+# --- OpenAI ---
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    model = body.get("model") or MODEL_NAME
+    stream = bool(body.get("stream"))
+    limit = body.get("max_completion_tokens") or body.get("max_tokens")
+    tokens = _tokens(_reply_for(messages), limit)
+    ttft, tps = _begin(stream, tokens)
+    cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    finish = "length" if isinstance(limit, int) and 0 < limit <= len(tokens) else "stop"
+
+    if not stream:
+        content = await _complete(tokens, ttft, tps)
+        prompt_tokens = _prompt_tokens(messages)
+        return JSONResponse({"id": cid, "object": "chat.completion", "created": created, "model": model,
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                          "finish_reason": finish}],
+                             "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                       "total_tokens": prompt_tokens + len(tokens)}})
+
+    def chunk(delta, finish_reason=None):
+        return "data: " + json.dumps({"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                                      "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}) + "\n\n"
+
+    async def events():
+        first = True
+        async for tok in _paced(tokens, ttft, tps):
+            yield chunk({"role": "assistant", "content": tok} if first else {"content": tok})
+            first = False
+        yield chunk({}, finish)
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/v1/models")
+def openai_models():
+    return {"object": "list", "data": [{"id": MODEL_NAME, "object": "model", "created": 0, "owned_by": "fakellm"}]}
+
+# --- Control ---
+class FakeConfig(BaseModel):
+    ttft: Optional[float] = None
+    tps: Optional[float] = None
+    script: Optional[str] = None
+
+# Change pacing or the script between benchmark runs
+@app.post("/control/config")
+def set_config(cfg: FakeConfig):
+    global _rules
+    with _lock:
+        if cfg.script is not None:
+            _rules = load_script(cfg.script)
+            _config["script"] = cfg.script
+        if cfg.ttft is not None:
+            _config["ttft"] = max(0.0, cfg.ttft)
+        if cfg.tps is not None:
+            _config["tps"] = max(0.0, cfg.tps)
+        logger.info(f"Config: {_config}")
+        return {"ok": True, **_config}
+
+@app.get("/health")
+def health():
+    with _lock:
+        return {"ok": True, "model": MODEL_NAME, **_config, "rules": len(_rules), **_stats}
@@ -0,0 +1,112 @@
+# site/services/stt/bench_stt.py
+"""
+Per-utterance overhead of the two STT ingest paths:
+  wav - WAV encode, multipart upload, temp file, decode (POST /stt)
+  pcm - raw int16 body, numpy conversion (POST /stt/pcm)
+
+With --url it times full round trips against a running service, and reports the service's
+prep_ms (audio handling before the model runs).  Without it, it times the same audio
+handling in-process, so it runs without a model:
+
+  python site/services/stt/bench_stt.py --seconds 1,3,5,10
+  python site/services/stt/bench_stt.py --url http://127.0.0.1:8001 --runs 5
+"""
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import requests
+import soundfile as sf
+
+SAMPLE_RATE = 16000
+DEFAULT_WAV = os.path.join(os.path.dirname(__file__), "..", "test01_20s.wav")
+
+def load_pcm(path, seconds):
+    audio, rate = sf.read(path, dtype="int16")
+    if rate != SAMPLE_RATE:
+        raise SystemExit(f"{path} is {rate}Hz, need {SAMPLE_RATE}Hz")
+    need = int(seconds * SAMPLE_RATE)
+    reps = need // len(audio) + 1
+    return np.tile(audio, reps)[:need].tobytes()
+
+def wav_bytes(pcm):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.frombuffer(pcm, dtype=np.int16), SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+def decode_file(path):
+    try:
+        from faster_whisper.audio import decode_audio
+        return decode_audio(path, sampling_rate=SAMPLE_RATE)
+    except ImportError:
+        return sf.read(path, dtype="float32")[0]
+
+# In-process: the client and service work done before the model sees the audio
+def local_wav(pcm):
+    data = wav_bytes(pcm)
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+        tmp.write(data)
+        path = tmp.name
+    try:
+        return decode_file(path)
+    finally:
+        os.remove(path)
+
+def local_pcm(pcm):
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def remote_wav(url, pcm):
+    r = requests.post(f"{url}/stt", files={"file": ("speech.wav", wav_bytes(pcm), "audio/wav")},
+                      data={"language": "en"}, timeout=120)
+    r.raise_for_status()
+    return r.json()
+
+def remote_pcm(url, pcm):
+    r = requests.post(f"{url}/stt/pcm", data=pcm, params={"language": "en"},
+                      headers={"Content-Type": "application/octet-stream"}, timeout=120)
+    r.raise_for_status()
+    return r.json()
+
+def timed(fn, runs):
+    times, results = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        results.append(fn())
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark STT ingest overhead, WAV upload vs raw PCM")
+    parser.add_argument("--url", default=None, help="STT service base URL, e.g. http://127.0.0.1:8001")
+    parser.add_argument("--wav", default=DEFAULT_WAV, help="16kHz mono source audio")
+    parser.add_argument("--seconds", default="1,3,5,10", help="Comma separated utterance lengths")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per measurement (median reported)")
+    args = parser.parse_args()
+
+    if args.url:
+        url = args.url.rstrip("/")
+        if url.endswith("/stt"):
+            url = url[:-4]
+        print(f"{'seconds':>7} {'wav ms':>9} {'wav prep':>9} {'pcm ms':>9} {'pcm prep':>9} {'saved ms':>9}")
+    else:
+        print(f"{'seconds':>7} {'wav ms':>9} {'pcm ms':>9} {'saved ms':>9}")
+
+    for seconds in [float(s) for s in args.seconds.split(",") if s]:
+        pcm = load_pcm(args.wav, seconds)
+        if args.url:
+            wav_ms, wav_res = timed(lambda: remote_wav(url, pcm), args.runs)
+            pcm_ms, pcm_res = timed(lambda: remote_pcm(url, pcm), args.runs)
+            wav_prep = statistics.median(r.get("prep_ms") or 0.0 for r in wav_res)
+            pcm_prep = statistics.median(r.get("prep_ms") or 0.0 for r in pcm_res)
+            print(f"{seconds:>7.1f} {wav_ms:>9.1f} {wav_prep:>9.2f} {pcm_ms:>9.1f} {pcm_prep:>9.2f} {wav_ms - pcm_ms:>9.1f}")
+        else:
+            wav_ms, _ = timed(lambda: local_wav(pcm), args.runs)
+            pcm_ms, _ = timed(lambda: local_pcm(pcm), args.runs)
+            print(f"{seconds:>7.1f} {wav_ms:>9.2f} {pcm_ms:>9.2f} {wav_ms - pcm_ms:>9.2f}")
+
+if __name__ == "__main__":
+    main()
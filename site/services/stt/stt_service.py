@@ -1,10 +1,13 @@
 # site/services/stt/stt_service.py
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from faster_whisper import WhisperModel
-import tempfile, os, logging
-from threading import Lock
+from faster_whisper.audio import decode_audio
+import numpy as np
+import asyncio, gc, tempfile, os, logging, time
+from collections import deque
+from threading import Condition, Lock, Thread
 from typing import Optional, List, Dict
 
 # --- Config via env ---
@@ -13,14 +16,124 @@ DEVICE     = os.getenv("STT_DEVICE", "auto")
 COMPUTE    = os.getenv("STT_COMPUTE", "int8")
 USE_VAD    = os.getenv("STT_VAD", "1") == "1"
 WORDS      = os.getenv("STT_WORDS", "0") == "1"
+SAMPLE_RATE = 16000
+# Concurrent transcriptions, requests waiting beyond that, and what to do when the queue is full:
+# "reject" turns away the new request, "shed" drops the oldest waiting one in its favor
+WORKERS      = max(1, int(os.getenv("STT_WORKERS", "1")))
+QUEUE_DEPTH  = max(0, int(os.getenv("STT_QUEUE_DEPTH", "16")))
+QUEUE_POLICY = os.getenv("STT_QUEUE_POLICY", "reject").lower()
 
 logger = logging.getLogger("stt")
 logger.setLevel(logging.INFO)
 
+class QueueFull(Exception):
+    pass
+
+class InferencePool:
+    '''
+    Runs transcriptions on a fixed set of worker threads, fed by one bounded queue, so the
+    event loop never blocks on the model and a long utterance only occupies one worker.  The
+    model is loaded with num_workers to match, which lets faster-whisper run that many
+    transcriptions in parallel on one copy of the weights.
+    '''
+    def __init__(self, workers, queue_depth, policy):
+        self._workers = workers
+        self._queue_depth = queue_depth
+        self._policy = policy
+        self._queue = deque()
+        self._cond = Condition()
+        self._busy = 0
+        self._max_depth = 0
+        self._completed = 0
+        self._errors = 0
+        self._rejected = 0
+        self._shed = 0
+        self._audio_sec = 0.0
+        self._busy_sec = 0.0
+        self._last_rtf = None
+        for i in range(workers):
+            Thread(target=self._run, name=f"stt-worker-{i}", daemon=True).start()
+
+    @property
+    def workers(self):
+        return self._workers
+
+    # Queue fn(model) for a worker, audio_sec is the audio duration for real-time-factor metrics
+    async def submit(self, fn, audio_sec):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = (loop, future, fn, audio_sec)
+        with self._cond:
+            # an idle worker takes the job straight away, it never waits in the queue
+            waiting = len(self._queue) - (self._workers - self._busy)
+            if waiting >= self._queue_depth:
+                if self._policy != "shed" or not self._queue:
+                    self._rejected += 1
+                    raise QueueFull(f"STT queue full ({self._queue_depth} waiting)")
+                old_loop, old_future, _, _ = self._queue.popleft()
+                self._shed += 1
+                old_loop.call_soon_threadsafe(_set_exception, old_future, QueueFull("Shed for a newer request"))
+            self._queue.append(job)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._cond.notify()
+        return await future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                loop, future, fn, audio_sec = self._queue.popleft()
+                self._busy += 1
+            start = time.perf_counter()
+            try:
+                result = fn(model)
+                loop.call_soon_threadsafe(_set_result, future, result)
+                ok = True
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+                ok = False
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self._busy -= 1
+                if ok:
+                    self._completed += 1
+                    self._audio_sec += audio_sec
+                    self._busy_sec += elapsed
+                    self._last_rtf = elapsed / audio_sec if audio_sec else None
+                else:
+                    self._errors += 1
+
+    def metrics(self):
+        with self._cond:
+            return {"workers": self._workers,
+                    "busy": self._busy,
+                    "queue_depth": len(self._queue),
+                    "max_queue_depth": self._max_depth,
+                    "queue_limit": self._queue_depth,
+                    "queue_policy": self._policy,
+                    "completed": self._completed,
+                    "errors": self._errors,
+                    "rejected": self._rejected,
+                    "shed": self._shed,
+                    "audio_sec": round(self._audio_sec, 3),
+                    # processing time per second of audio, below 1.0 is faster than real time
+                    "rtf": round(self._busy_sec / self._audio_sec, 4) if self._audio_sec else None,
+                    "last_rtf": round(self._last_rtf, 4) if self._last_rtf is not None else None}
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future, e):
+    if not future.done():
+        future.set_exception(e)
+
 app = FastAPI()
-logger.info(f"Loading model: {MODEL_NAME} (device={DEVICE}, compute={COMPUTE})")
+logger.info(f"Loading model: {MODEL_NAME} (device={DEVICE}, compute={COMPUTE}, workers={WORKERS})")
 model_lock = Lock()
-model = WhisperModel(MODEL_NAME, device=DEVICE, compute_type=COMPUTE)
+model = WhisperModel(MODEL_NAME, device=DEVICE, compute_type=COMPUTE, num_workers=WORKERS)
+pool = InferencePool(WORKERS, QUEUE_DEPTH, QUEUE_POLICY)
 
 class STTSegment(BaseModel):
     start: float
@@ -31,12 +144,55 @@ class STTResponse(BaseModel):
     text: str
     language: str | None = None
     segments: list[STTSegment]
+    # time spent getting the audio ready, and transcribing it
+    prep_ms: float | None = None
+    transcribe_ms: float | None = None
 
 class ReloadConfig(BaseModel):
     model: Optional[str] = None          # e.g. "/models/faster-whisper-small.en"
     device: Optional[str] = None         # "auto"|"cpu"|"cuda"
     compute: Optional[str] = None        # "int8"|"int8_float16"|"float16"|"float32"
 
+# Transcribe 16kHz float32 mono audio, the format faster-whisper decodes files into
+async def _transcribe(audio, language, translate, initial_prompt, prep_ms):
+    try:
+        return await pool.submit(lambda m: _run_transcribe(m, audio, language, translate, initial_prompt, prep_ms),
+                                 len(audio) / SAMPLE_RATE)
+    except QueueFull as e:
+        logger.warning(f"STT request refused: {e}")
+        return JSONResponse(status_code=503, content={"error": str(e)})
+
+def _run_transcribe(model, audio, language, translate, initial_prompt, prep_ms):
+    start = time.perf_counter()
+    segments, info = model.transcribe(
+        audio,
+        language=language,
+        task="translate" if translate else "transcribe",
+        vad_filter=USE_VAD,
+        word_timestamps=WORDS,
+        initial_prompt=initial_prompt,
+    )
+
+    out_text, out_segments = [], []
+    for s in segments:
+        out_text.append(s.text)
+        out_segments.append({"start": s.start, "end": s.end, "text": s.text})
+
+    text = " ".join(out_text).strip()
+    transcribe_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"STT result: chars={len(text)} segments={len(out_segments)} lang={info.language} prep_ms={prep_ms:.1f} transcribe_ms={transcribe_ms:.1f}")
+    return {"text": text, "language": info.language, "segments": out_segments,
+            "prep_ms": prep_ms, "transcribe_ms": transcribe_ms}
+
+def _decode_upload(data, suffix):
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        return decode_audio(tmp_path, sampling_rate=SAMPLE_RATE)
+    finally:
+        os.remove(tmp_path)
+
 @app.post("/stt", response_model=STTResponse)
 async def stt(
     file: UploadFile = File(...),
@@ -45,33 +201,34 @@ async def stt(
     translate: bool = Form(False),
 ):
     try:
+        start = time.perf_counter()
         suffix = os.path.splitext(file.filename or ".wav")[1]
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            data = await file.read()
-            tmp.write(data)
-            tmp_path = tmp.name
-
+        data = await file.read()
         logger.info(f"STT request: {file.filename=} size={len(data)} lang={language} vad={USE_VAD}")
+        # file I/O and ffmpeg decoding block, keep them off the event loop
+        audio = await asyncio.to_thread(_decode_upload, data, suffix)
+        return await _transcribe(audio, language, translate, initial_prompt, (time.perf_counter() - start) * 1000)
 
-        segments, info = model.transcribe(
-            tmp_path,
-            language=language,
-            task="translate" if translate else "transcribe",
-            vad_filter=USE_VAD,
-            word_timestamps=WORDS,
-            initial_prompt=initial_prompt,
-        )
-
-        out_text, out_segments = [], []
-        for s in segments:
-            out_text.append(s.text)
-            out_segments.append({"start": s.start, "end": s.end, "text": s.text})
-
-        os.remove(tmp_path)
+    except Exception as e:
+        logger.exception("STT failure")
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
-        text = " ".join(out_text).strip()
-        logger.info(f"STT result: chars={len(text)} segments={len(out_segments)} lang={info.language}")
-        return {"text": text, "language": info.language, "segments": out_segments}
+# Raw 16kHz mono int16 PCM in the request body, no container, temp file or decoder involved
+@app.post("/stt/pcm", response_model=STTResponse)
+async def stt_pcm(
+    request: Request,
+    language: str | None = None,
+    initial_prompt: str | None = None,
+    translate: bool = False,
+):
+    try:
+        start = time.perf_counter()
+        data = await request.body()
+        if len(data) % 2:
+            return JSONResponse(status_code=400, content={"error": "PCM body must be whole int16 samples"})
+        logger.info(f"STT PCM request: size={len(data)} lang={language} vad={USE_VAD}")
+        audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+        return await _transcribe(audio, language, translate, initial_prompt, (time.perf_counter() - start) * 1000)
 
     except Exception as e:
         logger.exception("STT failure")
@@ -79,7 +236,8 @@ async def stt(
 
 @app.get("/health")
 def health():
-    return {"ok": True, "model": MODEL_NAME, "device": DEVICE, "compute": COMPUTE}
+    return {"ok": True, "model": MODEL_NAME, "device": DEVICE, "compute": COMPUTE, "pool": pool.metrics(),
+            "reload": _reload_status()["state"]}
 
 # ---------- Control API ----------
 def _scan_models(roots: List[str]) -> List[Dict[str, str]]:
@@ -126,20 +284,60 @@ def list_models(root: Optional[str] = None):
     roots.append(here_models)
     return {"ok": True, "models": _scan_models(roots)}
 
+# Background reload: the new model is built and warmed while the current one keeps serving
+_reload_lock = Lock()
+_reload = {"state": "idle"}
+
+def _reload_status():
+    with _reload_lock:
+        return dict(_reload)
+
+def _update_reload(**kwargs):
+    with _reload_lock:
+        _reload.update(kwargs)
+
+def _reload_worker(new_model, new_dev, new_comp):
+    global model, MODEL_NAME, DEVICE, COMPUTE
+    try:
+        start = time.perf_counter()
+        m = WhisperModel(new_model, device=new_dev, compute_type=new_comp, num_workers=pool.workers)
+        loaded = time.perf_counter()
+        _update_reload(state="warming", load_ms=round((loaded - start) * 1000, 1))
+        # a short synthetic pass, so the first real request doesn't pay the cold start
+        segments, _ = m.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language="en", vad_filter=False)
+        list(segments)
+        warm_ms = round((time.perf_counter() - loaded) * 1000, 1)
+        with model_lock:
+            old = model
+            model = m
+            MODEL_NAME, DEVICE, COMPUTE = new_model, new_dev, new_comp
+        # requests already running keep their reference, the old model is freed when they finish
+        del old
+        gc.collect()
+        _update_reload(state="ready", warm_ms=warm_ms, finished=time.time())
+        logger.info(f"Reloaded model={new_model} device={new_dev} compute={new_comp} warm_ms={warm_ms}")
+    except Exception as e:
+        logger.exception("Reload failed")
+        _update_reload(state="failed", error=str(e), finished=time.time())
+
 @app.post("/control/reload")
 def reload_model(cfg: ReloadConfig):
-    global model, MODEL_NAME, DEVICE, COMPUTE
     new_model = cfg.model or MODEL_NAME
     new_dev   = cfg.device or DEVICE
     new_comp  = cfg.compute or COMPUTE
 
     logger.info(f"Reload request: model={new_model} device={new_dev} compute={new_comp}")
-    with model_lock:
-        try:
-            m = WhisperModel(new_model, device=new_dev, compute_type=new_comp)
-            model = m
-            MODEL_NAME, DEVICE, COMPUTE = new_model, new_dev, new_comp
-        except Exception as e:
-            logger.exception("Reload failed")
-            return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
-    return {"ok": True, "model": MODEL_NAME, "device": DEVICE, "compute": COMPUTE}
+    with _reload_lock:
+        if _reload["state"] in ("loading", "warming"):
+            same = (_reload.get("model"), _reload.get("device"), _reload.get("compute")) == (new_model, new_dev, new_comp)
+            return JSONResponse(status_code=202 if same else 409, content={"ok": same, **_reload})
+        _reload.clear()
+        _reload.update(state="loading", model=new_model, device=new_dev, compute=new_comp, started=time.time())
+        status = dict(_reload)
+    Thread(target=_reload_worker, args=(new_model, new_dev, new_comp), name="stt-reload", daemon=True).start()
+    return JSONResponse(status_code=202, content={"ok": True, **status})
+
+# Progress of the last reload: idle, loading, warming, ready or failed
+@app.get("/control/reload")
+def reload_status():
+    return {"ok": True, "serving": {"model": MODEL_NAME, "device": DEVICE, "compute": COMPUTE}, **_reload_status()}